@@ -0,0 +1,359 @@
+"""Cached client for the TheMealDB and Yelp APIs.
+
+Every outbound API call goes through the module level `api` client. Responses
+are cached in two tiers:
+
+- an in-process LRU cache with a TTL per entry
+- a SQLite file shared by every gunicorn worker on the host
+
+Each endpoint has a (fresh, stale) TTL pair. A fresh entry is served as is. A
+stale entry is served right away and refreshed in a background thread
+(stale-while-revalidate), and it is also served if the upstream call fails.
+
+Misses are coalesced: only one upstream call per key is in flight in a worker,
+concurrent callers wait for it and share its result. With
+API_CACHE_WORKER_LOCK=1 a lock row in the shared tier extends this across
+workers, the other workers wait for the entry to appear in the shared tier.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import requests
+
+from http_client import http
+
+
+#(fresh seconds, stale seconds) by endpoint, matched against the end of the url
+ENDPOINT_TTLS = {
+    "list.php": (24*3600, 7*24*3600),
+    "filter.php": (24*3600, 7*24*3600),
+    "lookup.php": (24*3600, 7*24*3600),
+    "search.php": (3600, 24*3600),
+    "random.php": (0, 0),
+    "businesses/search": (10*60, 3600),
+}
+
+DEFAULT_TTL = (60, 10*60)
+
+CACHE_PATH = os.environ.get('API_CACHE_PATH', os.path.join(tempfile.gettempdir(), "food-roulette-api-cache.sqlite3"))
+CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', 1024))
+WORKER_LOCK = os.environ.get('API_CACHE_WORKER_LOCK', '0') == '1'
+#how long a worker may hold the load lock of a key, and how often the others check on it
+LOCK_TTL = float(os.environ.get('API_CACHE_LOCK_TTL', 15))
+LOCK_POLL = 0.05
+
+
+class LRUCache:
+    """Thread safe in-process LRU cache of (value, fresh_until, stale_until) entries."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the (value, fresh_until, stale_until) entry or None if missing or expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, fresh_until, stale_until):
+        with self.lock:
+            self.entries[key] = (value, fresh_until, stale_until)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCache:
+    """Cache tier stored in a SQLite file, shared by all worker processes on the host."""
+
+    #expired rows are purged every PURGE_EVERY writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS api_cache (
+                                        key TEXT PRIMARY KEY,
+                                        value TEXT NOT NULL,
+                                        fresh_until REAL NOT NULL,
+                                        stale_until REAL NOT NULL)""")
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS api_locks (
+                                        key TEXT PRIMARY KEY,
+                                        expires REAL NOT NULL)""")
+
+    def _connection(self):
+        """One connection per thread, sqlite3 connections can't be shared between threads."""
+
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def reset(self):
+        """Open new connections on next use, used after a fork so workers don't share the master's connection.
+
+        The inherited connection is dropped without closing it, closing it in
+        the child would run SQLite's cleanup on files the master still uses.
+        """
+
+        self.local = threading.local()
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, fresh_until, stale_until FROM api_cache WHERE key=? AND stale_until>=?",
+                                         (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]), row[1], row[2])
+
+    def set(self, key, value, fresh_until, stale_until):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO api_cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), fresh_until, stale_until))
+
+        self.writes += 1
+        if self.writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM api_cache WHERE stale_until<?", (time.time(),))
+
+    def acquire(self, key, ttl=LOCK_TTL):
+        """Take the cross-worker load lock of key, True if we got it. Locks expire after ttl seconds."""
+
+        conn = self._connection()
+        now = time.time()
+        conn.execute("DELETE FROM api_locks WHERE key=? AND expires<?", (key, now))
+        return conn.execute("INSERT OR IGNORE INTO api_locks (key, expires) VALUES (?, ?)", (key, now+ttl)).rowcount == 1
+
+    def release(self, key):
+        self._connection().execute("DELETE FROM api_locks WHERE key=?", (key,))
+
+    def locked(self, key):
+        return self._connection().execute("SELECT 1 FROM api_locks WHERE key=? AND expires>=?",
+                                          (key, time.time())).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM api_cache").fetchone()[0]
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers of the same key wait and share its result."""
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return (result of fn, True if it came from another caller's call)."""
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class CachedClient:
+    """JSON GET client with a local and a shared cache tier."""
+
+    COUNTERS = ("local_hits", "shared_hits", "stale_hits", "misses", "coalesced", "worker_coalesced",
+                "uncached", "refreshes", "errors")
+
+    def __init__(self, local=None, shared=None, ttls=ENDPOINT_TTLS, worker_lock=WORKER_LOCK):
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self.ttls = ttls
+        self.worker_lock = worker_lock and shared is not None
+        self.flight = SingleFlight()
+
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.counters_lock = threading.Lock()
+
+        self.refreshing = set()
+        self.refreshing_lock = threading.Lock()
+
+    def ttl_for(self, url):
+        """(fresh, stale) TTL of the endpoint of url."""
+
+        for endpoint, ttl in self.ttls.items():
+            if url.endswith(endpoint):
+                return ttl
+        return DEFAULT_TTL
+
+    @staticmethod
+    def cache_key(url, params=None):
+        """Cache key of a request. Headers are not part of the key, they only carry credentials."""
+
+        return f"{url}?{urlencode(sorted((params or {}).items()))}"
+
+    def count(self, counter):
+        with self.counters_lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        """Hit/miss counters of this worker plus the size of both tiers."""
+
+        with self.counters_lock:
+            stats = dict(self.counters)
+
+        lookups = stats["local_hits"]+stats["shared_hits"]+stats["stale_hits"]+stats["misses"]
+        stats["hit_ratio"] = round((lookups-stats["misses"])/lookups, 3) if lookups else None
+        stats["local_size"] = len(self.local)
+        stats["shared_size"] = len(self.shared) if self.shared is not None else None
+        return stats
+
+    def fetch_json(self, url, params=None, headers=None):
+        """Uncached GET, returns the decoded JSON body."""
+
+        resp = http.get(url, params=params, headers=headers)
+        resp.raise_for_status()
+        return resp.json()
+
+    def get_json(self, url, params=None, headers=None, key=None):
+        """Cached GET, returns the decoded JSON body.
+
+        key overrides the cache key, for callers that normalize their params.
+        """
+
+        fresh, stale = self.ttl_for(url)
+        if not fresh:
+            self.count("uncached")
+            return self.fetch_json(url, params, headers)
+
+        key = key or self.cache_key(url, params)
+        now = time.time()
+
+        entry = self.local.get(key)
+        tier = "local_hits"
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            tier = "shared_hits"
+            if entry is not None:
+                self.local.set(key, *entry)
+
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if fresh_until >= now:
+                self.count(tier)
+            else:
+                self.count("stale_hits")
+                self.refresh_in_background(key, url, params, headers)
+            return value
+
+        self.count("misses")
+        value, coalesced = self.flight.do(key, lambda: self.load_once(key, url, params, headers))
+        if coalesced:
+            self.count("coalesced")
+        return value
+
+    def load_once(self, key, url, params, headers):
+        """load(), but with the worker lock only one worker calls upstream for key."""
+
+        if not self.worker_lock:
+            return self.load(key, url, params, headers)
+
+        if self.shared.acquire(key):
+            try:
+                return self.load(key, url, params, headers)
+            finally:
+                self.shared.release(key)
+
+        #another worker is loading it, wait for its entry while it holds the lock
+        deadline = time.time()+LOCK_TTL
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL)
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.count("worker_coalesced")
+                self.local.set(key, *entry)
+                return entry[0]
+            if not self.shared.locked(key):
+                break
+
+        #the other worker failed or gave up
+        return self.load(key, url, params, headers)
+
+    def load(self, key, url, params, headers):
+        """Fetch url and store the response in both tiers."""
+
+        fresh, stale = self.ttl_for(url)
+        try:
+            value = self.fetch_json(url, params, headers)
+        except (requests.RequestException, ValueError):
+            self.count("errors")
+            raise
+
+        now = time.time()
+        self.local.set(key, value, now+fresh, now+fresh+stale)
+        if self.shared is not None:
+            self.shared.set(key, value, now+fresh, now+fresh+stale)
+        return value
+
+    def refresh_in_background(self, key, url, params, headers):
+        """Revalidate a stale entry, at most one refresh per key at a time."""
+
+        with self.refreshing_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.load(key, url, params, headers)
+                self.count("refreshes")
+            except (requests.RequestException, ValueError):
+                #the stale entry keeps being served until it expires
+                pass
+            finally:
+                with self.refreshing_lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+api = CachedClient(shared=SQLiteCache())
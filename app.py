@@ -1,24 +1,26 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g,url_for,jsonify
+from flask import Flask, render_template, request, flash, redirect, session, g,url_for,jsonify,abort
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
-import requests
-import json
-from random import choice
-
+from api_client import api
+from favorites import apply_batch, like_meal, set_meals_active, set_restaurants_active
+from favorites import like_restaurant as like_restaurant_for_meal
+from feeds import load_feed
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, Cuisine, Category,Message,Meal,User,MealLiked,RestaurantMealLiked,Like
-from secrets import api_key
-
-
-headers = {'Authorization': 'Bearer %s' % api_key}
-
-yelp_url='https://api.yelp.com/v3/businesses/search'
-
-# In the dictionary, term can take values like food, cafes or businesses like McDonalds
-# params = {'term':'seafood','location':'New York City'}
+from meal_index import meal_index, ingredient_filter
+from models import db, connect_db, Cuisine, Category,Message,Meal,User,MealLiked,Restaurant,RestaurantMealLiked,Like,MealStats
+from prefetch import PrefetchQueue
+from recommender import recommender
+from replicas import init_app as route_to_replicas, replica_binds
+from sampler import sampler
+from seen import seen
+from search import search_meals
+from sql_budget import budget, init_app as count_statements
+from user_cache import CurrentUser, UserGone, user_cache
+from yelp import search_restaurants
 
 
 CURR_USER_KEY = "curr_user"
@@ -30,13 +32,38 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///food-roulette-db').replace("postgres://", "postgresql://", 1))
 
+# Read replicas for GET requests (comma separated), see replicas.py
+app.config['SQLALCHEMY_BINDS'] = replica_binds(os.environ.get('DATABASE_REPLICA_URLS', ''))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Outbound APIs. API_BACKEND=fake points both at the local stand-in (see fake_apis.py)
+app.config['MEALDB_URL'] = os.environ.get('MEALDB_URL', "http://www.themealdb.com/api/json/v1/1")
+app.config['YELP_URL'] = os.environ.get('YELP_URL', "https://api.yelp.com/v3/businesses/search")
+if os.environ.get('API_BACKEND') == 'fake':
+    fake_apis_url = os.environ.get('FAKE_APIS_URL', "http://127.0.0.1:5001")
+    app.config['MEALDB_URL'] = f"{fake_apis_url}/api/json/v1/1"
+    app.config['YELP_URL'] = f"{fake_apis_url}/v3/businesses/search"
+
+# /cache-stats shows internal cache counters, served only when this is set or in debug mode
+app.config['CACHE_STATS'] = os.environ.get('CACHE_STATS') == '1'
+
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+#statement counts and budgets of each request, see sql_budget.py
+count_statements(app)
+route_to_replicas(app)
+
+#next roulette meals of each user, see prefetch.py
+prefetch=PrefetchQueue(app)
+#meals each user was shown, written in the background, see seen.py
+seen.init_app(app)
+#full recommender rebuilds run off the request, see recommender.py
+recommender.init_app(app)
 
 ##############################################################################
 # User signup/login/logout
@@ -45,10 +72,13 @@ connect_db(app)
 #Before any request it works
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    It is loaded lazily, see user_cache.py.
+    """
     
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser(session[CURR_USER_KEY])
     else:
         g.user = None
 
@@ -67,6 +97,7 @@ def do_logout():
 
 
 @app.route('/signup', methods=["GET", "POST"])
+@budget(4)
 def signup():
     """Handle user signup.
 
@@ -115,6 +146,7 @@ def signup():
 
 
 @app.route('/login', methods=["GET", "POST"])
+@budget(3)
 def login():
     """Handle user login."""
     if not g.user:
@@ -136,6 +168,7 @@ def login():
         return redirect("/")
 
 @app.route('/logout')
+@budget(2)
 def logout():
     """Handle logout of user."""
 
@@ -149,47 +182,84 @@ def logout():
 
 ##############################################################################
 
+def feed_page(query):
+    """Feed page of a Message query for g.user, starting at the 'cursor' query param (see feeds.py)."""
+
+    try:
+        return load_feed(query,g.user.id,request.args.get("cursor"))
+    except ValueError:
+        abort(400)
+
+def ingredient_filters():
+    """IngredientFilter from the 'include' and 'exclude' query params (comma separated), None without them."""
+
+    return ingredient_filter(request.args.getlist("include"),request.args.getlist("exclude"))
+
+def favorites_changed(user_id,meal_ids):
+    """Bring the roulette up to date after a committed change to the user's favorite meals."""
+
+    recommender.sync_user(user_id)
+    #the user's tables skip their favorites, and the meals' popularity moved
+    sampler.forget_user(user_id)
+    sampler.meals_changed(meal_ids)
+    #prefetched spins were drawn from the old tables, dropped last so refills draw from the new ones
+    prefetch.invalidate(user_id)
+
 ####search bar
 @app.route('/meals')
+@budget(5)
 def list_meals():
     """Page with listing of meals.
 
-    Can take a 'q' param in querystring to search by that meal.
+    Can take a 'q' param in querystring to search meal, cuisine, category
+    and ingredient names (see search.py), 'include'/'exclude' params to
+    filter by ingredients and a 'page' param.
     """
     search = request.args.get('q')
+    filters = ingredient_filters()
+    page = max(request.args.get('page',1,type=int),1)
 
-    if not search:
-        meals = Meal.query.all()
-    else:
-        meals = Meal.query.filter(Meal.meal_name.ilike(f"%{search.strip()}%")).all()
+    query = Meal.query
+    if filters:
+        query = query.filter(Meal.id.in_(meal_index.ids("surprise",filters=filters) or [0]))
+    results = search_meals(search or "",page,query=query)
     
-    return render_template('meals/list_meals.html', meals=meals,search=search)
+    return render_template('meals/list_meals.html', meals=results.items,results=results,search=search,filters=filters)
+
+@app.route('/meals/autocomplete')
+@budget(4)
+def autocomplete_meals():
+    """Meal names starting with the 'q' param (or with a later word of it), from memory.
+
+    Takes an optional 'limit' param, at most 20.
+    """
+    limit = min(max(request.args.get('limit',8,type=int),1),20)
+    suggestions = meal_index.complete(request.args.get('q',''),limit)
+
+    return jsonify({"meals":[{"id":meal_id,"name":name} for name,meal_id in suggestions]})
 
 @app.route('/meals/<int:meal_id>')
+@budget(9)
 def show_meal(meal_id):
     """Show single meal"""
     
     meal=Meal.query.get_or_404(meal_id)
 
-    
-    ingredientKeys=["strIngredient"+str(i) for i in range(1,21)]
+    ingredientList=meal.ingredient_names
 
-    detailed_meal_info=requests.get("http://www.themealdb.com/api/json/v1/1/search.php",params={"s":meal.meal_name}).json()
-    
-    ingredientList=[]
-    for i in ingredientKeys:
-        detailed_meal_info["meals"][0].get(i)
-        if detailed_meal_info["meals"][0].get(i):
-            ingredientList.append(detailed_meal_info["meals"][0].get(i))
+    stats=MealStats.query.get(meal.id)
+    top_restaurants=MealStats.top_restaurants(meal.id)
 
     if not g.user:
-        return render_template('meals/single_meal.html', meal=meal,ingredients=ingredientList)
+        return render_template('meals/single_meal.html', meal=meal,ingredients=ingredientList,stats=stats,top_restaurants=top_restaurants)
     else:
 
         user_liked_meal=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==meal.id).first()
-        return render_template('meals/single_meal.html', meal=meal,ingredients=ingredientList,user_liked_meal=user_liked_meal)
+        return render_template('meals/single_meal.html', meal=meal,ingredients=ingredientList,user_liked_meal=user_liked_meal,
+                               stats=stats,top_restaurants=top_restaurants)
 
 @app.route('/meals/<int:meal_id>/reviews')
+@budget(8)
 def check_reviews(meal_id):
     """Show reviews of a meal"""
     if not g.user:
@@ -199,18 +269,13 @@ def check_reviews(meal_id):
 
         meal=Meal.query.get_or_404(meal_id)
 
-        meals_liked_ids=[i[0] for i in MealLiked.query.with_entities(MealLiked.id).filter(MealLiked.meal_id==meal_id).all()]
-
-        messages=Message.query.filter(Message.meals_liked_id.in_(meals_liked_ids)).all()
-        
+        feed=feed_page(Message.query.join(MealLiked,Message.meals_liked_id==MealLiked.id).filter(MealLiked.meal_id==meal_id))
 
-        a=RestaurantMealLiked.query.with_entities(RestaurantMealLiked.restaurant_yelp_id,RestaurantMealLiked.restaurant_name).all()
-
-        d={yelp:name for yelp,name in a}
-
-        return render_template('meals/check_reviews.html',messages=messages, meal=meal,d=d)
+        return render_template('meals/check_reviews.html',feed=feed,meal=meal,
+                               stats=MealStats.query.get(meal_id),top_restaurants=MealStats.top_restaurants(meal_id))
 
 @app.route("/cuisines")
+@budget(4)
 def show_cuisines():
     """Shows cuisine list."""
     if not g.user:
@@ -222,6 +287,7 @@ def show_cuisines():
         return render_template("cuisines/cuisines.html",cuisines=cuisines)
 
 @app.route("/cuisines/<int:cuisine_id>")
+@budget(14)
 def show_cuisine(cuisine_id):
     """Shows random meal from selected cuisine"""
 
@@ -229,31 +295,20 @@ def show_cuisine(cuisine_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     else:
-        cuisine=Cuisine.query.filter(Cuisine.cuisine_id==cuisine_id).first().cuisine_name
-        
-        ### meal database request
-        meal_list=requests.get("http://www.themealdb.com/api/json/v1/1/filter.php",params={"a":cuisine})
-        random_meal=choice(meal_list.json()["meals"])
-        #meal_object
-        meal_object=Meal.query.filter(Meal.meal_name==random_meal["strMeal"]).first()
-
-        ####it is going to be used to check soft deletes: user_liked_meal.is_active
-        user_liked_meal=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==meal_object.id).first()
-        
-        ingredientKeys=["strIngredient"+str(i) for i in range(1,21)]
-
-        detailed_meal_info=requests.get("http://www.themealdb.com/api/json/v1/1/lookup.php",params={"i":random_meal["idMeal"]}).json()
-        ingredientList=[]
-        for i in ingredientKeys:
-            detailed_meal_info["meals"][0].get(i)
-            if detailed_meal_info["meals"][0].get(i):
-                ingredientList.append(detailed_meal_info["meals"][0].get(i))
+        #meals come from the local catalog mirror (see catalog.py), prefetched per user (see prefetch.py)
+        filters=ingredient_filters()
+        spin=prefetch.next(g.user.id,"cuisine",cuisine_id,filters)
+        if spin is None and filters:
+            flash("No meals match those ingredients.", "warning")
+            return redirect(f"/cuisines/{cuisine_id}")
+        if spin is None:
+            abort(404)
 
-        ##### meal=random_meal for meal photo
-        return render_template("cuisines/random_meal_by_cuisine.html",user_liked_meal=user_liked_meal,ingredients=ingredientList,meal=random_meal,id=cuisine_id,meal_object=meal_object)
+        return render_template("cuisines/random_meal_by_cuisine.html",user_liked_meal=spin.user_liked_meal,ingredients=spin.ingredients,id=cuisine_id,meal_object=spin.meal_object,filters=filters)
 
 
 @app.route("/categories")
+@budget(4)
 def show_categories():
     """Shows category list."""
     if not g.user:
@@ -267,6 +322,7 @@ def show_categories():
 
 
 @app.route("/categories/<int:category_id>")
+@budget(14)
 def show_category(category_id):
     """Shows random meal from selected category"""
     if not g.user:
@@ -274,29 +330,18 @@ def show_category(category_id):
         return redirect("/")
     else:
 
-        category=Category.query.filter(Category.category_id==category_id).first().category_name
-
-        meal_list=requests.get("http://www.themealdb.com/api/json/v1/1/filter.php",params={"c":category})
-        random_meal=choice(meal_list.json()["meals"])
-
-        meal_object=Meal.query.filter(Meal.meal_name==random_meal["strMeal"]).first()
-
-        ####it is going to be used to check soft deletes: user_liked_meal.is_active
-        user_liked_meal=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==meal_object.id).first()
-
-        ingredientKeys=["strIngredient"+str(i) for i in range(1,21)]
-
-        detailed_meal_info=requests.get("http://www.themealdb.com/api/json/v1/1/lookup.php",params={"i":random_meal["idMeal"]}).json()
-        ingredientList=[]
-        for i in ingredientKeys:
-            detailed_meal_info["meals"][0].get(i)
-            if detailed_meal_info["meals"][0].get(i):
-                ingredientList.append(detailed_meal_info["meals"][0].get(i))
+        filters=ingredient_filters()
+        spin=prefetch.next(g.user.id,"category",category_id,filters)
+        if spin is None and filters:
+            flash("No meals match those ingredients.", "warning")
+            return redirect(f"/categories/{category_id}")
+        if spin is None:
+            abort(404)
         
-        ##### meal=random_meal for meal photo
-        return render_template("categories/random_meal_by_category.html",user_liked_meal=user_liked_meal,ingredients=ingredientList,meal=random_meal,id=category_id,meal_object=meal_object)
+        return render_template("categories/random_meal_by_category.html",user_liked_meal=spin.user_liked_meal,ingredients=spin.ingredients,id=category_id,meal_object=spin.meal_object,filters=filters)
 
 @app.route("/surprise-me")
+@budget(14)
 def show_surprise_meal():
     """Show random meal from all meals"""
     if not g.user:
@@ -304,25 +349,39 @@ def show_surprise_meal():
         return redirect("/")
     else:
 
-        random_meal=requests.get("http://www.themealdb.com/api/json/v1/1/random.php")
-        meal=random_meal.json()["meals"][0]
-        meal_object=Meal.query.filter(Meal.meal_name==meal["strMeal"]).first()
-
-        ####it is going to be used to check soft deletes: user_liked_meal.is_active
-        user_liked_meal=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==meal_object.id).first()
-
-        ingredientKeys=["strIngredient"+str(i) for i in range(1,21)]
+        filters=ingredient_filters()
+        spin=prefetch.next(g.user.id,"surprise",None,filters)
+        if spin is None and filters:
+            flash("No meals match those ingredients.", "warning")
+            return redirect("/surprise-me")
+        if spin is None:
+            abort(404)
+
+        return render_template("surprise_me.html",user_liked_meal=spin.user_liked_meal,ingredients=spin.ingredients,meal_object=spin.meal_object,filters=filters,
+                               spin_url="/surprise-me")
+
+@app.route("/for-you")
+@budget(14)
+def show_for_you_meal():
+    """Show a meal drawn from the user's recommendations (see recommender.py), weighted by how well it fits their favorites"""
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    else:
 
-        detailed_meal_info=requests.get("http://www.themealdb.com/api/json/v1/1/lookup.php",params={"i":meal["idMeal"]}).json()
-        ingredientList=[]
-        for i in ingredientKeys:
-            detailed_meal_info["meals"][0].get(i)
-            if detailed_meal_info["meals"][0].get(i):
-                ingredientList.append(detailed_meal_info["meals"][0].get(i))
+        filters=ingredient_filters()
+        spin=prefetch.next(g.user.id,"for-you",None,filters)
+        if spin is None and filters:
+            flash("No meals match those ingredients.", "warning")
+            return redirect("/for-you")
+        if spin is None:
+            abort(404)
 
-        return render_template("surprise_me.html",user_liked_meal=user_liked_meal,ingredients=ingredientList,meal=meal,meal_object=meal_object)
+        return render_template("surprise_me.html",user_liked_meal=spin.user_liked_meal,ingredients=spin.ingredients,meal_object=spin.meal_object,filters=filters,
+                               spin_url="/for-you")
 
 @app.route("/like-it/<meal_name>",methods=["POST"])
+@budget(16)
 def show_like_it(meal_name):
     """Like meal"""
     if not g.user:
@@ -332,22 +391,18 @@ def show_like_it(meal_name):
 
         address=request.form["address"] or g.user.location
 
-        liked_meal=Meal.query.filter(Meal.meal_name==meal_name).first()
+        liked_meal=Meal.query.filter(Meal.meal_name==meal_name).first_or_404()
 
-        #Checks for soft deleted entries
-        checks_soft_deleted_meal_liked=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==liked_meal.id,MealLiked.is_active==False).first()
-        ##if the meal in the database but it is inactive, this block is going to change its status
-        if checks_soft_deleted_meal_liked:
-            checks_soft_deleted_meal_liked.is_active=True
-            
-        ##else meal going to be added to meals_liked table
-        else:
-            g.user.meals_liked_list.append(liked_meal)
+        ##adds the meal to meals_liked table, or reactivates it if it was soft deleted, in one statement
+        like_meal(g.user.id,liked_meal.id)
         db.session.commit()
+
+        favorites_changed(g.user.id,[liked_meal.id])
         
         return redirect(url_for("show_restaurants_new_meal",meal_name=liked_meal.meal_name,address=address))
 
 @app.route("/like-it/<meal_name>/restaurants/<address>")
+@budget(5)
 def show_restaurants_new_meal(meal_name,address):
     """Show restaurant list based on the selected meal and the address"""
     if not g.user:
@@ -357,7 +412,7 @@ def show_restaurants_new_meal(meal_name,address):
 
 
         liked_meal=Meal.query.filter(Meal.meal_name==meal_name).first()
-        restaurants=requests.get(yelp_url,headers=headers,params={"location":address,"term":meal_name}).json()
+        restaurants=search_restaurants(meal_name,address)
     
 
         meal_liked=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==liked_meal.id).first()
@@ -373,6 +428,7 @@ def show_restaurants_new_meal(meal_name,address):
 
 
 @app.route("/show-it/<meal_name>/restaurants")
+@budget(5)
 def show_restaurants_existing_meal(meal_name):
     """Show restaurant list if the meal is already liked"""
 
@@ -384,7 +440,7 @@ def show_restaurants_existing_meal(meal_name):
         address=request.args["address"] or g.user.location
         
         liked_meal=Meal.query.filter(Meal.meal_name==meal_name).first()
-        restaurants=requests.get(yelp_url,headers=headers,params={"location":address,"term":meal_name}).json()
+        restaurants=search_restaurants(meal_name,address)
         
         meal_liked=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==liked_meal.id).first()
 
@@ -400,6 +456,7 @@ def show_restaurants_existing_meal(meal_name):
 #####################################################################33#######
 #Restaurant
 @app.route("/restaurant/like-it",methods=["POST"])
+@budget(11)
 def like_restaurant():
     """Like restaurant_meal"""
     if not g.user:
@@ -416,54 +473,35 @@ def like_restaurant():
         restaurant_url=request.form["restaurant_url"]
         photo=request.form["photo"]
 
+        #only for the user's own liked meals, as in the batch API (see favorites.add_restaurants)
+        MealLiked.query.filter(MealLiked.id==meals_liked_id,MealLiked.user_id==g.user.id).first_or_404()
 
-        checks_soft_deleted_restaurant_liked=RestaurantMealLiked.query.filter(RestaurantMealLiked.user_id==g.user.id,
-                                                                            RestaurantMealLiked.restaurant_yelp_id==yelp_id,
-                                                                            RestaurantMealLiked.meals_liked_id==meals_liked_id,
-                                                                            RestaurantMealLiked.is_active==False).first()
-        if checks_soft_deleted_restaurant_liked:
-            checks_soft_deleted_restaurant_liked.is_active=True
-            db.session.commit()
-        else:
-            try:
-
-                restaurant_meal=RestaurantMealLiked(restaurant_name=restaurant_name,
-                                                    restaurant_yelp_id=yelp_id,
-                                                    meals_liked_id=meals_liked_id,
-                                                    restaurant_address=address,
-                                                    restaurant_rating=rating,
-                                                    restaurant_url=restaurant_url,
-                                                    restaurant_photo=photo,
-                                                    user_id=g.user.id
-                )
-
-                db.session.add(restaurant_meal)
-                db.session.commit()
-
-            except IntegrityError:
-                db.session.rollback()
+        ##stores the restaurant unless it is stored already, then adds it for the meal, or reactivates it if it was soft deleted
+        try:
+            Restaurant.save(yelp_id,restaurant_name,address,rating,restaurant_url,photo)
+        except ValueError:
+            abort(400)
+        like_restaurant_for_meal(g.user.id,meals_liked_id,yelp_id)
+        db.session.commit()
     
         return redirect(request.referrer)
 #************************************************************************************************************************
 @app.route("/restaurant/<restaurant_yelp_id>/unlink-restaurant-meal/<int:meal_liked_id>",methods=["POST"])
+@budget(8)
 def unlink_restaurant_meal(restaurant_yelp_id,meal_liked_id):
     """Unlink single meal restaurant relationship"""
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     else:
-        user_restaurant=RestaurantMealLiked.query.filter(RestaurantMealLiked.restaurant_yelp_id==restaurant_yelp_id
-        ,RestaurantMealLiked.user_id==g.user.id
-        ,RestaurantMealLiked.meals_liked_id==meal_liked_id).all()
-            
-        for entry in user_restaurant:
-            entry.is_active=False
+        set_restaurants_active(g.user.id,[{"yelp_id":restaurant_yelp_id,"meals_liked_id":meal_liked_id}],False)
         db.session.commit()
 
         return redirect(request.referrer)
 
 #************************************************************************************************************************
 @app.route("/restaurant/remove-it/<restaurant_yelp_id>",methods=["POST"])
+@budget(8)
 def remove_restaurant(restaurant_yelp_id):
     """complete removal of restaurant (for all meals) from like list, soft-deletes it"""
     if not g.user:
@@ -472,13 +510,11 @@ def remove_restaurant(restaurant_yelp_id):
     else:
 
 
-        user_restaurant=RestaurantMealLiked.query.filter(RestaurantMealLiked.restaurant_yelp_id==restaurant_yelp_id,RestaurantMealLiked.user_id==g.user.id).all()
         #Soft delete for user like restaurants
 
         #yelp_id and user_id together are not unique identifiers for this table. Users may get more than one dish at the same restaurant
-        #That's why potentially we will have multiple rows in our restaurants_meals_liked table
-        for entry in user_restaurant:
-            entry.is_active=False
+        #That's why potentially we will have multiple rows in our restaurants_meals_liked table, one UPDATE covers them all
+        set_restaurants_active(g.user.id,[{"yelp_id":restaurant_yelp_id}],False)
         db.session.commit()
 
         return redirect(request.referrer)
@@ -488,6 +524,7 @@ def remove_restaurant(restaurant_yelp_id):
 
 
 @app.route("/meals-liked/remove-it/<meal_id>",methods=["POST"])
+@budget(14)
 def remove_meal_from_fav_list(meal_id):
     """remove meal from the fav list, soft deletes it"""
     if not g.user:
@@ -495,19 +532,43 @@ def remove_meal_from_fav_list(meal_id):
         return redirect("/")
     else:
 
-        #Selects the meal to removed
-        meal_liked=MealLiked.query.filter(MealLiked.meal_id==meal_id,MealLiked.user_id==g.user.id).first()
         #Soft deletes it
-        meal_liked.is_active=False
+        set_meals_active(g.user.id,[int(meal_id)],False)
         
         db.session.commit()
+        favorites_changed(g.user.id,[int(meal_id)])
 
         return redirect(request.referrer)
 
+@app.route("/favorites/batch",methods=["POST"])
+@budget(24)
+def batch_favorites():
+    """Add, remove and restore many meal and restaurant favorites in one transaction (see favorites.py).
+
+    Returns the number of rows each change touched.
+    """
+    if not g.user:
+        return jsonify({"error":"Access unauthorized."}),401
+
+    batch=request.get_json(silent=True)
+    try:
+        changed=apply_batch(g.user.id,batch)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error":str(e)}),400
+
+    db.session.commit()
+    if any(changed["meals"].values()):
+        meals=batch["meals"]
+        favorites_changed(g.user.id,[meal_id for action in meals for meal_id in meals[action]])
+
+    return jsonify(changed)
+
 ##############################################################################
 # Messages routes:
 
 @app.route('/messages/new', methods=["GET", "POST"])
+@budget(8)
 def messages_add():
     """Add a message:
 
@@ -519,13 +580,15 @@ def messages_add():
         return redirect("/")
 
     #unique restaurants by yelp_id
-    restaurant_list=db.session.query(RestaurantMealLiked.restaurant_yelp_id,RestaurantMealLiked.restaurant_name).filter(RestaurantMealLiked.user_id==g.user.id).distinct()
+    restaurant_list=(db.session.query(Restaurant.yelp_id,Restaurant.name)
+                     .join(RestaurantMealLiked,RestaurantMealLiked.restaurant_yelp_id==Restaurant.yelp_id)
+                     .filter(RestaurantMealLiked.user_id==g.user.id).distinct().all())
 
     form = MessageForm()
     
     form.meal.choices=[(meal.id,meal.meal_name)for meal in g.user.meals_liked_list]
     form.meal.choices.insert(0,("",""))
-    form.restaurant.choices=[(restaurant.restaurant_yelp_id,restaurant.restaurant_name) for restaurant in restaurant_list ]
+    form.restaurant.choices=[(restaurant.yelp_id,restaurant.name) for restaurant in restaurant_list ]
     form.restaurant.choices.insert(0,("",""))
 
 
@@ -533,7 +596,10 @@ def messages_add():
 
         meals_liked_id=MealLiked.query.filter(MealLiked.user_id==g.user.id,MealLiked.meal_id==int(form.meal.data)).first().id
 
-        msg = Message(text=form.text.data,restaurant_info=form.restaurant.data,meals_liked_id=meals_liked_id)
+        #only one of the user's restaurants, anything else (e.g. "No Restaurant Selected") is no restaurant
+        restaurant_info=form.restaurant.data if form.restaurant.data in {restaurant.yelp_id for restaurant in restaurant_list} else None
+
+        msg = Message(text=form.text.data,restaurant_info=restaurant_info,meals_liked_id=meals_liked_id)
         g.user.messages.append(msg)
         db.session.commit()
         
@@ -545,6 +611,7 @@ def messages_add():
 
 #####For Dynamic WTF forms
 @app.route("/restaurants/<int:meal_id>")
+@budget(3)
 def restaurants_meals(meal_id):
 
     if not g.user:
@@ -572,6 +639,7 @@ def restaurants_meals(meal_id):
 
 
 @app.route('/users/<int:user_id>/messages', methods=["GET"])
+@budget(6)
 def messages_show(user_id):
     """Show a message."""
     if not g.user:
@@ -580,19 +648,15 @@ def messages_show(user_id):
     else:
 
         user=User.query.get_or_404(user_id)
-        messages = Message.query.filter(Message.user_id==user.id).all()
+        feed=feed_page(Message.query.filter(Message.user_id==user.id))
 
-        a=RestaurantMealLiked.query.with_entities(RestaurantMealLiked.restaurant_yelp_id,RestaurantMealLiked.restaurant_name).all()
+        total_reviews=Message.query.filter(Message.user_id==user.id).count()
 
-        d={yelp:name for yelp,name in a}
-
-
-        total_likes=sum([len(message.user_likes) for message in messages])
-        
-        return render_template('users/show.html', messages=messages,user=user,d=d,total_likes=total_likes)
+        return render_template('users/show.html',feed=feed,user=user,total_reviews=total_reviews,total_likes=user.likes_received)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@budget(6)
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -612,6 +676,7 @@ def messages_destroy(message_id):
 #users
 
 @app.route('/users/profile', methods=["GET", "POST"])
+@budget(8)
 def update_profile():
     """Update profile for current user."""
 
@@ -645,6 +710,7 @@ def update_profile():
             user.location=form.location.data
 
             db.session.commit()
+            user_cache.invalidate(user.id)
 
             return redirect(f"/users/{g.user.id}")
 
@@ -655,6 +721,7 @@ def update_profile():
     return render_template('users/edit.html', form=form)
 
 @app.route('/users/delete', methods=["POST"])
+@budget(12)
 def delete_user():
     """Delete user."""
 
@@ -664,13 +731,15 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(g.user.instance)
     db.session.commit()
+    user_cache.invalidate(g.user.id)
 
     return redirect("/signup")
 
 
 @app.route("/users/<int:user_id>")
+@budget(5)
 def show_user(user_id):
 
     if not g.user:
@@ -680,12 +749,16 @@ def show_user(user_id):
         user=User.query.get_or_404(user_id)
 
         
-        return render_template("users/user_profile.html",user=user,messages=user.messages)
+        #meals of all the messages in one query, the template shows each one
+        messages=Message.query.options(joinedload(Message.meal_liked).joinedload(MealLiked.meal)).filter(Message.user_id==user.id).all()
+
+        return render_template("users/user_profile.html",user=user,messages=messages)
 
 
     #fav lists
 
 @app.route("/users/<int:user_id>/liked-food")
+@budget(5)
 def show_liked_meals(user_id):
 
     #check meals in the fav list
@@ -694,13 +767,14 @@ def show_liked_meals(user_id):
         return redirect("/")
     else:
 
-        meal_list=[liked_meal.meal for liked_meal in MealLiked.query.filter(MealLiked.user_id==user_id,MealLiked.is_active==True).all()]
+        meal_list=[liked_meal.meal for liked_meal in MealLiked.query.options(joinedload(MealLiked.meal)).filter(MealLiked.user_id==user_id,MealLiked.is_active==True).all()]
         user=User.query.get_or_404(user_id)
 
         return render_template("users/user_liked_food.html",meals=meal_list,user=user)
 
 
 @app.route("/users/<int:user_id>/liked-food/<int:meal_id>")
+@budget(5)
 def show_liked_meal_detail(user_id,meal_id):
 
     if not g.user:
@@ -718,6 +792,7 @@ def show_liked_meal_detail(user_id,meal_id):
 
 
 @app.route("/users/<int:user_id>/liked-restaurants")
+@budget(4)
 def show_liked_restaurants(user_id):
 
     if not g.user:
@@ -728,12 +803,14 @@ def show_liked_restaurants(user_id):
         user=User.query.get_or_404(user_id)
 
 
-        restaurant_list=db.session.query(RestaurantMealLiked.restaurant_yelp_id,RestaurantMealLiked.restaurant_name,RestaurantMealLiked.restaurant_url,RestaurantMealLiked.restaurant_photo).filter(RestaurantMealLiked.user_id==user_id,RestaurantMealLiked.is_active==True).distinct()
+        liked_yelp_ids=db.session.query(RestaurantMealLiked.restaurant_yelp_id).filter(RestaurantMealLiked.user_id==user_id,RestaurantMealLiked.is_active==True)
+        restaurant_list=Restaurant.query.filter(Restaurant.yelp_id.in_(liked_yelp_ids)).all()
         
         return render_template("users/user_liked_restaurants.html",restaurants=restaurant_list,user=user)
 
 
 @app.route("/users/<int:user_id>/liked-restaurants/<yelp_id>")
+@budget(4)
 def show_liked_restaurants_details(user_id,yelp_id):
 
     if not g.user:
@@ -742,7 +819,7 @@ def show_liked_restaurants_details(user_id,yelp_id):
     else:
         user=User.query.get_or_404(user_id)
 
-        restaurants=RestaurantMealLiked.query.filter(RestaurantMealLiked.user_id==user_id,RestaurantMealLiked.restaurant_yelp_id==yelp_id,RestaurantMealLiked.is_active==True).all()
+        restaurants=RestaurantMealLiked.query.options(joinedload(RestaurantMealLiked.meal_liked).joinedload(MealLiked.meal)).filter(RestaurantMealLiked.user_id==user_id,RestaurantMealLiked.restaurant_yelp_id==yelp_id,RestaurantMealLiked.is_active==True).all()
 
         if len(restaurants)==0:
             return redirect(f"/users/{user.id}/liked-restaurants")
@@ -759,6 +836,7 @@ def show_liked_restaurants_details(user_id,yelp_id):
 # Likes routes:
 
 @app.route("/users/add_like/<int:message_id>",methods=['POST'])
+@budget(8)
 def add_like(message_id):
     """Add & Remove Like"""
     if not g.user:
@@ -768,18 +846,14 @@ def add_like(message_id):
     msg=Message.query.get_or_404(message_id)
 
     if msg.user_id!=g.user.id:
-        if g.user in msg.user_likes:
-            g.user.likes.remove(msg)
-        
-        else:
-            g.user.likes.append(msg)
-
+        Like.toggle(g.user.id,msg.id)
         db.session.commit()
     
         
     return redirect(request.referrer)
 
 @app.route("/users/<int:user_id>/liked-messages")
+@budget(5)
 def show_liked_messages(user_id):
 
     if not g.user:
@@ -789,39 +863,56 @@ def show_liked_messages(user_id):
 
         user=User.query.get_or_404(user_id)
 
-        messages=user.likes
-        a=RestaurantMealLiked.query.with_entities(RestaurantMealLiked.restaurant_yelp_id,RestaurantMealLiked.restaurant_name).all()
-
-        d={yelp:name for yelp,name in a}
+        feed=feed_page(Message.query.join(Like,Like.message_id==Message.id).filter(Like.user_id==user.id))
         
-        return render_template("users/user_liked_messages.html",messages=messages,user=user,d=d)
+        return render_template("users/user_liked_messages.html",feed=feed,user=user)
 
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/')
+@budget(5)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages, a page at a time
     """
 
     if g.user:
         
-        messages=Message.query.all()
-        return render_template('home.html', messages=messages)
+        feed=feed_page(Message.query)
+
+        return render_template('home.html',feed=feed)
 
     else:
         return render_template('home-anon.html')
 
+@app.route('/cache-stats')
+@budget(1)
+def cache_stats():
+    """Hit/miss counters of the API cache of this worker, when CACHE_STATS is set or in debug mode."""
+
+    if not (app.config['CACHE_STATS'] or app.debug):
+        abort(404)
+
+    return jsonify(api.stats())
+
 @app.errorhandler(404)
 def page_not_found(e):
     """404 page"""
     # note that we set the 404 status explicitly
     return render_template('error_page.html'), 404
 
+@app.errorhandler(UserGone)
+def user_gone(e):
+    """The logged in user was deleted while g.user still looked logged in, see user_cache.py"""
+
+    do_logout()
+    flash("Access unauthorized.", "danger")
+    return redirect("/")
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -0,0 +1,87 @@
+"""Per-request latency of module level requests.get vs the pooled http client.
+
+Runs against a local stub server that answers like TheMealDB and adds a small
+delay to every new connection, standing in for the TCP/TLS handshake.
+
+run it from the project root like:
+
+    python benchmarks/bench_http_client.py [requests] [handshake_ms]
+"""
+
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import HTTPClient
+
+
+BODY = json.dumps({"meals": [{"strMeal": "Rock Cakes", "idMeal": "52971"}]}).encode()
+
+
+def make_handler(handshake_delay):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        #headers and body are separate writes, don't let Nagle hold the body back on kept-alive sockets
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            #runs once per connection, not once per request
+            time.sleep(handshake_delay)
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def timed(get, url, n):
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        get(url, params={"i": i}).json()
+        timings.append((time.perf_counter()-start)*1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings)*0.95)-1]
+    print(f"{name:<22} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main(n=500, handshake_ms=2.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(handshake_ms/1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/json/v1/1/lookup.php"
+
+    print(f"{n} sequential GETs, {handshake_ms} ms simulated handshake per new connection")
+
+    unpooled = timed(requests.get, url, n)
+    pooled = timed(HTTPClient(pool_size=1).get, url, n)
+
+    report("requests.get", unpooled)
+    report("pooled http client", pooled)
+    print(f"mean latency drop: {(1-statistics.mean(pooled)/statistics.mean(unpooled))*100:.1f}%")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[cast(arg) for cast, arg in zip((int, float), sys.argv[1:])])
@@ -0,0 +1,76 @@
+"""Build, incremental update and scoring time of the recommender at a million favorites.
+
+Uses synthetic favorites (no database): users like a handful of meals each,
+skewed towards popular ones like real favorites are.
+
+run it from the project root like:
+
+    python benchmarks/bench_recommender.py [favorites] [meals] [users_scored]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommender import Recommender, cooccurrence
+
+
+def synthetic_favorites(favorites, meals, rng):
+    """Sorted distinct (user, meal position) pairs, about 10 meals per user."""
+
+    pairs = np.zeros((0, 2), dtype=np.int64)
+    while len(pairs) < favorites:
+        drawn = np.stack([rng.integers(0, favorites//10, favorites), np.minimum(rng.zipf(1.3, favorites)-1, meals-1)], axis=1)
+        pairs = np.unique(np.concatenate([pairs, drawn]), axis=0)
+    pairs = pairs[np.sort(rng.choice(len(pairs), favorites, replace=False))]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def timed(function, n):
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        function(i)
+        timings.append((time.perf_counter()-start)*1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings)*0.95)-1]
+    print(f"{name:<22} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main(favorites=1000000, meals=300, scored=1000):
+    rng = np.random.default_rng(0)
+
+    users, positions = synthetic_favorites(favorites, meals, rng)
+    print(f"{len(users)} favorites of {len(np.unique(users))} users over {meals} meals")
+
+    start = time.perf_counter()
+    counts = cooccurrence(users, positions, meals)
+    print(f"{'full build':<22} {(time.perf_counter()-start)*1000:7.0f} ms")
+
+    recommender = Recommender()
+    recommender.meal_ids = np.arange(meals)
+    recommender.counts = counts
+    starts = np.flatnonzero(np.diff(users, prepend=-1))
+    recommender.user_meals = {int(users[start]): liked for start, liked in zip(starts, np.split(positions, starts[1:]))}
+
+    sample = rng.choice(list(recommender.user_meals), scored)
+    report("score user", timed(lambda i: recommender.score_positions(recommender.user_meals[sample[i]]), scored))
+
+    def like_one_more(i):
+        liked = recommender.user_meals[sample[i]]
+        recommender.apply(int(sample[i]), np.union1d(liked, [rng.integers(meals)]))
+
+    report("apply like", timed(like_one_more, scored))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
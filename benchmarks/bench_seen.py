@@ -0,0 +1,73 @@
+"""Memory per user and spin latency of the seen meal bitsets at a million users.
+
+Fills a SeenSets with synthetic users (no database) who were each shown a
+number of meals, then times spins that skip seen meals and mark the drawn one.
+
+run it from the project root like:
+
+    python benchmarks/bench_seen.py [users] [meals] [seen_per_user] [spins]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sampler
+from sampler import AliasTable, Sampler
+from seen import SeenSets
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings)*0.95)-1]
+    print(f"{name:<22} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main(users=1000000, meals=300, seen_per_user=20, spins=10000):
+    rng = random.Random(0)
+    seen = SeenSets(max_users=users, clock=lambda: 0)
+
+    def add_users(start, stop):
+        for user_id in range(start, stop):
+            bits = 0
+            for meal_id in rng.sample(range(1, meals+1), seen_per_user):
+                bits |= 1 << meal_id
+            seen.users[user_id] = [0, bits, 0]
+
+    #tracing is slow, so memory is measured on the first users only
+    traced = min(users, 100000)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    add_users(0, traced)
+    used = tracemalloc.get_traced_memory()[0]-before
+    tracemalloc.stop()
+    add_users(traced, users)
+
+    print(f"{users} users, {seen_per_user} of {meals} meals seen each")
+    print(f"{'memory per user':<22} {used/traced:7.0f} bytes in memory, {2*((meals+8)//8)+4} bytes stored")
+
+    #spins draw from the whole catalog like /surprise-me, through the sampler's own skipping
+    sampler.seen = seen
+    table = AliasTable(list(range(1, meals+1)), [rng.randint(1, 50) for i in range(meals)])
+    draw = Sampler().draw_unseen
+
+    def spin(i):
+        user_id = rng.randrange(users)
+        seen.mark(user_id, draw(user_id, table))
+
+    timings = []
+    for i in range(spins):
+        start = time.perf_counter()
+        spin(i)
+        timings.append((time.perf_counter()-start)*1000)
+    report("spin", timings)
+    print(f"{'database writes':<22} 0 per spin, {len(seen.dirty)} users batched for the next flush")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,97 @@
+"""Local mirror of the TheMealDB catalog.
+
+The meal pages and the roulette routes are served from the meals and
+meal_ingredients tables. This sync job keeps those tables up to date with
+TheMealDB, it is run by seed.py and can be re-run at any time to refresh them:
+
+    python catalog.py
+
+The TheMealDB url comes from the app config (MEALDB_URL, API_BACKEND).
+"""
+
+import string
+
+from api_client import api
+from meal_index import meal_index
+from models import db, Cuisine, Category, Meal, MealIngredient, CatalogVersion
+from search import build_search_text
+
+
+
+def parse_ingredients(meal_info):
+    """Return (ingredient, measure) pairs of a TheMealDB meal in recipe order."""
+
+    ingredients=[]
+    for i in range(1,21):
+        ingredient=(meal_info.get(f"strIngredient{i}") or "").strip()
+        if ingredient:
+            measure=(meal_info.get(f"strMeasure{i}") or "").strip()
+            ingredients.append((ingredient,measure))
+
+    return ingredients
+
+
+def sync_meal(meal_info,cuisines,categories):
+    """Insert or update a meal from a TheMealDB meal dict.
+
+    cuisines and categories map TheMealDB area/category names to our ids.
+    Returns the meal, or None if its area or category is not in our tables.
+    """
+
+    cuisine_id=cuisines.get(meal_info.get("strArea"))
+    category_id=categories.get(meal_info.get("strCategory"))
+    if not cuisine_id or not category_id:
+        return None
+
+    meal=(Meal.query.filter(Meal.mealdb_id==meal_info["idMeal"]).first()
+          or Meal.query.filter(Meal.meal_name==meal_info["strMeal"]).first())
+    if not meal:
+        meal=Meal(meal_name=meal_info["strMeal"])
+        db.session.add(meal)
+
+    meal.mealdb_id=meal_info["idMeal"]
+    meal.meal_name=meal_info["strMeal"]
+    meal.cuisine_id=cuisine_id
+    meal.category_id=category_id
+    meal.image_url=meal_info.get("strMealThumb")
+    meal.instructions=meal_info.get("strInstructions")
+
+    #ingredients are replaced as a whole, delete-orphan removes the old rows
+    meal.ingredients=[]
+    db.session.flush()
+    ingredients=parse_ingredients(meal_info)
+    meal.ingredients=[MealIngredient(position=position,ingredient=ingredient,measure=measure)
+                      for position,(ingredient,measure) in enumerate(ingredients,1)]
+    meal.search_text=build_search_text(meal.meal_name,meal_info.get("strArea"),meal_info.get("strCategory"),
+                                       [ingredient for ingredient,measure in ingredients])
+
+    return meal
+
+
+def sync_catalog(base_url):
+    """Mirror every TheMealDB meal into the database. Returns the number of meals synced."""
+
+    cuisines={cuisine.cuisine_name:cuisine.cuisine_id for cuisine in Cuisine.query.all()}
+    categories={category.category_name:category.category_id for category in Category.query.all()}
+
+    synced=0
+    for first_letter in string.ascii_lowercase:
+        #the sync always wants the current data, so it bypasses the API cache
+        meals=api.fetch_json(f"{base_url}/search.php",params={"f":first_letter})
+
+        #TheMealDB returns {"meals": null} for letters without meals
+        for meal_info in meals["meals"] or []:
+            if sync_meal(meal_info,cuisines,categories):
+                synced+=1
+
+    #other workers rebuild their meal indexes when they see the new version
+    CatalogVersion.bump()
+    db.session.commit()
+    meal_index.invalidate()
+    return synced
+
+
+if __name__ == "__main__":
+    from app import app
+
+    print(f"Synced {sync_catalog(app.config['MEALDB_URL'])} meals")
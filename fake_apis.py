@@ -0,0 +1,192 @@
+"""Local stand-in for the TheMealDB and Yelp APIs.
+
+Serves the endpoints the app uses, with fixtures generated from the CSVs in
+generator/, so the app can be tested and benchmarked with no network access:
+
+    /api/json/v1/1/list.php, filter.php, lookup.php, search.php, random.php
+    /v3/businesses/search
+
+Responses are deterministic: the same request always gets the same body,
+except for random.php, which picks a meal at random like the real API does.
+Latency and errors can be injected to mimic a slow or flaky upstream.
+
+run it like:
+
+    python fake_apis.py --port 5001 --latency-ms 300 --jitter-ms 100 --error-rate 0.05
+
+and point the app at it with API_BACKEND=fake (see app.py).
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import time
+from csv import DictReader
+
+from flask import Flask, jsonify, request
+
+
+#ingredients of the generated meals, picked by category
+INGREDIENTS = {
+    "Beef": ["Beef", "Onion", "Garlic", "Beef Stock", "Carrots", "Thyme", "Red Wine", "Potatoes", "Tomato Puree"],
+    "Breakfast": ["Eggs", "Bacon", "Bread", "Butter", "Milk", "Sausages", "Mushrooms", "Tomatoes", "Baked Beans"],
+    "Chicken": ["Chicken", "Garlic", "Ginger", "Onion", "Soy Sauce", "Lemon", "Rice", "Paprika", "Coriander"],
+    "Dessert": ["Plain Flour", "Caster Sugar", "Butter", "Eggs", "Milk", "Vanilla Extract", "Almonds", "Cocoa", "Cream"],
+    "Goat": ["Goat Meat", "Onion", "Garlic", "Cumin", "Tomatoes", "Chilli", "Coriander", "Yogurt"],
+    "Lamb": ["Lamb", "Rosemary", "Garlic", "Onion", "Potatoes", "Mint", "Lamb Stock", "Carrots"],
+    "Miscellaneous": ["Onion", "Garlic", "Olive Oil", "Salt", "Pepper", "Tomatoes", "Cheese", "Parsley"],
+    "Pasta": ["Spaghetti", "Penne Rigate", "Parmesan", "Olive Oil", "Garlic", "Basil", "Tomatoes", "Pine Nuts"],
+    "Pork": ["Pork", "Apple", "Sage", "Onion", "Garlic", "Honey", "Soy Sauce", "Ginger"],
+    "Seafood": ["Salmon", "Prawns", "Cod", "Lemon", "Butter", "Dill", "Garlic", "White Wine", "Mussels"],
+    "Side": ["Potatoes", "Butter", "Carrots", "Peas", "Olive Oil", "Salt", "Parsley", "Cabbage"],
+    "Starter": ["Bread", "Tomatoes", "Garlic", "Olive Oil", "Basil", "Mozzarella", "Prawns", "Lettuce"],
+    "Vegan": ["Chickpeas", "Tofu", "Spinach", "Coconut Milk", "Lentils", "Rice", "Peanuts", "Tomatoes"],
+    "Vegetarian": ["Eggs", "Cheese", "Spinach", "Mushrooms", "Peppers", "Rice", "Walnuts", "Milk", "Courgettes"],
+}
+
+#the CSVs of the meals, wherever the stand-in is started from
+GENERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generator")
+
+RESTAURANT_WORDS = ["Golden", "Little", "Corner", "Blue", "Old Town", "Harbor", "Garden", "Urban", "Rustic", "Lucky"]
+RESTAURANT_KINDS = ["Kitchen", "Bistro", "Diner", "Eatery", "Grill", "Cafe", "Table", "House"]
+
+
+def stable_random(*parts):
+    """Random generator seeded by the request, so responses are repeatable."""
+
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def load_meals(generator_dir=GENERATOR_DIR):
+    """TheMealDB-shaped meal dicts built from the generator CSVs."""
+
+    with open(os.path.join(generator_dir, "cuisines.csv")) as cuisines:
+        areas = {row["cuisine_id"]: row["cuisine_name"] for row in DictReader(cuisines)}
+    with open(os.path.join(generator_dir, "categories.csv")) as categories:
+        categories = {row["category_id"]: row["category_name"] for row in DictReader(categories)}
+
+    meals = []
+    with open(os.path.join(generator_dir, "meals.csv")) as meals_csv:
+        for idx, row in enumerate(DictReader(meals_csv), 1):
+            category = categories[row["category_id"]]
+            rand = stable_random(row["meal_name"])
+            ingredients = rand.sample(INGREDIENTS[category], rand.randint(4, 8))
+
+            meal = {
+                "idMeal": str(52700+idx),
+                "strMeal": row["meal_name"],
+                "strCategory": category,
+                "strArea": areas[row["cuisine_id"]],
+                "strInstructions": f"Prepare the {', '.join(ingredient.lower() for ingredient in ingredients)}. Cook and serve.",
+                "strMealThumb": row["image_url"],
+            }
+            for i in range(1, 21):
+                meal[f"strIngredient{i}"] = ingredients[i-1] if i <= len(ingredients) else ""
+                meal[f"strMeasure{i}"] = f"{rand.randint(1, 4)*50}g" if i <= len(ingredients) else ""
+            meals.append(meal)
+
+    return meals
+
+
+def fake_businesses(term, location, count=10):
+    """Yelp businesses/search results for term near location."""
+
+    rand = stable_random(term.lower(), location)
+    businesses = []
+    for i in range(count):
+        name = f"{rand.choice(RESTAURANT_WORDS)} {term.title()} {rand.choice(RESTAURANT_KINDS)}"
+        yelp_id = hashlib.sha1(f"{name}|{location}|{i}".encode()).hexdigest()[:22]
+        businesses.append({
+            "id": yelp_id,
+            "alias": yelp_id,
+            "name": name,
+            "image_url": f"https://s3-media.fl.yelpcdn.com/bphoto/{yelp_id}/o.jpg",
+            "url": f"https://www.yelp.com/biz/{yelp_id}",
+            "review_count": rand.randint(5, 900),
+            "categories": [{"alias": "restaurants", "title": "Restaurants"}],
+            "rating": rand.choice([3.0, 3.5, 4.0, 4.5, 5.0]),
+            "price": "$"*rand.randint(1, 4),
+            "location": {"display_address": [f"{rand.randint(1, 999)} Main St", location]},
+            "display_phone": f"(555) {rand.randint(100, 999)}-{rand.randint(1000, 9999)}",
+        })
+    return businesses
+
+
+def create_app(latency_ms=0, jitter_ms=0, error_rate=0.0, generator_dir=GENERATOR_DIR):
+    """Flask app serving both fake APIs."""
+
+    fake = Flask("fake_apis")
+    meals = load_meals(generator_dir)
+    by_id = {meal["idMeal"]: meal for meal in meals}
+
+    def summary(meal):
+        return {"strMeal": meal["strMeal"], "strMealThumb": meal["strMealThumb"], "idMeal": meal["idMeal"]}
+
+    @fake.before_request
+    def inject_latency_and_errors():
+        if latency_ms or jitter_ms:
+            time.sleep(max(0, latency_ms+random.uniform(-jitter_ms, jitter_ms))/1000)
+        if error_rate and random.random() < error_rate:
+            return jsonify({"error": "injected failure"}), 503
+
+    @fake.route("/api/json/v1/1/list.php")
+    def list_php():
+        if "a" in request.args:
+            return jsonify({"meals": [{"strArea": area} for area in sorted({meal["strArea"] for meal in meals})]})
+        if "c" in request.args:
+            return jsonify({"meals": [{"strCategory": category} for category in sorted({meal["strCategory"] for meal in meals})]})
+        ingredients = sorted({meal[f"strIngredient{i}"] for meal in meals for i in range(1, 21)}-{""})
+        return jsonify({"meals": [{"strIngredient": ingredient} for ingredient in ingredients]})
+
+    @fake.route("/api/json/v1/1/filter.php")
+    def filter_php():
+        if "a" in request.args:
+            found = [meal for meal in meals if meal["strArea"] == request.args["a"]]
+        elif "c" in request.args:
+            found = [meal for meal in meals if meal["strCategory"] == request.args["c"]]
+        else:
+            ingredient = request.args.get("i", "").replace("_", " ").lower()
+            found = [meal for meal in meals
+                     if ingredient in {meal[f"strIngredient{i}"].lower() for i in range(1, 21)}]
+        return jsonify({"meals": [summary(meal) for meal in found] or None})
+
+    @fake.route("/api/json/v1/1/lookup.php")
+    def lookup_php():
+        meal = by_id.get(request.args.get("i"))
+        return jsonify({"meals": [meal] if meal else None})
+
+    @fake.route("/api/json/v1/1/search.php")
+    def search_php():
+        if "f" in request.args:
+            letter = request.args["f"].lower()
+            found = [meal for meal in meals if meal["strMeal"].lower().startswith(letter)]
+        else:
+            search = request.args.get("s", "").lower()
+            found = [meal for meal in meals if search in meal["strMeal"].lower()]
+        return jsonify({"meals": found or None})
+
+    @fake.route("/api/json/v1/1/random.php")
+    def random_php():
+        return jsonify({"meals": [random.choice(meals)]})
+
+    @fake.route("/v3/businesses/search")
+    def businesses_search():
+        location = request.args.get("location") or f"{request.args.get('latitude')},{request.args.get('longitude')}"
+        businesses = fake_businesses(request.args.get("term", "food"), location)
+        return jsonify({"businesses": businesses, "total": len(businesses)})
+
+    return fake
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    create_app(args.latency_ms, args.jitter_ms, args.error_rate).run(host=args.host, port=args.port, threaded=True)
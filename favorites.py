@@ -0,0 +1,218 @@
+"""Set-based changes to a user's favorite meals and restaurants.
+
+Favorites are soft deleted (is_active), so removing and restoring are each
+one UPDATE over every matching row, however many there are. apply_batch
+runs a whole batch of changes, as sent to POST /favorites/batch, in the
+caller's transaction:
+
+    {"meals": {"add": [meal ids], "remove": [meal ids], "restore": [meal ids]},
+     "restaurants": {"add": [{"yelp_id", "meals_liked_id", "name", "address", "rating", "url", "photo"}],
+                     "remove": [{"yelp_id"[, "meals_liked_id"]}],
+                     "restore": [{"yelp_id"[, "meals_liked_id"]}]}}
+
+A restaurant change without meals_liked_id applies to the restaurant for
+every meal. Restaurant details are only needed to add restaurants that are
+not stored yet, and never change a stored restaurant.
+
+Every change recomputes the MealStats of the meals it touched, in the same
+transaction. apply_batch collects the meals all its changes touched and
+recomputes them once.
+"""
+
+from sqlalchemy import and_, or_, select
+
+from models import db, insert_missing, upsert, Meal, MealLiked, MealStats, Restaurant, RestaurantMealLiked
+
+
+MEAL_ACTIONS = ("add", "remove", "restore")
+RESTAURANT_ACTIONS = ("add", "remove", "restore")
+
+
+def refresh_stats(meal_ids, touched=None):
+    """Recompute the MealStats of meal_ids (a list or a select of ids), or add them to touched to recompute later."""
+
+    if touched is not None:
+        touched.append(meal_ids)
+    else:
+        MealStats.refresh(db.session.connection(), meal_ids)
+
+
+def touched_meals(touched):
+    """Select of every meal id in touched, [] if there are none."""
+
+    ids = sorted({meal_id for meal_ids in touched if isinstance(meal_ids, (list, set, tuple)) for meal_id in meal_ids})
+    conditions = [Meal.id.in_(ids)] if ids else []
+    conditions += [Meal.id.in_(meal_ids) for meal_ids in touched if not isinstance(meal_ids, (list, set, tuple))]
+    return select([Meal.id]).where(or_(*conditions)) if conditions else []
+
+
+def meals_of(meals_liked_ids):
+    """Select of the meal ids of meals_liked rows."""
+
+    return select([MealLiked.meal_id]).where(MealLiked.id.in_(meals_liked_ids))
+
+
+def like_meal(user_id, meal_id):
+    """Favorite a meal, or restore it if it was soft deleted, in one upsert."""
+
+    upsert(MealLiked, {"meal_id": meal_id, "user_id": user_id}, {"is_active": True}, {"is_active": True})
+    refresh_stats([meal_id])
+
+
+def like_restaurant(user_id, meals_liked_id, yelp_id):
+    """Favorite a stored restaurant for a liked meal, or restore it if it was soft deleted, in one upsert."""
+
+    upsert(RestaurantMealLiked, {"meals_liked_id": meals_liked_id, "restaurant_yelp_id": yelp_id},
+           {"user_id": user_id, "is_active": True}, {"is_active": True},
+           where=RestaurantMealLiked.user_id == user_id)
+    refresh_stats(meals_of([meals_liked_id]))
+
+
+def set_meals_active(user_id, meal_ids, active, touched=None):
+    """Soft delete (active False) or restore meal favorites. Returns the number of rows changed.
+
+    The stats of the meals are recomputed, or added to touched (see refresh_stats).
+    """
+
+    if not meal_ids:
+        return 0
+    changed = (MealLiked.query.filter(MealLiked.user_id == user_id, MealLiked.meal_id.in_(sorted(meal_ids)),
+                                      MealLiked.is_active != active)
+               .update({MealLiked.is_active: active}, synchronize_session=False))
+    refresh_stats(meal_ids, touched)
+    return changed
+
+
+def add_meals(user_id, meal_ids, touched=None):
+    """Favorite meals, restoring soft deleted ones. Returns the number of rows changed."""
+
+    meal_ids = set(meal_ids)
+    if not meal_ids:
+        return 0
+
+    existing = {meal_id for (meal_id,) in db.session.query(MealLiked.meal_id)
+                .filter(MealLiked.user_id == user_id, MealLiked.meal_id.in_(sorted(meal_ids)))}
+    new_ids = {meal_id for (meal_id,) in db.session.query(Meal.id).filter(Meal.id.in_(sorted(meal_ids - existing)))}
+
+    #a concurrent like of the same meal is skipped, not an IntegrityError
+    added = insert_missing(MealLiked, ["meal_id", "user_id"], [{"user_id": user_id, "meal_id": meal_id, "is_active": True}
+                                                              for meal_id in sorted(new_ids)])
+    restored = set_meals_active(user_id, existing, True, touched)
+    refresh_stats(new_ids, touched)
+    return added + restored
+
+
+def restaurant_condition(items):
+    """Rows of (yelp_id[, meals_liked_id]) items, None if there are none."""
+
+    conditions = [and_(RestaurantMealLiked.restaurant_yelp_id == item["yelp_id"],
+                       RestaurantMealLiked.meals_liked_id == item["meals_liked_id"])
+                  if item.get("meals_liked_id") is not None else RestaurantMealLiked.restaurant_yelp_id == item["yelp_id"]
+                  for item in items]
+    return or_(*conditions) if conditions else None
+
+
+def set_restaurants_active(user_id, items, active, touched=None):
+    """Soft delete (active False) or restore restaurant favorites. Returns the number of rows changed."""
+
+    condition = restaurant_condition(items)
+    if condition is None:
+        return 0
+    changed = (RestaurantMealLiked.query.filter(RestaurantMealLiked.user_id == user_id, condition,
+                                                RestaurantMealLiked.is_active != active)
+               .update({RestaurantMealLiked.is_active: active}, synchronize_session=False))
+    refresh_stats(meals_of(select([RestaurantMealLiked.meals_liked_id])
+                           .where(and_(RestaurantMealLiked.user_id == user_id, condition))), touched)
+    return changed
+
+
+def add_restaurants(user_id, items, touched=None):
+    """Favorite restaurants for meals the user liked, restoring soft deleted ones.
+
+    Returns the number of rows changed, raises ValueError for meals_liked ids
+    of other users and unknown restaurants without details or with urls that
+    are not http(s).
+    """
+
+    if not items:
+        return 0
+
+    meals_liked_ids = {item["meals_liked_id"] for item in items}
+    owned = {meals_liked_id for (meals_liked_id,) in db.session.query(MealLiked.id)
+             .filter(MealLiked.user_id == user_id, MealLiked.id.in_(sorted(meals_liked_ids)))}
+    if owned != meals_liked_ids:
+        raise ValueError(f"not your liked meals: {sorted(meals_liked_ids - owned)}")
+
+    stored = {yelp_id for (yelp_id,) in db.session.query(Restaurant.yelp_id)
+              .filter(Restaurant.yelp_id.in_(sorted({item["yelp_id"] for item in items})))}
+    #unknown restaurants are stored together, not one statement each
+    details = {}
+    for item in items:
+        if item["yelp_id"] not in stored and item["yelp_id"] not in details:
+            try:
+                details[item["yelp_id"]] = dict(yelp_id=item["yelp_id"], name=item["name"], address=item["address"],
+                                                rating=float(item["rating"]), url=item["url"], photo=item.get("photo"))
+            except (KeyError, TypeError) as e:
+                raise ValueError(f"details of restaurant {item['yelp_id']!r} are missing") from e
+    Restaurant.save_all(list(details.values()))
+
+    pairs = {(item["yelp_id"], item["meals_liked_id"]) for item in items}
+    existing = set(db.session.query(RestaurantMealLiked.restaurant_yelp_id, RestaurantMealLiked.meals_liked_id)
+                   .filter(RestaurantMealLiked.user_id == user_id, restaurant_condition(items)))
+    new_pairs = pairs - existing
+
+    db.session.flush()
+    added = insert_missing(RestaurantMealLiked, ["meals_liked_id", "restaurant_yelp_id"],
+                           [{"restaurant_yelp_id": yelp_id, "meals_liked_id": meals_liked_id, "user_id": user_id, "is_active": True}
+                            for yelp_id, meals_liked_id in sorted(new_pairs)])
+    restored = set_restaurants_active(user_id, [{"yelp_id": yelp_id, "meals_liked_id": meals_liked_id}
+                                                for yelp_id, meals_liked_id in existing], True, touched)
+    refresh_stats(meals_of(sorted(meals_liked_ids)), touched)
+    return added + restored
+
+
+def check_batch(batch):
+    """Raise ValueError unless batch has the shape shown in the module docstring."""
+
+    if not isinstance(batch, dict) or set(batch) - {"meals", "restaurants"}:
+        raise ValueError("a batch has 'meals' and 'restaurants' changes")
+
+    meals, restaurants = batch.get("meals", {}), batch.get("restaurants", {})
+    if not isinstance(meals, dict) or set(meals) - set(MEAL_ACTIONS):
+        raise ValueError(f"meal actions are {', '.join(MEAL_ACTIONS)}")
+    if not isinstance(restaurants, dict) or set(restaurants) - set(RESTAURANT_ACTIONS):
+        raise ValueError(f"restaurant actions are {', '.join(RESTAURANT_ACTIONS)}")
+
+    for action, meal_ids in meals.items():
+        if not isinstance(meal_ids, list) or not all(type(meal_id) is int for meal_id in meal_ids):
+            raise ValueError(f"meals.{action} is a list of meal ids")
+
+    for action, items in restaurants.items():
+        if (not isinstance(items, list)
+                or not all(isinstance(item, dict) and isinstance(item.get("yelp_id"), str) for item in items)
+                or not all(item.get("meals_liked_id") is None or type(item["meals_liked_id"]) is int for item in items)
+                or action == "add" and not all(type(item.get("meals_liked_id")) is int for item in items)):
+            raise ValueError(f"restaurants.{action} is a list of {{yelp_id, meals_liked_id}} objects")
+
+
+def apply_batch(user_id, batch):
+    """Apply a batch of favorite changes, uncommitted. Returns the rows changed per change.
+
+    Raises ValueError for malformed batches; the caller rolls back. The stats
+    of every meal the batch touched are recomputed once, at the end.
+    """
+
+    check_batch(batch)
+    meals, restaurants = batch.get("meals", {}), batch.get("restaurants", {})
+
+    touched = []
+    changed = {
+        "meals": {"add": add_meals(user_id, meals.get("add", []), touched),
+                  "remove": set_meals_active(user_id, meals.get("remove", []), False, touched),
+                  "restore": set_meals_active(user_id, meals.get("restore", []), True, touched)},
+        "restaurants": {"add": add_restaurants(user_id, restaurants.get("add", []), touched),
+                        "remove": set_restaurants_active(user_id, restaurants.get("remove", []), False, touched),
+                        "restore": set_restaurants_active(user_id, restaurants.get("restore", []), True, touched)},
+    }
+    refresh_stats(touched_meals(touched))
+    return changed
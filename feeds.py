@@ -0,0 +1,79 @@
+"""Keyset pagination of message (review) listings.
+
+Pages are ordered newest first on (timestamp, id) and the next page starts
+after the last row of the previous one, so every page costs the same index
+range scan however deep the user scrolls (no OFFSET). Cursors are opaque
+url-safe strings.
+
+load_feed fetches a page with everything the review templates show in a
+fixed number of queries however long the page is: the messages joined with
+their authors, meals and restaurants (like counts are a column of messages),
+then one for the viewer's likes.
+"""
+
+import base64
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Message, MealLiked, Like
+
+
+PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 20))
+
+Page = namedtuple("Page", ["items", "next_cursor"])
+Feed = namedtuple("Feed", ["items", "next_cursor", "liked_ids"])
+
+
+def encode_cursor(message):
+    """Cursor pointing right after message."""
+
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) of a cursor, raises ValueError if it is malformed."""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor+"="*(-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    #bad base64, utf-8, isoformat and int all raise ValueError subclasses
+    except ValueError as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+
+
+def paginate(query, cursor=None, size=PAGE_SIZE):
+    """Page of a Message query, newest first, starting after cursor."""
+
+    if cursor:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(*decode_cursor(cursor)))
+
+    #one extra row tells whether there is a next page
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(size+1).all()
+    next_cursor = encode_cursor(messages[size-1]) if len(messages) > size else None
+
+    return Page(messages[:size], next_cursor)
+
+
+def load_feed(query, viewer_id, cursor=None, size=PAGE_SIZE):
+    """Page of a Message query ready for the review templates.
+
+    liked_ids are the ids viewer_id liked.
+    """
+
+    page = paginate(query.options(joinedload(Message.user), joinedload(Message.meal_liked).joinedload(MealLiked.meal),
+                                  joinedload(Message.restaurant)),
+                    cursor, size)
+    message_ids = [message.id for message in page.items]
+    if not message_ids:
+        return Feed([], None, set())
+
+    liked_ids = {message_id for (message_id,) in db.session.query(Like.message_id)
+                 .filter(Like.user_id == viewer_id, Like.message_id.in_(message_ids))}
+
+    return Feed(page.items, page.next_cursor, liked_ids)
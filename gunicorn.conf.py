@@ -0,0 +1,17 @@
+"""Gunicorn settings, loaded automatically by `gunicorn app:app`."""
+
+
+def post_fork(server, worker):
+    """Give each worker its own outbound connection pool and API cache connection.
+
+    Sockets and SQLite connections opened in the master before the fork must
+    not be shared between workers. HTTP_POOL_SIZE sets the pool size of every
+    worker.
+    """
+
+    from api_client import api
+    from http_client import http
+
+    http.reset()
+    if api.shared is not None:
+        api.shared.reset()
@@ -0,0 +1,92 @@
+"""Shared outbound HTTP client.
+
+All outbound calls (TheMealDB, Yelp) go through `http`, a requests Session
+with a keep-alive connection pool per host, so repeated calls to the same API
+reuse an open TCP/TLS connection. Every call has a connect and a read timeout,
+and idempotent GETs are retried a bounded number of times with jittered
+exponential backoff.
+
+Settings come from environment variables, so each gunicorn worker can be
+given its own pool size:
+
+    HTTP_POOL_SIZE          connections kept open per host (default 10)
+    HTTP_CONNECT_TIMEOUT    seconds (default 3.05)
+    HTTP_READ_TIMEOUT       seconds (default 10)
+    HTTP_RETRIES            retries after the first attempt (default 2)
+    HTTP_BACKOFF            base backoff in seconds (default 0.2)
+"""
+
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.2))
+
+#responses worth another attempt, anything else is returned to the caller
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HTTPClient:
+    """Pooled keep-alive GET client with hard timeouts and jittered retries."""
+
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = self._session()
+
+    def _session(self):
+        session = requests.Session()
+
+        #pool_connections is the number of hosts kept, pool_maxsize the connections per host.
+        #Retries are done in get() so they can be jittered and limited to GETs.
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def reset(self):
+        """Drop all pooled connections, used after a fork so workers don't share sockets."""
+
+        self.session.close()
+        self.session = self._session()
+
+    def sleep_before_retry(self, attempt, resp=None):
+        """Full jitter exponential backoff, honouring a Retry-After header in seconds."""
+
+        delay = random.uniform(0, self.backoff*2**attempt)
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), self.timeout[1]))
+        time.sleep(delay)
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        """GET url, retrying connection errors, timeouts and RETRY_STATUSES responses."""
+
+        for attempt in range(self.retries+1):
+            try:
+                resp = self.session.get(url, params=params, headers=headers, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                self.sleep_before_retry(attempt)
+                continue
+
+            if resp.status_code in RETRY_STATUSES and attempt < self.retries:
+                self.sleep_before_retry(attempt, resp)
+                continue
+
+            return resp
+
+
+http = HTTPClient()
@@ -0,0 +1,82 @@
+"""Check that the hot lookups are served by an index.
+
+Each query in HOT_QUERIES is compiled for the database in use and EXPLAINed.
+A query passes when its plan reads tables through an index and never scans
+one in full. On Postgres sequential scans are disabled for the check, so a
+small database whose planner would rather scan still shows whether a usable
+index exists:
+
+    python index_check.py
+"""
+
+import sys
+
+from sqlalchemy import text
+
+from models import Meal, MealLiked, RestaurantMealLiked, Message, Like
+
+
+#name -> query, with placeholder values
+HOT_QUERIES = {
+    "active meal like of a user": lambda: MealLiked.query.filter_by(user_id=1, meal_id=1, is_active=True),
+    "restaurants of a meal like": lambda: RestaurantMealLiked.query.filter_by(user_id=1, meals_liked_id=1),
+    "active restaurant like of a user": lambda: RestaurantMealLiked.query.filter_by(user_id=1, restaurant_yelp_id="yelp", is_active=True),
+    "reviews by a user": lambda: Message.query.filter_by(user_id=1).order_by(Message.timestamp.desc(), Message.id.desc()),
+    "reviews of a meal like": lambda: Message.query.filter_by(meals_liked_id=1).order_by(Message.timestamp.desc(), Message.id.desc()),
+    "meal by name": lambda: Meal.query.filter_by(meal_name="Rock Cakes"),
+    "likes of a message": lambda: Like.query.filter_by(message_id=1),
+}
+
+INDEX_ACCESS = {
+    "postgresql": ("Index Scan", "Index Only Scan", "Bitmap Index Scan"),
+    "sqlite": ("USING INDEX", "USING COVERING INDEX", "USING INTEGER PRIMARY KEY", "USING PRIMARY KEY"),
+}
+
+FULL_SCAN = {
+    "postgresql": ("Seq Scan",),
+    "sqlite": ("SCAN ",),
+}
+
+
+def explain(conn, query):
+    """Plan of a query as a list of lines."""
+
+    sql = str(query.statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+
+    if conn.dialect.name == "postgresql":
+        with conn.begin() as trans:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = [line for (line,) in conn.execute(text(f"EXPLAIN {sql}"))]
+            trans.rollback()
+        return plan
+
+    #sqlite rows are (id, parent, notused, detail)
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def check_indexes(engine):
+    """Map each hot query name to (uses an index, plan)."""
+
+    index_access, full_scan = INDEX_ACCESS[engine.dialect.name], FULL_SCAN[engine.dialect.name]
+    results = {}
+    with engine.connect() as conn:
+        for name, query in HOT_QUERIES.items():
+            plan = explain(conn, query())
+            uses_index = (any(marker in line for line in plan for marker in index_access)
+                          and not any(marker in line for line in plan for marker in full_scan))
+            results[name] = (uses_index, plan)
+
+    return results
+
+
+if __name__ == "__main__":
+    from app import app, db
+
+    failed = False
+    for name, (uses_index, plan) in check_indexes(db.engine).items():
+        print(f"{'ok' if uses_index else 'NO INDEX'}: {name}")
+        if not uses_index:
+            failed = True
+            print("\n".join(f"    {line}" for line in plan))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,147 @@
+"""Location normalization for the restaurant searches.
+
+Users type locations free-form ("NYC", "New York", "new york, ny"). resolve()
+maps them to a canonical Location. Places found in the local gazetteer
+(generator/gazetteer.csv) are bucketed by geohash, so every spelling of a city
+shares one bucket. Anything else, like a street address, is keyed by its
+normalized text.
+"""
+
+import os
+import re
+import unicodedata
+from collections import namedtuple
+from csv import DictReader
+
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generator", "gazetteer.csv")
+
+#~4.9km x 4.9km cells
+GEOHASH_PRECISION = 5
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+STATES = {
+    "al", "ak", "az", "ar", "ca", "co", "ct", "de", "dc", "fl", "ga", "hi", "id", "il", "in", "ia", "ks", "ky",
+    "la", "me", "md", "ma", "mi", "mn", "ms", "mo", "mt", "ne", "nv", "nh", "nj", "nm", "ny", "nc", "nd", "oh",
+    "ok", "or", "pa", "ri", "sc", "sd", "tn", "tx", "ut", "vt", "va", "wa", "wv", "wi", "wy", "on", "qc", "bc",
+}
+
+COUNTRIES = {"usa", "us", "united states", "united states of america", "america", "canada", "uk", "united kingdom"}
+
+Location = namedtuple("Location", ["key", "name", "latitude", "longitude"])
+
+
+def normalize_text(location):
+    """Lowercase, ascii, no punctuation, single spaces."""
+
+    location = unicodedata.normalize("NFKD", location).encode("ascii", "ignore").decode()
+    location = re.sub(r"[^a-z0-9]+", " ", location.lower())
+    return " ".join(location.split())
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point."""
+
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits, bit_count, even = 0, 0, True
+    chars = []
+
+    while len(chars) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0]+interval[1])/2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+
+    return "".join(chars)
+
+
+def geohash_center(code):
+    """(latitude, longitude) of the center of a geohash cell."""
+
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in code:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0]+interval[1])/2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+
+    return ((lat_range[0]+lat_range[1])/2, (lon_range[0]+lon_range[1])/2)
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Map every normalized name and alias to its (name, state, latitude, longitude) place."""
+
+    places = {}
+    with open(path) as gazetteer:
+        for row in DictReader(gazetteer):
+            place = (row["name"], row["state"].lower(), float(row["latitude"]), float(row["longitude"]))
+            for alias in [row["name"]]+row["aliases"].split("|"):
+                places.setdefault(normalize_text(alias), place)
+    return places
+
+
+class Gazetteer:
+    """Resolves free-text locations against the gazetteer."""
+
+    def __init__(self, places=None):
+        self.places = places if places is not None else load_gazetteer()
+
+    def lookup(self, text):
+        """Place of a normalized location, allowing trailing state and country names."""
+
+        if text in self.places:
+            return self.places[text]
+
+        words = text.split()
+        state = None
+        while len(words) > 1:
+            #"new york ny usa" -> "new york ny" -> "new york"
+            for size in (4, 3, 2, 1):
+                tail = " ".join(words[-size:])
+                if len(words) > size and (tail in COUNTRIES or (size == 1 and tail in STATES and state is None)):
+                    if tail in STATES:
+                        state = tail
+                    words = words[:-size]
+                    break
+            else:
+                return None
+
+            place = self.places.get(" ".join(words))
+            #"portland me" is not Portland, OR
+            if place and (state is None or not place[1] or place[1] == state):
+                return place
+
+        return None
+
+    def resolve(self, location):
+        """Canonical Location of a free-text location."""
+
+        text = normalize_text(location or "")
+        place = self.lookup(text)
+        if place is None:
+            return Location(f"text:{text}", text, None, None)
+
+        name, state, latitude, longitude = place
+        bucket = geohash(latitude, longitude)
+        latitude, longitude = geohash_center(bucket)
+        return Location(f"geo:{bucket}", name, latitude, longitude)
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,264 @@
+"""In-memory index of meal ids per cuisine, category and ingredient.
+
+The roulette picks a random meal id with one array lookup, with no network
+call and no name lookup. The index is built from the meals table on first use
+and rebuilt when the catalog version changes (see CatalogVersion). Each worker
+checks the version at most every MEAL_INDEX_CHECK_SECONDS.
+
+Ingredients are an inverted index: every ingredient word maps to a bitset (a
+Python int) with bit i set when the i-th meal of all_ids has an ingredient
+with that word, so include/exclude filters are a few dict lookups and ANDs.
+Terms match whole words, "nuts" finds "Cashew Nuts" but not "Peanuts", and
+words are compared lowercased, without punctuation and singular ("egg"
+finds "Eggs"). The ids matching a filter are cached until the next
+rebuild, so filtered spins are array picks too.
+
+Meal names are kept in sorted arrays for the search bar autocomplete: a
+prefix lookup is a bisect and a walk over at most the matches it returns.
+"""
+
+import os
+import random
+import re
+from bisect import bisect_left
+import threading
+import time
+from collections import namedtuple
+
+from models import db, Meal, MealIngredient, CatalogVersion
+
+
+CHECK_SECONDS = float(os.environ.get('MEAL_INDEX_CHECK_SECONDS', 60))
+#filtered id arrays kept between rebuilds
+FILTER_CACHE_SIZE = int(os.environ.get('MEAL_INDEX_FILTER_CACHE_SIZE', 1024))
+#autocomplete suggestions per prefix
+COMPLETE_LIMIT = 8
+
+IngredientFilter = namedtuple("IngredientFilter", ["include", "exclude"])
+
+
+def normalize_ingredient(name):
+    return " ".join(name.lower().split())
+
+
+def singular(word):
+    """Rough singular of a plural ingredient word, enough to match "eggs" with "egg" and "tomatoes" with "tomato"."""
+
+    if len(word) > 3 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def ingredient_words(name):
+    """Normalized words of an ingredient or a filter term."""
+
+    return tuple(singular(word) for word in re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def ingredient_filter(include=(), exclude=()):
+    """IngredientFilter from lists of comma-separated ingredient terms, None if both are empty.
+
+    >>> ingredient_filter(["Chicken, garlic"], ["nuts"])
+    IngredientFilter(include=('chicken', 'garlic'), exclude=('nuts',))
+    """
+
+    def terms(values):
+        return tuple(sorted({normalize_ingredient(term) for value in values for term in value.split(",")} - {""}))
+
+    include, exclude = terms(include), terms(exclude)
+    return IngredientFilter(include, exclude) if include or exclude else None
+
+
+def prefix_range(keys, prefix):
+    """Positions of the sorted keys starting with prefix, one bisect each end."""
+
+    start = bisect_left(keys, prefix)
+    #every key starting with prefix sorts before prefix followed by the highest code point
+    return start, bisect_left(keys, prefix+"\U0010ffff", start)
+
+
+def bit_ids(bits, ids):
+    """ids at the positions of the set bits."""
+
+    found = []
+    while bits:
+        low = bits & -bits
+        found.append(ids[low.bit_length()-1])
+        bits ^= low
+    return found
+
+
+def term_bits(term, by_word, ingredients_with, by_ingredient):
+    """Meals with an ingredient holding the words of term in a row, so "nuts" matches "Pine Nuts" but not "Peanuts".
+
+    Takes the ingredient maps of one build, see MealIndex.
+    """
+
+    words = ingredient_words(term)
+    if len(words) <= 1:
+        return by_word.get(words[0], 0) if words else 0
+
+    #a phrase: only the ingredients with its first word can hold it
+    bits, size = 0, len(words)
+    for ingredient in ingredients_with.get(words[0], ()):
+        if any(ingredient[i:i+size] == words for i in range(len(ingredient)-size+1)):
+            bits |= by_ingredient[ingredient]
+    return bits
+
+
+class MealIndex:
+    """Meal ids of every cuisine_id and category_id, plus all meal ids and ingredient bitsets."""
+
+    def __init__(self, check_seconds=CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0
+        self.all_ids = []
+        self.by_cuisine = {}
+        self.by_category = {}
+        self.positions = {}
+        #ingredient word -> bitset of the meals using it, and -> ingredients (as word tuples) with it
+        self.by_word = {}
+        self.ingredients_with = {}
+        self.by_ingredient = {}
+        self.filtered = {}
+        #sorted lowercased names and (name, id) at the same positions, for whole
+        #names and for every later word of a name ("handi" finds Chicken Handi)
+        self.name_keys, self.name_meals = [], []
+        self.word_keys, self.word_meals = [], []
+
+    def build(self):
+        """Load (id, cuisine_id, category_id) of every meal and their ingredients. Needs an app context."""
+
+        version = CatalogVersion.current()
+        all_ids, by_cuisine, by_category = [], {}, {}
+        names, words = [], []
+        for meal_id, cuisine_id, category_id, meal_name in (db.session.query(Meal.id, Meal.cuisine_id, Meal.category_id, Meal.meal_name)
+                                                            .order_by(Meal.id)):
+            all_ids.append(meal_id)
+            by_cuisine.setdefault(cuisine_id, []).append(meal_id)
+            by_category.setdefault(category_id, []).append(meal_id)
+
+            name_words = meal_name.lower().split()
+            names.append((" ".join(name_words), meal_name, meal_id))
+            words += [(" ".join(name_words[i:]), meal_name, meal_id) for i in range(1, len(name_words))]
+
+        names.sort()
+        words.sort()
+
+        positions = {meal_id: position for position, meal_id in enumerate(all_ids)}
+        by_ingredient, by_word, ingredients_with = {}, {}, {}
+        for meal_id, ingredient in db.session.query(MealIngredient.meal_id, MealIngredient.ingredient):
+            if meal_id in positions:
+                key = ingredient_words(ingredient)
+                by_ingredient[key] = by_ingredient.get(key, 0) | 1 << positions[meal_id]
+        for key, bits in by_ingredient.items():
+            for word in set(key):
+                by_word[word] = by_word.get(word, 0) | bits
+                ingredients_with.setdefault(word, []).append(key)
+
+        with self.lock:
+            self.all_ids, self.by_cuisine, self.by_category = all_ids, by_cuisine, by_category
+            self.positions, self.by_ingredient = positions, by_ingredient
+            self.by_word, self.ingredients_with = by_word, ingredients_with
+            self.name_keys, self.name_meals = [key for key, *meal in names], [tuple(meal) for key, *meal in names]
+            self.word_keys, self.word_meals = [key for key, *meal in words], [tuple(meal) for key, *meal in words]
+            self.filtered = {}
+            self.version = version
+            self.checked_at = time.time()
+
+    def invalidate(self):
+        """Rebuild on next use."""
+
+        with self.lock:
+            self.version = None
+
+    def reset(self):
+        """Forget the index, e.g. between tests that reseed the database."""
+
+        self.invalidate()
+
+    def refresh(self):
+        """Build the index if it is missing or the catalog version moved on."""
+
+        if self.version is not None and time.time()-self.checked_at < self.check_seconds:
+            return
+
+        if self.version is None or CatalogVersion.current() != self.version:
+            self.build()
+        else:
+            self.checked_at = time.time()
+
+    def ids(self, mode, key=None, filters=None):
+        """Meal ids of mode ("cuisine", "category" or "surprise" for all meals), narrowed by an IngredientFilter."""
+
+        self.refresh()
+        #one consistent snapshot, a rebuild may swap the arrays meanwhile
+        with self.lock:
+            all_ids, positions, filtered = self.all_ids, self.positions, self.filtered
+            maps = self.by_word, self.ingredients_with, self.by_ingredient
+            if mode == "cuisine":
+                ids = self.by_cuisine.get(key, [])
+            elif mode == "category":
+                ids = self.by_category.get(key, [])
+            else:
+                ids = all_ids
+
+        if not filters or not ids:
+            return ids
+
+        cache_key = (mode, key, filters)
+        found = filtered.get(cache_key)
+        if found is None:
+            bits = 0
+            for meal_id in ids:
+                bits |= 1 << positions[meal_id]
+            for term in filters.include:
+                bits &= term_bits(term, *maps)
+            for term in filters.exclude:
+                bits &= ~term_bits(term, *maps)
+            found = bit_ids(bits, all_ids)
+
+            with self.lock:
+                if len(filtered) >= FILTER_CACHE_SIZE:
+                    filtered.clear()
+                filtered[cache_key] = found
+        return found
+
+    def complete(self, prefix, limit=COMPLETE_LIMIT):
+        """Up to limit (name, id) of meals whose name, or a later word of it, starts with prefix.
+
+        Whole name matches come first, each group in alphabetical order.
+        """
+
+        self.refresh()
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+
+        with self.lock:
+            groups = [(self.name_keys, self.name_meals), (self.word_keys, self.word_meals)]
+
+        found, seen = [], set()
+        for keys, meals in groups:
+            start, stop = prefix_range(keys, prefix)
+            for position in range(start, stop):
+                name, meal_id = meals[position]
+                if len(found) == limit:
+                    return found
+                if meal_id not in seen:
+                    seen.add(meal_id)
+                    found.append((name, meal_id))
+        return found
+
+    def pick(self, mode, key=None, filters=None):
+        """Random meal id of mode in O(1), None if no meal matches."""
+
+        ids = self.ids(mode, key, filters)
+        return ids[random.randrange(len(ids))] if ids else None
+
+
+meal_index = MealIndex()
@@ -0,0 +1,123 @@
+"""Versioned schema migrations.
+
+Every file migrations/NNNN_name.py is one migration with an upgrade(conn)
+function. Applied versions are recorded in the schema_version table, so each
+migration runs once per database, in order, without touching existing data:
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list migrations and whether they are applied
+
+A migration runs in its own transaction. Migrations that set
+TRANSACTIONAL = False run in autocommit mode instead, which Postgres needs for
+CREATE INDEX CONCURRENTLY (building an index without blocking writes).
+
+seed.py builds a fresh database with db.create_all(), which already matches
+the latest migration, and stamps it as up to date.
+"""
+
+import argparse
+import importlib.util
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+Migration = namedtuple("Migration", ["version", "name", "module"])
+
+
+def load_migrations(path=MIGRATIONS_DIR):
+    """Migrations in path, sorted by version."""
+
+    migrations = []
+    for filename in sorted(os.listdir(path)):
+        match = re.match(r"(\d{4})_(\w+)\.py$", filename)
+        if not match:
+            continue
+
+        spec = importlib.util.spec_from_file_location(f"migrations.{filename[:-3]}", os.path.join(path, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(Migration(int(match.group(1)), match.group(2), module))
+
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"duplicate migration versions in {path}")
+
+    return migrations
+
+
+def applied_versions(engine):
+    """Versions recorded in schema_version, created if missing."""
+
+    with engine.begin() as conn:
+        conn.execute(text("""CREATE TABLE IF NOT EXISTS schema_version (
+                                 version INTEGER PRIMARY KEY,
+                                 name TEXT NOT NULL,
+                                 applied_at TIMESTAMP NOT NULL
+                             )"""))
+        return {version for (version,) in conn.execute(text("SELECT version FROM schema_version"))}
+
+
+def record(conn, migration):
+    conn.execute(text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                 version=migration.version, name=migration.name, applied_at=datetime.utcnow())
+
+
+def upgrade(engine, migrations=None):
+    """Apply pending migrations in order. Returns the ones applied."""
+
+    migrations = load_migrations() if migrations is None else migrations
+    applied = applied_versions(engine)
+
+    done = []
+    for migration in migrations:
+        if migration.version in applied:
+            continue
+
+        if getattr(migration.module, "TRANSACTIONAL", True):
+            with engine.begin() as conn:
+                migration.module.upgrade(conn)
+                record(conn, migration)
+        else:
+            #statements must be safe to re-run: a failure halfway leaves the version unrecorded
+            with engine.connect() as conn:
+                migration.module.upgrade(conn.execution_options(isolation_level="AUTOCOMMIT"))
+            with engine.begin() as conn:
+                record(conn, migration)
+
+        done.append(migration)
+
+    return done
+
+
+def stamp(engine, migrations=None):
+    """Record every migration as applied without running it, for databases made by db.create_all()."""
+
+    migrations = load_migrations() if migrations is None else migrations
+    applied = applied_versions(engine)
+
+    with engine.begin() as conn:
+        for migration in migrations:
+            if migration.version not in applied:
+                record(conn, migration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--status", action="store_true", help="list migrations instead of applying them")
+    args = parser.parse_args()
+
+    from app import app, db
+
+    if args.status:
+        applied = applied_versions(db.engine)
+        for migration in load_migrations():
+            print(f"{migration.version:04d} {migration.name}: {'applied' if migration.version in applied else 'pending'}")
+    else:
+        for migration in upgrade(db.engine):
+            print(f"Applied {migration.version:04d} {migration.name}")
@@ -0,0 +1,25 @@
+"""Indexes for the keyset-paginated review feeds.
+
+On Postgres the indexes are built CONCURRENTLY so live traffic keeps
+writing to messages. A concurrent build that fails leaves an INVALID index
+behind; drop it by hand before re-running.
+"""
+
+from sqlalchemy import text
+
+
+TRANSACTIONAL = False
+
+#(name, columns of messages)
+INDEXES = [
+    ("ix_messages_timestamp_id", "timestamp, id"),
+    ("ix_messages_user_id_timestamp_id", "user_id, timestamp, id"),
+    ("ix_messages_meals_liked_id_timestamp_id", "meals_liked_id, timestamp, id"),
+]
+
+
+def upgrade(conn):
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+
+    for name, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON messages ({columns})"))
@@ -0,0 +1,54 @@
+"""Move restaurant details to the normalized restaurants table (Postgres).
+
+Databases created before the restaurants table existed keep a copy of the
+restaurant details in every restaurants_meals_liked row. This moves them to
+one restaurants row per Yelp id (the most recent copy wins). It then points
+restaurants_meals_liked and messages at that table with foreign keys and
+drops the copied columns. Messages that name an unknown restaurant (e.g. "No
+Restaurant Selected") get a NULL restaurant. Databases that already have the
+table are left alone.
+"""
+
+from sqlalchemy import text
+
+from models import DEFAULT_RESTAURANT_PHOTO
+
+
+STATEMENTS = [
+    """CREATE TABLE restaurants (
+           yelp_id TEXT PRIMARY KEY,
+           name TEXT NOT NULL,
+           address TEXT NOT NULL,
+           rating FLOAT,
+           url TEXT NOT NULL,
+           photo TEXT
+       )""",
+    """INSERT INTO restaurants (yelp_id, name, address, rating, url, photo)
+       SELECT restaurant_yelp_id, restaurant_name, restaurant_address, restaurant_rating, restaurant_url,
+              NULLIF(NULLIF(restaurant_photo, :default_photo), '')
+       FROM restaurants_meals_liked
+       WHERE id IN (SELECT max(id) FROM restaurants_meals_liked GROUP BY restaurant_yelp_id)""",
+    """ALTER TABLE restaurants_meals_liked
+           ADD CONSTRAINT restaurants_meals_liked_restaurant_yelp_id_fkey
+           FOREIGN KEY (restaurant_yelp_id) REFERENCES restaurants (yelp_id),
+           DROP COLUMN restaurant_name,
+           DROP COLUMN restaurant_address,
+           DROP COLUMN restaurant_rating,
+           DROP COLUMN restaurant_url,
+           DROP COLUMN restaurant_photo""",
+    """ALTER TABLE messages ALTER COLUMN restaurant_info DROP NOT NULL""",
+    """UPDATE messages SET restaurant_info = NULL
+       WHERE restaurant_info IS NOT NULL
+         AND NOT EXISTS (SELECT 1 FROM restaurants WHERE yelp_id = messages.restaurant_info)""",
+    """ALTER TABLE messages
+           ADD CONSTRAINT messages_restaurant_info_fkey
+           FOREIGN KEY (restaurant_info) REFERENCES restaurants (yelp_id)""",
+]
+
+
+def upgrade(conn):
+    if conn.dialect.has_table(conn, "restaurants"):
+        return
+
+    for statement in STATEMENTS:
+        conn.execute(text(statement), default_photo=DEFAULT_RESTAURANT_PHOTO)
@@ -0,0 +1,32 @@
+"""Indexes for the per-user like lookups and per-message like counts.
+
+On Postgres the indexes are built CONCURRENTLY so live traffic keeps
+writing to the tables. A concurrent build that fails leaves an INVALID
+index behind; drop it by hand before re-running.
+"""
+
+from sqlalchemy import text
+
+
+TRANSACTIONAL = False
+
+#(name, table, columns, only active rows)
+INDEXES = [
+    ("ix_meals_liked_user_id_meal_id_active", "meals_liked", "user_id, meal_id", True),
+    ("ix_restaurants_meals_liked_user_id_meals_liked_id", "restaurants_meals_liked", "user_id, meals_liked_id", False),
+    ("ix_restaurants_meals_liked_user_id_restaurant_yelp_id_active", "restaurants_meals_liked", "user_id, restaurant_yelp_id", True),
+    ("ix_likes_message_id", "likes", "message_id", False),
+]
+
+
+def upgrade(conn):
+    postgres = conn.dialect.name == "postgresql"
+
+    for name, table, columns, active in INDEXES:
+        statement = f"CREATE INDEX {'CONCURRENTLY ' if postgres else ''}IF NOT EXISTS {name} ON {table} ({columns})"
+        if active:
+            statement += " WHERE is_active" if postgres else " WHERE is_active = 1"
+        conn.execute(text(statement))
+
+    #superseded by the partial index on active rows
+    conn.execute(text("DROP INDEX IF EXISTS ix_restaurants_meals_liked_user_id_restaurant_yelp_id"))
@@ -0,0 +1,19 @@
+"""Denormalized like counters: messages.like_count and users.likes_received."""
+
+from sqlalchemy import inspect, text
+
+
+STATEMENTS = [
+    "ALTER TABLE messages ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN likes_received INTEGER NOT NULL DEFAULT 0",
+    "UPDATE messages SET like_count = (SELECT count(*) FROM likes WHERE likes.message_id = messages.id)",
+    "UPDATE users SET likes_received = (SELECT coalesce(sum(like_count), 0) FROM messages WHERE messages.user_id = users.id)",
+]
+
+
+def upgrade(conn):
+    if "like_count" in {column["name"] for column in inspect(conn).get_columns("messages")}:
+        return
+
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
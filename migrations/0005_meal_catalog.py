@@ -0,0 +1,50 @@
+"""Local TheMealDB catalog mirror: meals.mealdb_id and meals.instructions, meal_ingredients and catalog_version.
+
+Existing meals get their TheMealDB id, instructions and ingredients from the
+next catalog sync (python catalog.py).
+"""
+
+from sqlalchemy import inspect, text
+
+
+POSTGRES = [
+    "ALTER TABLE meals ADD COLUMN mealdb_id TEXT UNIQUE",
+    "ALTER TABLE meals ADD COLUMN instructions TEXT",
+]
+
+#sqlite can't add a UNIQUE column, a unique index does the same
+SQLITE = [
+    "ALTER TABLE meals ADD COLUMN mealdb_id TEXT",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_meals_mealdb_id ON meals (mealdb_id)",
+    "ALTER TABLE meals ADD COLUMN instructions TEXT",
+]
+
+#the tables as this revision of models.py made them, {serial} is the type of an autoincrementing id
+TABLES = [
+    """CREATE TABLE IF NOT EXISTS meal_ingredients (
+           id {serial} NOT NULL,
+           meal_id INTEGER NOT NULL,
+           position INTEGER NOT NULL,
+           ingredient TEXT NOT NULL,
+           measure TEXT,
+           PRIMARY KEY (id),
+           UNIQUE (meal_id, position),
+           FOREIGN KEY (meal_id) REFERENCES meals (id) ON DELETE cascade
+       )""",
+    """CREATE TABLE IF NOT EXISTS catalog_version (
+           id {serial} NOT NULL,
+           version INTEGER NOT NULL,
+           PRIMARY KEY (id)
+       )""",
+]
+
+
+def upgrade(conn):
+    postgres = conn.dialect.name == "postgresql"
+
+    if "mealdb_id" not in {column["name"] for column in inspect(conn).get_columns("meals")}:
+        for statement in POSTGRES if postgres else SQLITE:
+            conn.execute(text(statement))
+
+    for statement in TABLES:
+        conn.execute(text(statement.format(serial="SERIAL" if postgres else "INTEGER")))
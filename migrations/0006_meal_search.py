@@ -0,0 +1,40 @@
+"""meals.search_text for search.py, with a trigram index on Postgres.
+
+The meals table is only written by the catalog sync, so the index is built
+inside the migration's transaction rather than CONCURRENTLY.
+"""
+
+from sqlalchemy import inspect, text
+
+from models import create_pg_trgm
+
+
+def backfill(aggregate):
+    return f"""UPDATE meals SET search_text = lower(meal_name
+                   || ' ' || coalesce((SELECT cuisine_name FROM cuisines WHERE cuisine_id = meals.cuisine_id), '')
+                   || ' ' || coalesce((SELECT category_name FROM categories WHERE category_id = meals.category_id), '')
+                   || ' ' || coalesce((SELECT {aggregate} FROM meal_ingredients WHERE meal_id = meals.id), ''))"""
+
+
+#after create_pg_trgm
+POSTGRES = [
+    "ALTER TABLE meals ADD COLUMN search_text TEXT",
+    backfill("string_agg(ingredient, ' ' ORDER BY position)"),
+    "ALTER TABLE meals ALTER COLUMN search_text SET NOT NULL",
+    "CREATE INDEX ix_meals_search_text_trgm ON meals USING gin (search_text gin_trgm_ops)",
+]
+
+#sqlite can't add a NOT NULL column without a default, the model fills it in for new rows
+SQLITE = [
+    "ALTER TABLE meals ADD COLUMN search_text TEXT NOT NULL DEFAULT ''",
+    backfill("group_concat(ingredient, ' ')"),
+]
+
+
+def upgrade(conn):
+    if "search_text" in {column["name"] for column in inspect(conn).get_columns("meals")}:
+        return
+
+    create_pg_trgm(conn)
+    for statement in POSTGRES if conn.dialect.name == "postgresql" else SQLITE:
+        conn.execute(text(statement))
@@ -0,0 +1,49 @@
+"""Precomputed per-meal review stats: meal_stats and meal_restaurant_stats, backfilled.
+
+The tables and the backfill are as this revision of models.py made and
+computed them (see MealStats.refresh).
+"""
+
+from sqlalchemy import text
+
+
+STATEMENTS = [
+    """CREATE TABLE meal_stats (
+           meal_id INTEGER NOT NULL,
+           review_count INTEGER NOT NULL,
+           review_likes INTEGER NOT NULL,
+           liked_by INTEGER NOT NULL,
+           PRIMARY KEY (meal_id),
+           FOREIGN KEY (meal_id) REFERENCES meals (id) ON DELETE cascade
+       )""",
+    """CREATE TABLE meal_restaurant_stats (
+           meal_id INTEGER NOT NULL,
+           restaurant_yelp_id TEXT NOT NULL,
+           pairings INTEGER NOT NULL,
+           PRIMARY KEY (meal_id, restaurant_yelp_id),
+           FOREIGN KEY (meal_id) REFERENCES meals (id) ON DELETE cascade,
+           FOREIGN KEY (restaurant_yelp_id) REFERENCES restaurants (yelp_id) ON DELETE cascade
+       )""",
+    "CREATE INDEX ix_meal_restaurant_stats_meal_id_pairings ON meal_restaurant_stats (meal_id, pairings)",
+    """INSERT INTO meal_stats (meal_id, review_count, review_likes, liked_by)
+       SELECT meals.id,
+              (SELECT count(*) FROM messages JOIN meals_liked ON messages.meals_liked_id = meals_liked.id
+               WHERE meals_liked.meal_id = meals.id),
+              (SELECT coalesce(sum(messages.like_count), 0) FROM messages JOIN meals_liked ON messages.meals_liked_id = meals_liked.id
+               WHERE meals_liked.meal_id = meals.id),
+              (SELECT count(*) FROM meals_liked WHERE meals_liked.meal_id = meals.id AND meals_liked.is_active)
+       FROM meals""",
+    """INSERT INTO meal_restaurant_stats (meal_id, restaurant_yelp_id, pairings)
+       SELECT meals_liked.meal_id, restaurants_meals_liked.restaurant_yelp_id, count(*)
+       FROM restaurants_meals_liked JOIN meals_liked ON restaurants_meals_liked.meals_liked_id = meals_liked.id
+       WHERE meals_liked.is_active AND restaurants_meals_liked.is_active
+       GROUP BY meals_liked.meal_id, restaurants_meals_liked.restaurant_yelp_id""",
+]
+
+
+def upgrade(conn):
+    if conn.dialect.has_table(conn, "meal_stats"):
+        return
+
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
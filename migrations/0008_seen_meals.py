@@ -0,0 +1,18 @@
+"""Per-user seen meal bitsets for the roulette (see seen.py)."""
+
+from sqlalchemy import text
+
+
+#the table as this revision of models.py made it
+TABLE = """CREATE TABLE IF NOT EXISTS seen_meals (
+               user_id INTEGER NOT NULL,
+               epoch INTEGER NOT NULL,
+               current {binary} NOT NULL,
+               previous {binary} NOT NULL,
+               PRIMARY KEY (user_id),
+               FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE cascade
+           )"""
+
+
+def upgrade(conn):
+    conn.execute(text(TABLE.format(binary="BYTEA" if conn.dialect.name == "postgresql" else "BLOB")))
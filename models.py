@@ -2,12 +2,43 @@
 
 
 from datetime import datetime
+from urllib.parse import urlparse
 
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import DDL, and_, bindparam, event, exists, func, literal, orm, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import UpdateBase
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the engine in info["replica"] while it is set (see replicas.py).
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary and
+    set info["wrote"], and after the first of them the rest of the session
+    reads from the primary too, so it sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info.pop("replica", None)
+            self.info["wrote"] = True
+        elif self.info.get("replica") is not None:
+            return self.info["replica"]
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+#shown for restaurants without a Yelp photo
+DEFAULT_RESTAURANT_PHOTO = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAM8AAADPCAMAAABlX3VtAAAAMFBMVEX19fXDvrjQzMfc2tfp5+bGwbzy8vHs6+rMyMPW08/JxcDv7u3i4N7Tz8vf3drZ1tPsNjAMAAAD8UlEQVR4nO2c25KrIBBFIwpGvP3/354RAcPVGBv1VO31ZjkqS5sWaTKvFwAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAMCDqCsa3u3dJgv9m0jnj+lumder4XQ6VTWKm3VmSps/5K0x1+pYY/V5Zv2g6/t0BtIm2JtzU8yJbr0+b556wkO0kr4Lm+Qy053yWybdgWlTrEn+7570tLuIsVQ6mu+IORMXJV4X5tzddWlBD3D4UOTsgumYu+hVVP56Ze+Xh81BBeOhKZA7E1zTX8vlG5fr8mmZ94EH7QAnT/nhz8XjkdKXu368WDQcTEBfOZ63t5C8u5qEU0l2KVWhmNOxfB/ET4jtX7EsxA/odp8Cz4df23UsavBDq6N8GPE5v6WGzy7woQM++8CHDvjsAx+F6EjLQxqCmaUffahKkR78Lp9Sw1j4EPo8cbR9xuf0xR1osh187GHwyQKfGPCxh8EnC3xipHzE0K1jgG6IlR1yPoKlSxVdek1FSZ/emdYewznZnM8yw9/Fd6laRqIaXM5HBIvFgjUDOZ9MCKs2JwozxXzayMJEv36b81kGlu9Mmy/2ac2Xp2R1PRo33gaHJUoDoko3TLV5jO8by/iIVYfPeuK/r3lEiKVvdFOlXVW3THyE8vRjPUDgsz6Q8aOMoUt4UniHVTJ6xjWVRBOCvldRV3Ubzq8n832mWGuGyr8YSzas1wEaq+voWYdosshE8BE8n/UOBjd38pvIwkemMfXYSC/pTc+MNHtKP/BDeD7qtJEoHj1NPX8QRpWplsdeMzZv8mBeak1CBOuUPB+ZuH2915HNfIgvtEamjAmJj3e0P9G26pzPBr5PmwzvzhW18zvuSqn1RfzuZdDhvOX2bp1er6+gWKPk+qTHIyr91M5humW1NRqkiSb9DpP2VCbrb4y29Q1LBehpH5WA4hVn98mpJugm8nFqmmYyM8Cqc5iXMu+WfbUzXWfi7j0Py2F6SRyNjueTGca8wz+M/mJD9/U2Nr/NVDzGJ4uJ1iyGPomhZEw8HLhuXwqCBftqM0YzyxQ3yNZ4nvLZYl8jP7t54z6+rt/GnMLtTpJuQelJn7+ePptmy85P9K3dxybVK7cxtBhGnjrsVp+FZiHxSbrsshnG/SYoX8/60edr4HMU+Ngt+MDnMPCxW/CBz2HgY7fgA5/DwMduwQc+h4GP3YLPw32aw3SP9vkR+JT3OfGzyK0q9iCfaPngO7a56gf5vMTxZLDyUV16kg8F8NkHPnTAZx/40AGffZZmSvu/9KSz5ZDZ9Ss/fnTs+twKfLKM+1f8r3xODJRJuORfjQEAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAACk+QdvISUvRNWLXgAAAABJRU5ErkJggg=="
 
 
 def connect_db(app):
@@ -18,6 +49,58 @@ def connect_db(app):
     db.app = app
     db.init_app(app)
 
+
+def upsert(model, keys, values, update, where=None):
+    """Insert a row of keys and values, or apply update to the existing row with those keys.
+
+    keys are the columns of a unique constraint of the model's table. where
+    limits which existing rows may be updated. On Postgres this is one
+    INSERT ... ON CONFLICT DO UPDATE. Elsewhere it is an UPDATE followed by
+    an INSERT ... WHERE NOT EXISTS, which is atomic on SQLite because the
+    UPDATE takes the database write lock. Runs right away in the session's
+    transaction, bypassing the ORM.
+    """
+
+    table = model.__table__
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(postgresql.insert(table).values(**keys, **values)
+                           .on_conflict_do_update(index_elements=list(keys), set_=update, where=where))
+        return
+
+    matches = and_(*[table.c[key] == value for key, value in keys.items()])
+    db.session.execute(table.update().where(matches if where is None else and_(matches, where)).values(**update))
+
+    row = {**keys, **values}
+    db.session.execute(table.insert().from_select(list(row), select([literal(value, table.c[key].type) for key, value in row.items()])
+                                                  .where(~exists().where(matches))))
+
+def insert_missing(model, keys, rows):
+    """Insert each dict of rows whose keys are not in the model's table yet, leaving stored rows as they are.
+
+    keys are the columns of a unique constraint of the model's table, and
+    every row has the same columns. Returns the number of rows inserted. On
+    Postgres this is one INSERT ... ON CONFLICT DO NOTHING. Elsewhere it is
+    one INSERT ... WHERE NOT EXISTS executed for all the rows. Either way a
+    concurrent insert of the same keys is skipped instead of raising
+    IntegrityError. Runs right away in the session's transaction, bypassing
+    the ORM.
+    """
+
+    if not rows:
+        return 0
+
+    table = model.__table__
+    if db.engine.dialect.name == "postgresql":
+        return db.session.execute(postgresql.insert(table).values(rows)
+                                  .on_conflict_do_nothing(index_elements=list(keys))).rowcount
+
+    columns = list(rows[0])
+    matches = and_(*[table.c[key] == bindparam(f"new_{key}") for key in keys])
+    return db.session.execute(table.insert().from_select(columns, select([bindparam(f"new_{column}", type_=table.c[column].type)
+                                                                         for column in columns])
+                                                         .where(~exists().where(matches))),
+                              [{f"new_{column}": value for column, value in row.items()} for row in rows]).rowcount
+
 class Cuisine(db.Model):
 
     __tablename__="cuisines"
@@ -57,12 +140,96 @@ class Meal(db.Model):
     cuisine_id=db.Column(db.Integer,db.ForeignKey("cuisines.cuisine_id",ondelete="cascade"),nullable=False)
     category_id=db.Column(db.Integer,db.ForeignKey("categories.category_id",ondelete="cascade"),nullable=False)
     image_url=db.Column(db.Text)
+    #TheMealDB idMeal, used by the catalog sync job
+    mealdb_id=db.Column(db.Text,unique=True)
+    instructions=db.Column(db.Text)
+    #lowercased name, cuisine, category and ingredients for search.py, written by the catalog sync
+    search_text=db.Column(db.Text,nullable=False,
+                          default=lambda context: context.get_current_parameters()["meal_name"].lower())
 
     def __repr__(self):
         return f"<Meal #{self.id}, {self.meal_name}, {self.cuisine_id}, {self.category_id}>"
 
     meals_liked=db.relationship("MealLiked",backref="meal",passive_deletes=True)
 
+    ingredients=db.relationship("MealIngredient",backref="meal",order_by="MealIngredient.position",
+                                cascade="all, delete-orphan",passive_deletes=True)
+
+    @property
+    def ingredient_names(self):
+        """Ingredient names in recipe order."""
+        return [ingredient.ingredient for ingredient in self.ingredients]
+
+
+class MissingExtension(Exception):
+    """The Postgres server lacks an extension the schema needs."""
+
+
+def create_pg_trgm(connection):
+    """CREATE EXTENSION pg_trgm on Postgres, raising MissingExtension if the server can't."""
+
+    if connection.dialect.name != "postgresql":
+        return
+    try:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        raise MissingExtension("meal search needs the pg_trgm extension: install the PostgreSQL contrib package "
+                               "(postgresql-contrib) on the database server and create the tables as a user "
+                               f"allowed to CREATE EXTENSION ({e.orig})") from e
+
+
+#trigram index of the search text, Postgres only (see migrations/0006_meal_search.py)
+event.listen(Meal.__table__,"before_create",lambda target,connection,**kw: create_pg_trgm(connection))
+event.listen(Meal.__table__,"after_create",
+             DDL("CREATE INDEX ix_meals_search_text_trgm ON meals USING gin (search_text gin_trgm_ops)")
+             .execute_if(dialect="postgresql"))
+
+
+class CatalogVersion(db.Model):
+    """Single row bumped by every catalog change, so workers know to rebuild their in-memory meal indexes."""
+
+    __tablename__="catalog_version"
+
+    id=db.Column(db.Integer,primary_key=True)
+    version=db.Column(db.Integer,nullable=False,default=0)
+
+    def __repr__(self):
+        return f"<CatalogVersion {self.version}>"
+
+    @classmethod
+    def current(cls):
+        """Current catalog version, 0 before the first bump."""
+
+        row=db.session.query(cls.version).filter(cls.id==1).first()
+        return row[0] if row else 0
+
+    @classmethod
+    def bump(cls):
+        """Mark the catalog as changed, committed with the caller's transaction."""
+
+        row=cls.query.get(1)
+        if row is None:
+            db.session.add(cls(id=1,version=1))
+        else:
+            row.version=cls.version+1
+
+
+class MealIngredient(db.Model):
+    """Ingredient and measure of a meal, mirrored from TheMealDB strIngredientN/strMeasureN."""
+
+    __tablename__="meal_ingredients"
+
+    id=db.Column(db.Integer,primary_key=True,autoincrement=True)
+    meal_id=db.Column(db.Integer,db.ForeignKey("meals.id",ondelete="cascade"),nullable=False)
+    position=db.Column(db.Integer,nullable=False)
+    ingredient=db.Column(db.Text,nullable=False)
+    measure=db.Column(db.Text)
+
+    __table_args__ = (db.UniqueConstraint('meal_id', 'position'),)
+
+    def __repr__(self):
+        return f"<MealIngredient #{self.id}, {self.meal_id}, {self.ingredient}, {self.measure}>"
+
 
 class MealLiked(db.Model):
 
@@ -73,7 +240,12 @@ class MealLiked(db.Model):
     user_id=db.Column(db.Integer,db.ForeignKey("users.id",ondelete="cascade"),nullable=False)
     is_active=db.Column(db.Boolean,nullable=False,default=True)
 
-    __table_args__ = (db.UniqueConstraint('meal_id', 'user_id'),)
+    #indexes are created on live databases by migrations/, keep the two in sync
+    __table_args__ = (
+        db.UniqueConstraint('meal_id', 'user_id'),
+        db.Index('ix_meals_liked_user_id_meal_id_active', 'user_id', 'meal_id',
+                 postgresql_where=is_active, sqlite_where=is_active==True),
+    )
 
     def __repr__(self):
         return f"<MealLiked #{self.id}, {self.meal_id}, {self.user_id}>"
@@ -84,29 +256,92 @@ class MealLiked(db.Model):
 
 
 
+class Restaurant(db.Model):
+    """A Yelp business, stored once however many users like it."""
+
+    __tablename__='restaurants'
+
+    yelp_id=db.Column(db.Text,primary_key=True)
+    name=db.Column(db.Text,nullable=False)
+    address=db.Column(db.Text,nullable=False)
+    rating=db.Column(db.Float)
+    url=db.Column(db.Text,nullable=False)
+    #NULL when Yelp has no photo, see photo_url
+    photo=db.Column(db.Text)
+
+    def __repr__(self):
+        return f"<Restaurant {self.yelp_id}, {self.name}>"
+
+    @property
+    def photo_url(self):
+        return self.photo or DEFAULT_RESTAURANT_PHOTO
+
+    @classmethod
+    def save(cls,yelp_id,name,address,rating,url,photo):
+        """Store a restaurant unless it is stored already, see save_all."""
+
+        cls.save_all([dict(yelp_id=yelp_id,name=name,address=address,rating=rating,url=url,photo=photo)])
+
+    @classmethod
+    def save_all(cls,restaurants):
+        """Store each dict of restaurant details whose yelp id is not stored yet.
+
+        The details come from clients and the row is shared by every user, so a
+        stored restaurant is never overwritten. Raises ValueError for urls that
+        are not http(s), they are rendered as links.
+        """
+
+        for restaurant in restaurants:
+            if urlparse(restaurant["url"]).scheme not in ("http","https"):
+                raise ValueError(f"url of restaurant {restaurant['yelp_id']!r} is not http(s)")
+
+        insert_missing(cls,["yelp_id"],[dict(restaurant,photo=restaurant.get("photo") or None) for restaurant in restaurants])
+
+
 class RestaurantMealLiked(db.Model):
 
     __tablename__='restaurants_meals_liked'
 
     id=db.Column(db.Integer,primary_key=True,autoincrement=True)
-    restaurant_name=db.Column(db.Text,nullable=False)
-    restaurant_yelp_id=db.Column(db.Text,nullable=False)
-    restaurant_address=db.Column(db.Text,nullable=False)
-    restaurant_rating=db.Column(db.Float)
-    restaurant_url=db.Column(db.Text,nullable=False)
-    restaurant_photo=db.Column(db.Text,default="data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAM8AAADPCAMAAABlX3VtAAAAMFBMVEX19fXDvrjQzMfc2tfp5+bGwbzy8vHs6+rMyMPW08/JxcDv7u3i4N7Tz8vf3drZ1tPsNjAMAAAD8UlEQVR4nO2c25KrIBBFIwpGvP3/354RAcPVGBv1VO31ZjkqS5sWaTKvFwAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAMCDqCsa3u3dJgv9m0jnj+lumder4XQ6VTWKm3VmSps/5K0x1+pYY/V5Zv2g6/t0BtIm2JtzU8yJbr0+b556wkO0kr4Lm+Qy053yWybdgWlTrEn+7570tLuIsVQ6mu+IORMXJV4X5tzddWlBD3D4UOTsgumYu+hVVP56Ze+Xh81BBeOhKZA7E1zTX8vlG5fr8mmZ94EH7QAnT/nhz8XjkdKXu368WDQcTEBfOZ63t5C8u5qEU0l2KVWhmNOxfB/ET4jtX7EsxA/odp8Cz4df23UsavBDq6N8GPE5v6WGzy7woQM++8CHDvjsAx+F6EjLQxqCmaUffahKkR78Lp9Sw1j4EPo8cbR9xuf0xR1osh187GHwyQKfGPCxh8EnC3xipHzE0K1jgG6IlR1yPoKlSxVdek1FSZ/emdYewznZnM8yw9/Fd6laRqIaXM5HBIvFgjUDOZ9MCKs2JwozxXzayMJEv36b81kGlu9Mmy/2ac2Xp2R1PRo33gaHJUoDoko3TLV5jO8by/iIVYfPeuK/r3lEiKVvdFOlXVW3THyE8vRjPUDgsz6Q8aOMoUt4UniHVTJ6xjWVRBOCvldRV3Ubzq8n832mWGuGyr8YSzas1wEaq+voWYdosshE8BE8n/UOBjd38pvIwkemMfXYSC/pTc+MNHtKP/BDeD7qtJEoHj1NPX8QRpWplsdeMzZv8mBeak1CBOuUPB+ZuH2915HNfIgvtEamjAmJj3e0P9G26pzPBr5PmwzvzhW18zvuSqn1RfzuZdDhvOX2bp1er6+gWKPk+qTHIyr91M5humW1NRqkiSb9DpP2VCbrb4y29Q1LBehpH5WA4hVn98mpJugm8nFqmmYyM8Cqc5iXMu+WfbUzXWfi7j0Py2F6SRyNjueTGca8wz+M/mJD9/U2Nr/NVDzGJ4uJ1iyGPomhZEw8HLhuXwqCBftqM0YzyxQ3yNZ4nvLZYl8jP7t54z6+rt/GnMLtTpJuQelJn7+ePptmy85P9K3dxybVK7cxtBhGnjrsVp+FZiHxSbrsshnG/SYoX8/60edr4HMU+Ngt+MDnMPCxW/CBz2HgY7fgA5/DwMduwQc+h4GP3YLPw32aw3SP9vkR+JT3OfGzyK0q9iCfaPngO7a56gf5vMTxZLDyUV16kg8F8NkHPnTAZx/40AGffZZmSvu/9KSz5ZDZ9Ss/fnTs+twKfLKM+1f8r3xODJRJuORfjQEAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAACk+QdvISUvRNWLXgAAAABJRU5ErkJggg==")
+    restaurant_yelp_id=db.Column(db.Text,db.ForeignKey("restaurants.yelp_id"),nullable=False)
     meals_liked_id=db.Column(db.Integer,db.ForeignKey("meals_liked.id",ondelete="cascade"),nullable=False)
     user_id=db.Column(db.Integer,db.ForeignKey("users.id",ondelete="cascade"),nullable=False)
     is_active=db.Column(db.Boolean,nullable=False,default=True)
 
     
-    __table_args__ = (db.UniqueConstraint('meals_liked_id', 'restaurant_yelp_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('meals_liked_id', 'restaurant_yelp_id'),
+        db.Index('ix_restaurants_meals_liked_user_id_meals_liked_id', 'user_id', 'meals_liked_id'),
+        db.Index('ix_restaurants_meals_liked_user_id_restaurant_yelp_id_active', 'user_id', 'restaurant_yelp_id',
+                 postgresql_where=is_active, sqlite_where=is_active==True),
+    )
+
+    #always needed with the row, so it comes in the same query
+    restaurant=db.relationship("Restaurant",lazy="joined")
+
+    @property
+    def restaurant_name(self):
+        return self.restaurant.name
+
+    @property
+    def restaurant_address(self):
+        return self.restaurant.address
+
+    @property
+    def restaurant_rating(self):
+        return self.restaurant.rating
 
+    @property
+    def restaurant_url(self):
+        return self.restaurant.url
 
+    @property
+    def restaurant_photo(self):
+        return self.restaurant.photo_url
 
     def __repr__(self):
         p=self
-        return f"<RestaurantMealLiked #{p.id}, {p.restaurant_name}, {p.restaurant_yelp_id}, {p.meals_liked_id}>"
+        return f"<RestaurantMealLiked #{p.id}, {p.restaurant_yelp_id}, {p.meals_liked_id}>"
 
 
 class Message(db.Model):
@@ -117,8 +352,23 @@ class Message(db.Model):
     user_id=db.Column(db.Integer,db.ForeignKey("users.id",ondelete="cascade"),nullable=False)
     text=db.Column(db.Text,nullable=False)
     meals_liked_id=db.Column(db.Integer,db.ForeignKey("meals_liked.id",ondelete="cascade"), nullable=False)
-    restaurant_info=db.Column(db.Text,nullable=False)
-    timestamp = db.Column(db.DateTime,nullable=False,default=datetime.utcnow())
+    #yelp id of the restaurant the meal was eaten at, if any
+    restaurant_info=db.Column(db.Text,db.ForeignKey("restaurants.yelp_id"))
+    timestamp = db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+    #number of rows in likes for this message, kept in step by Like.toggle and the Like events below
+    like_count=db.Column(db.Integer,nullable=False,default=0,server_default="0")
+
+    #keyset pagination (see feeds.py) of the home page, user and meal review lists
+    __table_args__ = (
+        db.Index('ix_messages_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_messages_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_meals_liked_id_timestamp_id', 'meals_liked_id', 'timestamp', 'id'),
+    )
+
+    restaurant=db.relationship("Restaurant")
+
+    #read only, likes are written through Like so the counters see them
+    user_likes=db.relationship("User",secondary="likes",viewonly=True)
 
     def __repr__(self):
         p=self
@@ -145,14 +395,164 @@ class Like(db.Model):
         db.ForeignKey('messages.id', ondelete='cascade'),
     )
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'message_id'),)
+    #like counts are aggregated per message
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
 
     def __repr__(self):
         p=self
         return f"<Like #{p.id}, {p.user_id}, {p.message_id}>"
 
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like a message, or unlike it if the user already does. Returns whether it is liked now.
+
+        An insert that skips an existing (user_id, message_id) row, and a
+        delete when it did, however many likes the message has. Runs right
+        away, like insert_missing, so two clicks at once never hit the unique
+        constraint; the counters change with the row that was actually written.
+        """
+
+        likes=cls.__table__
+        if insert_missing(cls,["user_id","message_id"],[dict(user_id=user_id,message_id=message_id)]):
+            change_like_counts(db.session.connection(),[message_id],1)
+            return True
+
+        if db.session.execute(likes.delete().where(and_(likes.c.user_id==user_id,likes.c.message_id==message_id))).rowcount:
+            change_like_counts(db.session.connection(),[message_id],-1)
+        return False
+
     
 
+class MealStats(db.Model):
+    """Review and favorite totals of a meal, so meal pages read them with one primary key lookup.
+
+    Like and message writes adjust review_count and review_likes by their
+    delta (see the events at the bottom). Favorite writes, whose delta is not
+    known after an upsert or a set-based UPDATE, recompute the meals they
+    touched with refresh(), which also keeps MealRestaurantStats.
+    """
+
+    __tablename__="meal_stats"
+
+    meal_id=db.Column(db.Integer,db.ForeignKey("meals.id",ondelete="cascade"),primary_key=True)
+    review_count=db.Column(db.Integer,nullable=False,default=0)
+    #sum of like_count of the reviews
+    review_likes=db.Column(db.Integer,nullable=False,default=0)
+    #users with the meal in their active favorites
+    liked_by=db.Column(db.Integer,nullable=False,default=0)
+
+    meal=db.relationship("Meal",backref=db.backref("stats",uselist=False))
+
+    def __repr__(self):
+        p=self
+        return f"<MealStats {p.meal_id}, {p.review_count}, {p.review_likes}, {p.liked_by}>"
+
+    @classmethod
+    def refresh(cls,connection,meal_ids):
+        """Recompute the stats of meal_ids (a list or a select of ids) from the source tables.
+
+        The rows are kept and updated in place. On Postgres the first statement
+        locks them until commit, so concurrent refreshes of a meal take turns
+        and each recounts after the one before it committed.
+        """
+
+        if isinstance(meal_ids,(list,set,tuple)):
+            meal_ids=sorted(meal_ids)
+            if not meal_ids:
+                return
+
+        meals,meals_liked,messages=Meal.__table__,MealLiked.__table__,Message.__table__
+        restaurants_meals_liked=RestaurantMealLiked.__table__
+        stats,pairings=cls.__table__,MealRestaurantStats.__table__
+
+        #a row for every meal, each locked (a no-op update) on Postgres
+        columns=["meal_id","review_count","review_likes","liked_by"]
+        rows=select([meals.c.id,literal(0),literal(0),literal(0)]).where(meals.c.id.in_(meal_ids)).order_by(meals.c.id)
+        if connection.dialect.name == "postgresql":
+            insert=postgresql.insert(stats).from_select(columns,rows)
+            connection.execute(insert.on_conflict_do_update(index_elements=["meal_id"],set_={"meal_id":insert.excluded.meal_id}))
+        else:
+            connection.execute(stats.insert().from_select(columns,rows.where(~exists().where(stats.c.meal_id==meals.c.id))))
+
+        def of_meal(column):
+            #aggregate over the meal's reviews
+            return (select([column]).select_from(messages.join(meals_liked,messages.c.meals_liked_id==meals_liked.c.id))
+                    .where(meals_liked.c.meal_id==stats.c.meal_id).as_scalar())
+
+        liked_by=(select([func.count()]).where(meals_liked.c.meal_id==stats.c.meal_id)
+                  .where(meals_liked.c.is_active==True).as_scalar())
+
+        #a statement of its own, so it counts what the transactions that held the locks before committed
+        connection.execute(stats.update().where(stats.c.meal_id.in_(meal_ids)).values(
+            review_count=of_meal(func.count()),review_likes=of_meal(func.coalesce(func.sum(messages.c.like_count),0)),
+            liked_by=liked_by))
+
+        active_pairs=(restaurants_meals_liked.join(meals_liked,restaurants_meals_liked.c.meals_liked_id==meals_liked.c.id),
+                      and_(meals_liked.c.is_active==True,restaurants_meals_liked.c.is_active==True))
+
+        connection.execute(pairings.update().where(pairings.c.meal_id.in_(meal_ids)).values(
+            pairings=select([func.count()]).select_from(active_pairs[0]).where(active_pairs[1])
+            .where(meals_liked.c.meal_id==pairings.c.meal_id)
+            .where(restaurants_meals_liked.c.restaurant_yelp_id==pairings.c.restaurant_yelp_id).as_scalar()))
+        connection.execute(pairings.insert().from_select(
+            ["meal_id","restaurant_yelp_id","pairings"],
+            select([meals_liked.c.meal_id,restaurants_meals_liked.c.restaurant_yelp_id,func.count()])
+            .select_from(active_pairs[0])
+            .where(meals_liked.c.meal_id.in_(meal_ids))
+            .where(active_pairs[1])
+            .where(~exists().where(and_(pairings.c.meal_id==meals_liked.c.meal_id,
+                                        pairings.c.restaurant_yelp_id==restaurants_meals_liked.c.restaurant_yelp_id)))
+            .group_by(meals_liked.c.meal_id,restaurants_meals_liked.c.restaurant_yelp_id)))
+        connection.execute(pairings.delete().where(pairings.c.meal_id.in_(meal_ids)).where(pairings.c.pairings==0))
+
+    @classmethod
+    def top_restaurants(cls,meal_id,limit=5):
+        """(Restaurant, pairings) of the restaurants users paired with the meal most, from the pairings index."""
+
+        return (db.session.query(Restaurant,MealRestaurantStats.pairings)
+                .join(MealRestaurantStats,MealRestaurantStats.restaurant_yelp_id==Restaurant.yelp_id)
+                .filter(MealRestaurantStats.meal_id==meal_id)
+                .order_by(MealRestaurantStats.pairings.desc(),Restaurant.name)
+                .limit(limit).all())
+
+
+class MealRestaurantStats(db.Model):
+    """Number of users who favorited a restaurant for a meal, see MealStats."""
+
+    __tablename__="meal_restaurant_stats"
+
+    meal_id=db.Column(db.Integer,db.ForeignKey("meals.id",ondelete="cascade"),primary_key=True)
+    restaurant_yelp_id=db.Column(db.Text,db.ForeignKey("restaurants.yelp_id",ondelete="cascade"),primary_key=True)
+    pairings=db.Column(db.Integer,nullable=False)
+
+    __table_args__ = (db.Index('ix_meal_restaurant_stats_meal_id_pairings','meal_id','pairings'),)
+
+    def __repr__(self):
+        p=self
+        return f"<MealRestaurantStats {p.meal_id}, {p.restaurant_yelp_id}, {p.pairings}>"
+
+
+class SeenMeals(db.Model):
+    """Bitsets of the meals a user was shown by the roulette, written in batches by seen.py.
+
+    Bit i of current and previous is meal id i, for the window numbered
+    epoch and the one before it. Stored little-endian.
+    """
+
+    __tablename__="seen_meals"
+
+    user_id=db.Column(db.Integer,db.ForeignKey("users.id",ondelete="cascade"),primary_key=True)
+    epoch=db.Column(db.Integer,nullable=False)
+    current=db.Column(db.LargeBinary,nullable=False)
+    previous=db.Column(db.LargeBinary,nullable=False)
+
+    def __repr__(self):
+        return f"<SeenMeals {self.user_id}, {self.epoch}>"
+
+
 class User(db.Model):
     """User in the system."""
 
@@ -189,6 +589,14 @@ class User(db.Model):
         nullable=False,
     )
 
+    #likes on this user's messages, the sum of their like_count
+    likes_received = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     meals_liked=db.relationship("MealLiked",backref="user",passive_deletes=True)
 
     meals_liked_list=db.relationship("Meal",secondary="meals_liked",backref='users_liked',passive_deletes=True)
@@ -198,9 +606,10 @@ class User(db.Model):
 
     restaurants_meals_liked=db.relationship("RestaurantMealLiked",backref="users",passive_deletes=True)
 
+    #read only, see Like.toggle
     likes = db.relationship(
         'Message',
-        secondary="likes",backref="user_likes",passive_deletes=True
+        secondary="likes",viewonly=True
     )
 
     def __repr__(self):
@@ -244,4 +653,79 @@ class User(db.Model):
             if is_auth:
                 return user
 
-        return False
\ No newline at end of file
+        return False
+
+
+#like counters change in the same transaction as the likes rows. Rows removed
+#by ON DELETE CASCADE never reach the ORM, so deleting a message or a user
+#settles the counters first.
+
+def change_like_counts(connection, message_ids, delta):
+    """Add delta to the like_count of messages, to their authors' likes_received and to their meals' review_likes."""
+
+    messages, users = Message.__table__, User.__table__
+    meals_liked, stats = MealLiked.__table__, MealStats.__table__
+    meal_messages = messages.join(meals_liked, messages.c.meals_liked_id==meals_liked.c.id)
+
+    connection.execute(stats.update()
+                       .where(stats.c.meal_id.in_(select([meals_liked.c.meal_id]).select_from(meal_messages)
+                                                  .where(messages.c.id.in_(message_ids))))
+                       .values(review_likes=stats.c.review_likes+delta*
+                               select([func.count()]).select_from(meal_messages).where(messages.c.id.in_(message_ids))
+                                                     .where(meals_liked.c.meal_id==stats.c.meal_id).as_scalar()))
+
+    connection.execute(users.update()
+                       .where(users.c.id.in_(select([messages.c.user_id]).where(messages.c.id.in_(message_ids))))
+                       .values(likes_received=users.c.likes_received+delta*
+                               select([func.count()]).where(messages.c.id.in_(message_ids))
+                                                     .where(messages.c.user_id==users.c.id).as_scalar()))
+    connection.execute(messages.update().where(messages.c.id.in_(message_ids))
+                       .values(like_count=messages.c.like_count+delta))
+
+
+@event.listens_for(Like, "after_insert")
+def count_like(mapper, connection, like):
+    change_like_counts(connection, [like.message_id], 1)
+
+
+@event.listens_for(Like, "after_delete")
+def uncount_like(mapper, connection, like):
+    change_like_counts(connection, [like.message_id], -1)
+
+
+def message_meal_id(message):
+    meals_liked = MealLiked.__table__
+    return select([meals_liked.c.meal_id]).where(meals_liked.c.id==message.meals_liked_id).as_scalar()
+
+
+@event.listens_for(Message, "after_insert")
+def count_message(mapper, connection, message):
+    stats = MealStats.__table__
+    connection.execute(stats.update().where(stats.c.meal_id==message_meal_id(message))
+                       .values(review_count=stats.c.review_count+1))
+
+
+@event.listens_for(Message, "before_delete")
+def uncount_message_likes(mapper, connection, message):
+    messages, users, stats = Message.__table__, User.__table__, MealStats.__table__
+    like_count = select([messages.c.like_count]).where(messages.c.id==message.id).as_scalar()
+    connection.execute(users.update().where(users.c.id==message.user_id)
+                       .values(likes_received=users.c.likes_received-like_count))
+    connection.execute(stats.update().where(stats.c.meal_id==message_meal_id(message))
+                       .values(review_count=stats.c.review_count-1, review_likes=stats.c.review_likes-like_count))
+
+
+@event.listens_for(User, "before_delete")
+def uncount_user_likes(mapper, connection, user):
+    likes, meals_liked = Like.__table__, MealLiked.__table__
+    change_like_counts(connection, select([likes.c.message_id]).where(likes.c.user_id==user.id), -1)
+
+    #their favorites and reviews go with them, the stats of those meals are recomputed after the delete
+    user._stats_meal_ids = [meal_id for (meal_id,) in connection.execute(
+        select([meals_liked.c.meal_id]).where(meals_liked.c.user_id==user.id))]
+
+
+@event.listens_for(User, "after_delete")
+def refresh_user_meal_stats(mapper, connection, user):
+    MealStats.refresh(connection, user._stats_meal_ids)
+
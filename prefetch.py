@@ -0,0 +1,176 @@
+"""Per-user prefetch buffers for the roulette.
+
+Every spin (first visit or "Pass it") of /cuisines/<id>, /categories/<id>,
+/surprise-me and /for-you pops an already resolved meal from a buffer keyed by
+(user, mode, key, ingredient filters). When a buffer runs low it is refilled
+in a background thread, so the next spin is served from memory.
+
+Every spin served is marked seen (see seen.py), so the next spins skip it.
+A buffered spin is served with the user's liked state read again, as a
+favorite changed on another worker doesn't drop this worker's buffers, and
+only while the meal catalog is at the version it was resolved from.
+Buffered meals are detached from their session. They are loaded with
+everything the roulette templates use (cuisine, category, ingredients), so
+touching them never triggers a lazy load.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from meal_index import meal_index
+from models import db, Meal, MealLiked
+from sampler import sampler
+from seen import seen
+
+
+PREFETCH_SIZE = int(os.environ.get('PREFETCH_SIZE', 5))
+#refill when a buffer has fewer spins than this
+PREFETCH_LOW_WATER = int(os.environ.get('PREFETCH_LOW_WATER', 2))
+#buffers of the least recently active users are dropped beyond this
+PREFETCH_MAX_BUFFERS = int(os.environ.get('PREFETCH_MAX_BUFFERS', 10000))
+
+Spin = namedtuple("Spin", ["meal_object", "user_liked_meal", "ingredients", "catalog_version"])
+
+
+def liked_meal(user_id, meal_id):
+    """The user's MealLiked row of the meal, None if they never liked it."""
+
+    ####it is going to be used to check soft deletes: user_liked_meal.is_active
+    return MealLiked.query.filter(MealLiked.user_id==user_id,MealLiked.meal_id==meal_id).first()
+
+
+def resolve_spin(user_id, mode, key=None, filters=None):
+    """Pick a random meal for mode ("cuisine", "category", "surprise" or "for-you") and resolve everything the page needs.
+
+    filters is an optional meal_index.IngredientFilter.
+    """
+
+    #one retry in case the meal was deleted after the index was built
+    for attempt in range(2):
+        meal_id=sampler.pick(user_id,mode,key,filters)
+        if meal_id is None:
+            return None
+
+        meal_object=Meal.query.options(joinedload(Meal.cuisine),joinedload(Meal.category),
+                                       selectinload(Meal.ingredients)).get(meal_id)
+        if meal_object is not None:
+            break
+        meal_index.invalidate()
+    else:
+        return None
+
+    return Spin(meal_object,liked_meal(user_id,meal_object.id),meal_object.ingredient_names,meal_index.version)
+
+
+class PrefetchQueue:
+    """Buffers of resolved spins per (user_id, mode, key, filters)."""
+
+    def __init__(self, app, resolve=resolve_spin, size=PREFETCH_SIZE, low_water=PREFETCH_LOW_WATER,
+                 max_buffers=PREFETCH_MAX_BUFFERS, workers=2):
+        self.app = app
+        self.resolve = resolve
+        self.size = size
+        self.low_water = low_water
+        self.max_buffers = max_buffers
+
+        self.buffers = OrderedDict()
+        self.refilling = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def next(self, user_id, mode, key=None, filters=None):
+        """Next spin for the user, from the buffer if possible. Returns None if there is no meal to pick."""
+
+        buffer_key = (user_id, mode, key, filters)
+        seen_bits = seen.bits(user_id)
+        meal_index.refresh()
+        version = meal_index.version
+
+        with self.lock:
+            buffer = self.buffers.get(buffer_key)
+            if buffer is None:
+                buffer = self.buffers[buffer_key] = deque()
+                while len(self.buffers) > self.max_buffers:
+                    self.buffers.popitem(last=False)
+            self.buffers.move_to_end(buffer_key)
+
+            #skip spins the user was shown since they were buffered, e.g. by a spin that didn't wait for the refill,
+            #and spins of an older catalog
+            spin = None
+            while buffer and spin is None:
+                spin = buffer.popleft()
+                if spin.catalog_version != version or seen_bits >> spin.meal_object.id & 1:
+                    spin = None
+            low = len(buffer) < self.low_water
+
+        if spin is None:
+            spin = self.resolve(user_id, mode, key, filters)
+        else:
+            spin = spin._replace(user_liked_meal=liked_meal(user_id, spin.meal_object.id))
+
+        if spin is not None:
+            #the sampler skips it from now on
+            seen.mark(user_id, spin.meal_object.id)
+
+        if spin is not None and low:
+            self.refill_in_background(buffer_key)
+
+        return spin
+
+    def invalidate(self, user_id):
+        """Drop the buffers of a user, their liked state is out of date."""
+
+        with self.lock:
+            for buffer_key in [buffer_key for buffer_key in self.buffers if buffer_key[0] == user_id]:
+                del self.buffers[buffer_key]
+
+    def reset(self):
+        """Drop every buffer. Refills already running find theirs gone and skip it."""
+
+        with self.lock:
+            self.buffers.clear()
+
+    def refill_in_background(self, buffer_key):
+        with self.lock:
+            if buffer_key in self.refilling:
+                return
+            self.refilling.add(buffer_key)
+
+        self.executor.submit(self.refill, buffer_key)
+
+    def refill(self, buffer_key):
+        """Top the buffer up to size, in its own app context and session."""
+
+        try:
+            with self.app.app_context():
+                spins = []
+                with self.lock:
+                    buffer = self.buffers.get(buffer_key)
+                    missing = self.size-len(buffer) if buffer is not None else 0
+                    queued = {spin.meal_object.id for spin in buffer or ()}
+
+                #a few extra tries so the buffer doesn't hold the same meal twice
+                for attempt in range(missing*2):
+                    if len(spins) == missing:
+                        break
+                    spin = self.resolve(*buffer_key)
+                    if spin is None:
+                        break
+                    if spin.meal_object.id not in queued:
+                        queued.add(spin.meal_object.id)
+                        spins.append(spin)
+
+                #closing the session detaches the loaded meals
+                db.session.remove()
+
+                with self.lock:
+                    #skip if the buffer was invalidated (and maybe recreated) while we were resolving
+                    if buffer is not None and self.buffers.get(buffer_key) is buffer:
+                        buffer.extend(spins[:self.size-len(buffer)])
+        finally:
+            with self.lock:
+                self.refilling.discard(buffer_key)
@@ -0,0 +1,248 @@
+"""Item-item collaborative filtering over favorite meals, for the "for you" roulette.
+
+The user x meal matrix X has a 1 where a user has the meal in their active
+favorites. The recommender keeps the meal x meal co-occurrence matrix
+C = X^T X (C[i, j] is the number of users who like both meals, C[i, i] the
+number who like meal i) and each user's liked meal positions. Similarity is
+cosine, C[i, j] / sqrt(C[i, i] * C[j, j]), and a user's score for a meal is
+its summed similarity to the meals they like, so scoring a user reads only
+the rows of their own likes.
+
+The catalog is a few hundred meals, so C is a small dense array and X is
+never materialized beyond BUILD_CHUNK users at a time; a full build is a few
+BLAS products even at a million favorites. After that, sync_user() applies
+a user's changes as the difference of their outer products, touching only
+the rows and columns of the meals they like. Each worker syncs the users it
+serves and rebuilds from scratch every RECOMMENDER_MAX_AGE_SECONDS to pick up
+favorites made on other workers.
+
+Only the sync runs on a favorite change. A change that finds the matrix
+missing, old or built for another catalog starts a rebuild in a background
+thread instead, in the app's context; users synced while it runs are synced
+again on the new matrix. The "for you" spin still builds a missing matrix
+itself, since it can't score without one.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from meal_index import meal_index
+from models import db, MealLiked
+
+
+MAX_AGE_SECONDS = float(os.environ.get('RECOMMENDER_MAX_AGE_SECONDS', 600))
+#the "for you" roulette spins over this many best scored meals, weighted by score (see sampler.py)
+TOP_MEALS = int(os.environ.get('RECOMMENDER_TOP_MEALS', 20))
+#users per dense block of X during a full build
+BUILD_CHUNK = 4096
+
+EMPTY = np.zeros(0, dtype=np.intp)
+
+logger = logging.getLogger(__name__)
+
+
+def cooccurrence(users, positions, n):
+    """X^T X of the (user, meal position) pairs, users sorted, one dense block of BUILD_CHUNK users at a time."""
+
+    counts = np.zeros((n, n), dtype=np.float64)
+    #row of each pair within X
+    rows = np.unique(users, return_inverse=True)[1]
+    for start in range(0, rows[-1]+1 if len(rows) else 0, BUILD_CHUNK):
+        lo, hi = np.searchsorted(rows, [start, start+BUILD_CHUNK])
+        block = np.zeros((BUILD_CHUNK, n), dtype=np.float32)
+        block[rows[lo:hi]-start, positions[lo:hi]] = 1
+        counts += block.T @ block
+    return counts.astype(np.int32)
+
+
+class Recommender:
+    """Meal co-occurrence counts and liked meal positions per user."""
+
+    def __init__(self, max_age=MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.built_at = None
+        self.version = None
+        self.meal_ids = EMPTY
+        self.positions = {}
+        self.counts = np.zeros((0, 0), dtype=np.int32)
+        self.user_meals = {}
+        #users synced while a build runs, None when none runs
+        self.resync = None
+        self.app = None
+        self.building = False
+        self.builder = None
+
+    def build(self):
+        """Load every active favorite and compute C from scratch. Needs an app context."""
+
+        with self.lock:
+            self.resync = set()
+        meal_index.refresh()
+        version, meal_ids = meal_index.version, np.array(meal_index.all_ids, dtype=np.int64)
+        positions = {meal_id: position for position, meal_id in enumerate(meal_ids.tolist())}
+
+        pairs = np.array(db.session.query(MealLiked.user_id, MealLiked.meal_id)
+                         .filter(MealLiked.is_active == True).order_by(MealLiked.user_id, MealLiked.meal_id).all(),
+                         dtype=np.int64).reshape(-1, 2)
+        #meal ids are sorted, so their positions are a binary search; drop meals the index doesn't have yet
+        liked = np.searchsorted(meal_ids, pairs[:, 1]).clip(0, max(len(meal_ids)-1, 0))
+        known = meal_ids[liked] == pairs[:, 1] if len(meal_ids) else np.zeros(len(pairs), dtype=bool)
+        users, liked = pairs[known, 0], liked[known]
+        counts = cooccurrence(users, liked, len(meal_ids))
+
+        #split the sorted pairs into each user's positions
+        starts = np.flatnonzero(np.diff(users, prepend=-1)) if len(users) else EMPTY
+        user_meals = {int(users[start]): meals for start, meals in zip(starts, np.split(liked, starts[1:]))}
+
+        with self.lock:
+            self.meal_ids, self.positions, self.counts, self.user_meals = meal_ids, positions, counts, user_meals
+            self.version, self.built_at = version, time.time()
+            resync, self.resync = self.resync, None
+
+        #their changes may have missed the favorites loaded above
+        for user_id in sorted(resync or ()):
+            self.sync_user(user_id)
+
+    def init_app(self, app):
+        """Rebuild in a background thread in app's context when a favorite change finds the matrix out of date."""
+
+        self.app = app
+
+    def rebuild_in_background(self):
+        if self.app is None:
+            return
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+            self.builder = threading.Thread(target=self.rebuild, name="recommender-build", daemon=True)
+        self.builder.start()
+
+    def rebuild(self):
+        """build() in the app's context and a session of its own."""
+
+        try:
+            with self.app.app_context():
+                try:
+                    self.build()
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception("rebuilding the recommender failed, retrying with the next change")
+        finally:
+            with self.lock:
+                self.building = False
+
+    def invalidate(self):
+        """Rebuild on next use."""
+
+        with self.lock:
+            self.built_at = None
+
+    def reset(self):
+        """Wait for a background rebuild to finish, then rebuild on next use."""
+
+        builder = self.builder
+        if builder is not None:
+            builder.join()
+        self.invalidate()
+
+    def stale(self):
+        return self.built_at is None or time.time()-self.built_at >= self.max_age or meal_index.version != self.version
+
+    def refresh(self):
+        """Build if never built, too old, or the meal catalog changed."""
+
+        meal_index.refresh()
+        if self.stale():
+            self.build()
+
+    def sync_user(self, user_id):
+        """Bring a user's row of X up to date with the database, adjusting C by the change only.
+
+        Never builds: an out of date matrix is rebuilt in the background (see
+        init_app). Returns the user's liked positions, None if there is no
+        matrix for the current catalog to adjust.
+        """
+
+        with self.lock:
+            if self.resync is not None:
+                self.resync.add(user_id)
+        if self.stale():
+            self.rebuild_in_background()
+        if self.built_at is None or meal_index.version != self.version:
+            return None
+
+        liked = np.array(sorted(self.positions[meal_id] for (meal_id,) in
+                                db.session.query(MealLiked.meal_id)
+                                .filter(MealLiked.user_id == user_id, MealLiked.is_active == True)
+                                if meal_id in self.positions), dtype=np.intp)
+        self.apply(user_id, liked)
+        return liked
+
+    def apply(self, user_id, liked):
+        """Set a user's sorted liked meal positions, C += x_after x_after^T - x_before x_before^T."""
+
+        with self.lock:
+            before = self.user_meals.get(user_id, EMPTY)
+            if np.array_equal(before, liked):
+                return
+            np.add.at(self.counts, np.ix_(liked, liked), 1)
+            np.subtract.at(self.counts, np.ix_(before, before), 1)
+            if len(liked):
+                self.user_meals[user_id] = liked
+            else:
+                self.user_meals.pop(user_id, None)
+
+    def scores(self, user_id):
+        """Score of every meal (in meal_ids order) for the user, 0 for meals they like. None if they like none."""
+
+        #only a missing matrix is built here, an old one scores until sync_user's background rebuild replaces it
+        meal_index.refresh()
+        if self.built_at is None:
+            self.build()
+        liked = self.sync_user(user_id)
+        return self.score_positions(liked) if liked is not None else None
+
+    def score_positions(self, liked):
+        """Summed similarity of every meal to the meals at the liked positions, None if there are none."""
+
+        if not len(liked):
+            return None
+
+        with self.lock:
+            rows = self.counts[liked].astype(np.float64)
+            norms = np.sqrt(np.diagonal(self.counts).astype(np.float64))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarity = rows / norms[liked, None] / norms[None, :]
+        scores = np.nan_to_num(similarity).sum(axis=0)
+        scores[liked] = 0
+        return scores
+
+    def recommend(self, user_id, limit=TOP_MEALS, candidates=None):
+        """Up to limit (meal_id, score) with a positive score, best first, optionally only among candidate meal ids."""
+
+        scores = self.scores(user_id)
+        #after scoring, which builds a missing matrix
+        meal_ids = self.meal_ids
+        #None, or built for another catalog by a rebuild in between
+        if scores is None or len(scores) != len(meal_ids):
+            return []
+
+        if candidates is not None:
+            keep = np.zeros(len(scores), dtype=bool)
+            keep[[self.positions[meal_id] for meal_id in candidates if meal_id in self.positions]] = True
+            scores = np.where(keep, scores, 0)
+
+        best = np.argsort(-scores, kind="stable")[:limit]
+        best = best[scores[best] > 0]
+        return list(zip(meal_ids[best].tolist(), scores[best].tolist()))
+
+
+recommender = Recommender()
@@ -0,0 +1,96 @@
+"""Route read-only requests to read replicas.
+
+Replicas are Flask-SQLAlchemy binds named replica_1, replica_2, ..., set
+from the comma separated DATABASE_REPLICA_URLS. A GET or HEAD request reads
+from one of them, picked at random per request; any other request, and
+anything a GET request writes, goes to the primary (see
+models.RoutingSession). Without replicas every request uses the primary.
+
+Replicas lag behind the primary, so after a request that writes, the user's
+session cookie pins their reads to the primary for REPLICA_STICKY_SECONDS.
+Requests that write nothing, and every request without replicas, leave the
+cookie as it is.
+The pin travels with the user, so it holds whichever worker serves the next
+request.
+
+For a local two-database setup, create a second database, point
+DATABASE_REPLICA_URLS at it and copy the primary into it with
+
+    python replicas.py --copy
+
+Copies are snapshots; run it again to refresh them.
+"""
+
+import os
+import random
+import sys
+import time
+
+from flask import request, session
+
+from models import db
+
+
+STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+#session key of the time until which the user reads from the primary
+STICKY_KEY = "primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries of comma separated replica URLs."""
+
+    urls = [url.strip().replace("postgres://", "postgresql://", 1) for url in urls.split(",") if url.strip()]
+    return {f"replica_{i}": url for i, url in enumerate(urls, 1)}
+
+
+def replica_keys(app):
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith("replica_"))
+
+
+def replica_engines(app):
+    return [db.get_engine(app, key) for key in replica_keys(app)]
+
+
+def init_app(app):
+    """Route each request of app to a replica or the primary."""
+
+    @app.before_request
+    def read_from_replica():
+        if request.method not in SAFE_METHODS or time.time() < session.get(STICKY_KEY, 0):
+            return
+        keys = replica_keys(app)
+        if keys:
+            db.session().info["replica"] = db.get_engine(app, random.choice(keys))
+
+    @app.after_request
+    def stick_to_primary(response):
+        #without replicas, or without writes, the session cookie is left as it is
+        if replica_keys(app) and db.session().info.get("wrote"):
+            session[STICKY_KEY] = time.time()+STICKY_SECONDS
+        return response
+
+
+def copy_to_replicas(app):
+    """Replace every table of each replica with the primary's rows. Returns the number of replicas copied."""
+
+    engines = replica_engines(app)
+    tables = db.metadata.sorted_tables
+    for engine in engines:
+        db.metadata.create_all(bind=engine)
+        with engine.begin() as replica, db.engine.connect() as primary:
+            for table in reversed(tables):
+                replica.execute(table.delete())
+            for table in tables:
+                rows = [dict(row) for row in primary.execute(table.select())]
+                if rows:
+                    replica.execute(table.insert(), rows)
+    return len(engines)
+
+
+if __name__ == "__main__":
+    from app import app
+
+    if "--copy" not in sys.argv[1:]:
+        sys.exit("usage: python replicas.py --copy")
+    print(f"copied the primary to {copy_to_replicas(app)} replica(s)")
@@ -0,0 +1,234 @@
+"""Weighted roulette draws that skip the user's favorites, with Walker's alias method.
+
+A bucket is what a spin draws from: the meals of a cuisine, of a category or
+all meals (meal_index modes), narrowed by ingredient filters. Each bucket gets
+an AliasTable weighted by popularity, 1 + the number of users who have the
+meal in their favorites (MealStats.liked_by), so every meal stays possible.
+A draw is one random number and two array reads, whatever the bucket size.
+
+Meals the user already likes are left out of the table instead of being
+redrawn: a user who likes meals of a bucket gets their own table over the
+rest of it, built once and cached until their favorites change
+(forget_user) or the bucket's weights do. If they like every meal of the
+bucket they draw from the shared table, so a spin still shows a meal.
+
+When a meal's popularity changes (meals_changed), only the buckets that
+contain it are rebuilt, on their next draw. The "for-you" mode is a per-user
+table weighted by recommender scores instead. Each worker reloads all
+weights every SAMPLER_MAX_AGE_SECONDS to pick up other workers' changes.
+
+Meals the user was recently shown (see seen.py) change with every spin, so
+they are skipped by drawing again, at most SEEN_TRIES times; after that the
+draw is from a table built over the unseen meals only, and once the user has
+seen the whole bucket it starts over.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from meal_index import meal_index
+from models import db, MealLiked, MealStats
+from recommender import recommender
+from seen import seen
+
+
+MAX_AGE_SECONDS = float(os.environ.get('SAMPLER_MAX_AGE_SECONDS', 600))
+#per-user tables of the least recently spinning users are dropped beyond this
+MAX_USERS = int(os.environ.get('SAMPLER_MAX_USERS', 10000))
+#draws that may land on seen meals before drawing from a table of the unseen ones
+SEEN_TRIES = 8
+
+
+class AliasTable:
+    """Items drawn in O(1) with probability proportional to their weight (Vose's variant of Walker's method)."""
+
+    __slots__ = ("items", "weights", "prob", "alias")
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = float(sum(weights))
+        if not n or total <= 0:
+            raise ValueError("an alias table needs items with a positive total weight")
+
+        self.items = list(items)
+        self.weights = list(weights)
+        self.prob = [1.0]*n
+        self.alias = list(range(n))
+
+        #scaled so the average column holds exactly 1
+        scaled = [weight*n/total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1-scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        #what is left is 1 up to rounding
+        for i in small+large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, rng=random):
+        u = rng.random()*len(self.items)
+        i = int(u)
+        return self.items[i] if u-i < self.prob[i] else self.items[self.alias[i]]
+
+
+class Sampler:
+    """Alias tables per bucket, and per user for the buckets they like meals of."""
+
+    def __init__(self, max_age=MAX_AGE_SECONDS, max_users=MAX_USERS):
+        self.max_age = max_age
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded_at = None
+        self.popularity = {}
+        #bucket -> AliasTable, meal id -> buckets holding it, bucket -> times rebuilt
+        self.tables = {}
+        self.buckets_of = {}
+        self.generations = {}
+        #user id -> {"liked": frozenset of meal ids, "tables": {bucket: (generation, table the user draws from)}}
+        self.users = OrderedDict()
+
+    def load(self):
+        """Reload popularity and drop every table. Needs an app context."""
+
+        popularity = dict(db.session.query(MealStats.meal_id, MealStats.liked_by))
+        with self.lock:
+            self.popularity = popularity
+            self.tables, self.buckets_of, self.generations = {}, {}, {}
+            self.users.clear()
+            self.version, self.loaded_at = meal_index.version, time.time()
+
+    def reset(self):
+        """Forget every table, user and popularity count, reloading on next use."""
+
+        with self.lock:
+            self.popularity = {}
+            self.tables, self.buckets_of, self.generations = {}, {}, {}
+            self.users.clear()
+            self.version, self.loaded_at = None, None
+
+    def refresh(self):
+        meal_index.refresh()
+        if self.loaded_at is None or time.time()-self.loaded_at >= self.max_age or meal_index.version != self.version:
+            self.load()
+
+    def weight(self, meal_id):
+        return 1+self.popularity.get(meal_id, 0)
+
+    def bucket_table(self, bucket):
+        """(generation, shared table) of a (mode, key, filters) bucket, None as table for empty buckets."""
+
+        with self.lock:
+            if bucket in self.tables:
+                return self.generations.get(bucket, 0), self.tables[bucket]
+
+        ids = meal_index.ids(*bucket)
+        table = AliasTable(ids, [self.weight(meal_id) for meal_id in ids]) if ids else None
+        with self.lock:
+            self.tables[bucket] = table
+            for meal_id in ids:
+                self.buckets_of.setdefault(meal_id, set()).add(bucket)
+            return self.generations.get(bucket, 0), table
+
+    def user_entry(self, user_id):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is not None:
+                self.users.move_to_end(user_id)
+                return entry
+
+        liked = frozenset(meal_id for (meal_id,) in db.session.query(MealLiked.meal_id)
+                          .filter(MealLiked.user_id == user_id, MealLiked.is_active == True))
+        entry = {"liked": liked, "tables": {}}
+        with self.lock:
+            self.users[user_id] = entry
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        return entry
+
+    def user_table(self, user_id, bucket):
+        """The table the user draws bucket from: the shared one, or theirs without their favorites."""
+
+        generation, table = self.bucket_table(bucket)
+        entry = self.user_entry(user_id)
+        cached = entry["tables"].get(bucket)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        own = table
+        if table is not None and not entry["liked"].isdisjoint(table.items):
+            ids = [meal_id for meal_id in table.items if meal_id not in entry["liked"]]
+            own = AliasTable(ids, [self.weight(meal_id) for meal_id in ids]) if ids else table
+        entry["tables"][bucket] = (generation, own)
+        return own
+
+    def for_you_table(self, user_id, filters=None):
+        """Per-user table over the user's recommendations, weighted by score. None if there are none yet."""
+
+        bucket = ("for-you", None, filters)
+        entry = self.user_entry(user_id)
+        if bucket not in entry["tables"]:
+            candidates = meal_index.ids("surprise", filters=filters) if filters else None
+            recommended = recommender.recommend(user_id, candidates=candidates)
+            entry["tables"][bucket] = (0, AliasTable(*zip(*recommended)) if recommended else None)
+        return entry["tables"][bucket][1]
+
+    def pick(self, user_id, mode, key=None, filters=None):
+        """Meal id for a spin of mode ("cuisine", "category", "surprise" or "for-you"), None if no meal matches.
+
+        "for-you" falls back to "surprise" for users without recommendations.
+        """
+
+        self.refresh()
+        table = self.for_you_table(user_id, filters) if mode == "for-you" else None
+        if table is None:
+            table = self.user_table(user_id, ("surprise" if mode == "for-you" else mode, key, filters))
+        return self.draw_unseen(user_id, table) if table is not None else None
+
+    def draw_unseen(self, user_id, table):
+        """Draw from table, skipping the meals the user was recently shown."""
+
+        bits = seen.bits(user_id)
+        for attempt in range(SEEN_TRIES):
+            meal_id = table.draw()
+            if not bits >> meal_id & 1:
+                return meal_id
+
+        unseen = [(meal_id, weight) for meal_id, weight in zip(table.items, table.weights) if not bits >> meal_id & 1]
+        if unseen:
+            return AliasTable(*zip(*unseen)).draw()
+        seen.forget(user_id, table.items)
+        return table.draw()
+
+    def forget_user(self, user_id):
+        """Drop the user's tables, their favorites changed."""
+
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def meals_changed(self, meal_ids):
+        """Reload the popularity of meals and rebuild the buckets holding them on their next draw."""
+
+        meal_ids = sorted(set(meal_ids))
+        if not meal_ids:
+            return
+        popularity = dict(db.session.query(MealStats.meal_id, MealStats.liked_by).filter(MealStats.meal_id.in_(meal_ids)))
+        with self.lock:
+            for meal_id in meal_ids:
+                self.popularity[meal_id] = popularity.get(meal_id, 0)
+                for bucket in self.buckets_of.pop(meal_id, ()):
+                    self.tables.pop(bucket, None)
+                    self.generations[bucket] = self.generations.get(bucket, 0)+1
+
+
+sampler = Sampler()
@@ -0,0 +1,72 @@
+"""Relevance-ranked meal search for /meals.
+
+Each meal has a search_text column: its name, cuisine, category and
+ingredient names, lowercased (written by the catalog sync). On Postgres it
+has a pg_trgm GIN index, so a search is index lookups on word similarity,
+which tolerates typos, of the whole query or of each of its words, or on
+substring match for words too short to have trigrams. Results are ranked by how well the query matches the meal name
+first and the rest of the text second.
+
+Other databases (SQLite in development) fall back to requiring every query
+word as a substring of search_text, ranked exact name > name prefix > name
+substring > other text, without typo tolerance.
+"""
+
+import os
+from collections import namedtuple
+
+from sqlalchemy import and_, bindparam, case, func, or_, text
+
+from models import db, Meal
+
+
+PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 24))
+
+SearchPage = namedtuple("SearchPage", ["items", "page", "has_next"])
+
+
+def build_search_text(meal_name, cuisine_name, category_name, ingredients):
+    """search_text of a meal."""
+
+    return " ".join([meal_name, cuisine_name or "", category_name or "", *ingredients]).lower()
+
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def ranked(query, q):
+    """query filtered to meals matching q, best matches first."""
+
+    if db.engine.dialect.name == "postgresql":
+        #the whole query close to a run of words of the text, or every query word, as on other databases, close
+        #to a word or a substring of it; text() so the % operators survive psycopg2's paramstyle; all of them
+        #use the trigram index
+        def close(term, name):
+            return text(f"meals.search_text %> :{name}").bindparams(bindparam(name, term))
+
+        every_word = and_(*[or_(close(term, f"term_{i}"), Meal.search_text.ilike(f"%{escape_like(term)}%", escape="\\"))
+                            for i, term in enumerate(q.split())])
+        score = 2*func.word_similarity(q, Meal.meal_name) + func.word_similarity(q, Meal.search_text)
+        return query.filter(or_(close(q, "q"), every_word)).order_by(score.desc(), Meal.meal_name)
+
+    for term in q.split():
+        query = query.filter(Meal.search_text.like(f"%{escape_like(term)}%", escape="\\"))
+
+    name = func.lower(Meal.meal_name)
+    score = case([(name == q, 3),
+                  (name.like(f"{escape_like(q)}%", escape="\\"), 2),
+                  (name.like(f"%{escape_like(q)}%", escape="\\"), 1)], else_=0)
+    return query.order_by(score.desc(), Meal.meal_name)
+
+
+def search_meals(q, page=1, size=PAGE_SIZE, query=None):
+    """Page of meals matching q, starting at 1. query is a Meal query to narrow down, all meals by default."""
+
+    query = Meal.query if query is None else query
+    q = " ".join(q.lower().split())
+    query = ranked(query, q) if q else query.order_by(Meal.meal_name)
+
+    #one extra row tells whether there is a next page
+    meals = query.offset((page-1)*size).limit(size+1).all()
+    return SearchPage(meals[:size], page, len(meals) > size)
@@ -1,11 +1,16 @@
 from csv import DictReader
-from app import db
+from app import app, db
 from models import Cuisine,Category,Meal,User,Message,MealLiked,RestaurantMealLiked
+from catalog import sync_catalog
+from migrate import stamp
 
 
 db.drop_all()
 db.create_all()
 
+#a fresh schema already has every migration
+stamp(db.engine)
+
 with open('generator/cuisines.csv') as cuisines:
     db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
 
@@ -17,3 +22,6 @@ with open('generator/meals.csv') as meals:
 
 
 db.session.commit()
+
+#mirror meal details (TheMealDB id, instructions, ingredients) into the local catalog
+sync_catalog(app.config['MEALDB_URL'])
@@ -0,0 +1,193 @@
+"""Meals each user was already shown by the roulette, so spins don't repeat.
+
+A user's seen set is two bitsets (Python ints, bit i for meal id i like the
+ingredient bitsets of meal_index): the meals shown in the current window
+and in the one before it. Windows are SEEN_WINDOW_SECONDS long; when one
+ends the current bitset becomes the previous one and the oldest is dropped,
+so a meal stays skipped for one to two windows. A user whose every meal of
+a bucket is seen or liked starts over on that bucket (forget).
+
+Marking a meal seen only touches memory. Changed users are written to the
+seen_meals table by a background thread every SEEN_FLUSH_SECONDS, all in
+one transaction, so a spin never waits on a database write. A worker loads
+a user's bitsets from the table on their first spin and keeps the most
+recently spinning SEEN_MAX_USERS users. Two workers serving one user at the
+same moment may each overwrite the other's latest marks; seen meals are a
+hint, so that costs at most a repeated spin.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.dialects import postgresql
+
+from models import db, upsert, SeenMeals, User
+
+
+WINDOW_SECONDS = float(os.environ.get('SEEN_WINDOW_SECONDS', 86400))
+FLUSH_SECONDS = float(os.environ.get('SEEN_FLUSH_SECONDS', 5))
+MAX_USERS = int(os.environ.get('SEEN_MAX_USERS', 100000))
+
+logger = logging.getLogger(__name__)
+
+
+def to_bytes(bits):
+    return bits.to_bytes((bits.bit_length()+7)//8, "little")
+
+
+def from_bytes(data):
+    return int.from_bytes(data, "little")
+
+
+class SeenSets:
+    """user id -> [epoch, current bits, previous bits] of recently spinning users, and the changes not written yet."""
+
+    def __init__(self, window=WINDOW_SECONDS, flush_seconds=FLUSH_SECONDS, max_users=MAX_USERS, clock=time.time):
+        self.window = window
+        self.flush_seconds = flush_seconds
+        self.max_users = max_users
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        self.dirty = {}
+        self.app = None
+        self.flusher = None
+
+    def epoch(self):
+        return int(self.clock()//self.window)
+
+    def entry(self, user_id):
+        """The user's [epoch, current, previous], loaded on a miss and rotated to the current window."""
+
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is not None:
+                self.users.move_to_end(user_id)
+            else:
+                #a user evicted before their changes were written is still in dirty
+                entry = self.dirty.get(user_id)
+
+        if entry is None:
+            row = db.session.query(SeenMeals.epoch, SeenMeals.current, SeenMeals.previous).filter(SeenMeals.user_id == user_id).first()
+            entry = [row.epoch, from_bytes(row.current), from_bytes(row.previous)] if row else [self.epoch(), 0, 0]
+
+        with self.lock:
+            entry = self.users.setdefault(user_id, entry)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+
+            epoch = self.epoch()
+            if entry[0] != epoch:
+                entry[1:] = [0, entry[1] if entry[0] == epoch-1 else 0]
+                entry[0] = epoch
+        return entry
+
+    def bits(self, user_id):
+        """Bitset of the meals the user was shown in this window and the one before."""
+
+        epoch, current, previous = self.entry(user_id)
+        return current | previous
+
+    def mark(self, user_id, meal_id):
+        """Remember that the user was shown meal_id, written to the database later."""
+
+        entry = self.entry(user_id)
+        with self.lock:
+            entry[1] |= 1 << meal_id
+            self.dirty[user_id] = entry
+        self.start_flusher()
+
+    def forget(self, user_id, meal_ids):
+        """Start over on meal_ids, e.g. once the user has seen all of a bucket."""
+
+        mask = 0
+        for meal_id in meal_ids:
+            mask |= 1 << meal_id
+
+        entry = self.entry(user_id)
+        with self.lock:
+            entry[1] &= ~mask
+            entry[2] &= ~mask
+            self.dirty[user_id] = entry
+        self.start_flusher()
+
+    def reset(self):
+        """Forget every user, including changes not written yet."""
+
+        with self.lock:
+            self.users.clear()
+            self.dirty.clear()
+
+    def init_app(self, app):
+        """Flush from a background thread in app's context, and once more at exit."""
+
+        self.app = app
+        atexit.register(self.flush)
+
+    def start_flusher(self):
+        if self.app is None or self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_forever, name="seen-flusher", daemon=True)
+        self.flusher.start()
+
+    def flush_forever(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """Write every changed user in one transaction. Returns the number of users written.
+
+        Ends the calling thread's session, so it runs in the flusher thread and at exit.
+        """
+
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            rows = [{"user_id": user_id, "epoch": epoch, "current": to_bytes(current), "previous": to_bytes(previous)}
+                    for user_id, (epoch, current, previous) in dirty.items()]
+        if not rows or self.app is None:
+            return 0
+
+        try:
+            with self.app.app_context():
+                try:
+                    self.write(rows)
+                    db.session.commit()
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception("writing %d seen sets failed, retrying with the next flush", len(rows))
+            with self.lock:
+                for user_id, entry in dirty.items():
+                    self.dirty.setdefault(user_id, entry)
+            return 0
+        return len(rows)
+
+    def write(self, rows):
+        #users deleted since their last spin
+        users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_([row["user_id"] for row in rows]))}
+        rows = [row for row in rows if row["user_id"] in users]
+        if not rows:
+            return
+
+        table = SeenMeals.__table__
+        if db.engine.dialect.name == "postgresql":
+            insert = postgresql.insert(table).values(rows)
+            db.session.execute(insert.on_conflict_do_update(
+                index_elements=["user_id"],
+                set_={column: insert.excluded[column] for column in ("epoch", "current", "previous")}))
+            return
+
+        for row in rows:
+            values = {key: value for key, value in row.items() if key != "user_id"}
+            upsert(SeenMeals, {"user_id": row["user_id"]}, values, values)
+
+
+seen = SeenSets()
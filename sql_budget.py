@@ -0,0 +1,125 @@
+"""Per-request SQL statement counts, budgets and N+1 detection.
+
+Every statement any engine (primary or replica) runs while a request is
+handled is counted, timed and reduced to its shape: the SQL with bound
+parameters and literals replaced by ? and IN lists collapsed, so the same
+query for different ids has one shape. Responses carry the totals in
+X-SQL-Statements, X-SQL-Time-Ms and Server-Timing, and every request logs
+one JSON line on the "sql_budget" logger.
+
+Views declare how many statements they may run with @budget(n). A request
+over its budget, or one that runs a shape more than SQL_REPEAT_LIMIT times
+(the signature of a lazy load per row), is logged as a warning; while the
+app is testing it raises SQLBudgetExceeded instead, so a regression fails
+the test suite rather than reaching production.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+REPEAT_LIMIT = int(os.environ.get('SQL_REPEAT_LIMIT', 3))
+#statements of views that don't declare a budget
+DEFAULT_BUDGET = int(os.environ.get('SQL_DEFAULT_BUDGET', 10))
+
+logger = logging.getLogger("sql_budget")
+
+BIND_PARAMS = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+|\$\d+")
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+class SQLBudgetExceeded(Exception):
+    """A request ran more statements than its view's budget, or repeated a statement shape."""
+
+
+def budget(statements):
+    """Declare that a view runs at most this many SQL statements per request."""
+
+    def decorate(view):
+        view.sql_budget = statements
+        return view
+    return decorate
+
+
+def shape(statement):
+    """statement without its values, e.g. SELECT ... WHERE meals.id IN (?)"""
+
+    statement = LITERALS.sub("?", BIND_PARAMS.sub("?", statement))
+    return " ".join(LISTS.sub("?", statement).split())
+
+
+class RequestStats:
+    """Statements of one request."""
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def repeated(self, limit=REPEAT_LIMIT):
+        """(shape, times) run more than limit times, most repeated first."""
+
+        return [(statement, times) for statement, times in self.shapes.most_common() if times > limit]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_stats" in g:
+        conn.info.setdefault("sql_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("sql_started")
+    if started and has_request_context() and "sql_stats" in g:
+        stats = g.sql_stats
+        stats.seconds += time.perf_counter()-started.pop()
+        stats.statements += 1
+        stats.shapes[shape(statement)] += 1
+
+
+event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+def init_app(app):
+    """Count the statements of every request of app. Register it before other before_request hooks."""
+
+    @app.before_request
+    def start_counting():
+        g.sql_stats = RequestStats()
+
+    @app.after_request
+    def check_budget(response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+
+        view = app.view_functions.get(request.endpoint)
+        allowed = getattr(view, "sql_budget", DEFAULT_BUDGET)
+        repeated = stats.repeated()
+        over = stats.statements > allowed
+
+        milliseconds = stats.seconds*1000
+        response.headers["X-SQL-Statements"] = str(stats.statements)
+        response.headers["X-SQL-Time-Ms"] = f"{milliseconds:.2f}"
+        response.headers.add("Server-Timing", f'db;dur={milliseconds:.2f};desc="{stats.statements} statements"')
+
+        record = {"method": request.method, "path": request.path, "endpoint": request.endpoint,
+                  "status": response.status_code, "statements": stats.statements, "db_ms": round(milliseconds, 2),
+                  "budget": allowed, "over_budget": over,
+                  "repeated": [{"shape": statement[:200], "times": times} for statement, times in repeated]}
+        logger.log(logging.WARNING if over or repeated else logging.INFO, json.dumps(record))
+
+        if (over or repeated) and app.config.get('SQL_BUDGET_STRICT', app.testing):
+            problems = [f"{stats.statements} statements, budget {allowed}"] if over else []
+            problems += [f"{times} x {statement}" for statement, times in repeated]
+            raise SQLBudgetExceeded(f"{request.method} {request.path} ({request.endpoint}): " + "; ".join(problems))
+        return response
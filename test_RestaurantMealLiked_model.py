@@ -6,7 +6,7 @@
 import os
 from unittest import TestCase
 
-from models import db, Cuisine, Category,Message,Meal,User,MealLiked,RestaurantMealLiked,Like
+from models import db, Cuisine, Category,Message,Meal,User,MealLiked,Restaurant,RestaurantMealLiked,Like
 
 from sqlalchemy.exc import IntegrityError
 
@@ -44,6 +44,7 @@ class RestaurantMealLikedModelTestCase(TestCase):
         User.query.delete()
         MealLiked.query.delete()
         RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
         Cuisine.query.delete()
         Meal.query.delete()
         Category.query.delete()
@@ -85,15 +86,10 @@ class RestaurantMealLikedModelTestCase(TestCase):
         # MealLiked model should have correct meal id and user id
         self.assertEqual(len(meal_liked.restaurants),0)
         
-        restaurant_meal=RestaurantMealLiked(restaurant_name='restaurant_name',
-                                                    restaurant_yelp_id='yelp_id',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address',
-                                                    restaurant_rating=4.6,
-                                                    restaurant_url='restaurant_url',
-                                                    restaurant_photo='photo',
-                                                    user_id=user.id
-                )
+        Restaurant.save('yelp_id','restaurant_name','address',4.6,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal=RestaurantMealLiked(restaurant_yelp_id='yelp_id',
+                                            meals_liked_id=meal_liked.id,
+                                            user_id=user.id)
 
         db.session.add(restaurant_meal)
         db.session.commit()
@@ -102,15 +98,10 @@ class RestaurantMealLikedModelTestCase(TestCase):
 
 
         #meals_liked_id and restaurant_yelp_id must be unique pairs
-        restaurant_meal2=RestaurantMealLiked(restaurant_name='somethingBurger',
-                                                    restaurant_yelp_id='yelp_id',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address21312312',
-                                                    restaurant_rating=2.3,
-                                                    restaurant_url='url',
-                                                    restaurant_photo='photo',
-                                                    user_id=user.id
-                )
+        Restaurant.save('yelp_id','somethingBurger','address21312312',2.3,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal2=RestaurantMealLiked(restaurant_yelp_id='yelp_id',
+                                             meals_liked_id=meal_liked.id,
+                                             user_id=user.id)
         try:
             db.session.add(restaurant_meal2)
             db.session.commit()
@@ -120,15 +111,10 @@ class RestaurantMealLikedModelTestCase(TestCase):
         self.assertIsNone(restaurant_meal2.id)
 
         #this must work since unique pair of meals_liked_id and restaurant_yelp_id is provided
-        restaurant_meal3=RestaurantMealLiked(restaurant_name='somethingBurger',
-                                                    restaurant_yelp_id='yelp_id1231321313',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address21312312',
-                                                    restaurant_rating=2.3,
-                                                    restaurant_url='url',
-                                                    restaurant_photo='photo',
-                                                    user_id=user.id
-                )
+        Restaurant.save('yelp_id1231321313','somethingBurger','address21312312',2.3,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal3=RestaurantMealLiked(restaurant_yelp_id='yelp_id1231321313',
+                                             meals_liked_id=meal_liked.id,
+                                             user_id=user.id)
 
         try:
             db.session.add(restaurant_meal3)
@@ -139,4 +125,31 @@ class RestaurantMealLikedModelTestCase(TestCase):
         self.assertIsNotNone(restaurant_meal3.id)
         self.assertEqual(len(meal_liked.restaurants),2)
 
-        
\ No newline at end of file
+        
+    def test_restaurant_model(self):
+        """Restaurants are stored once per yelp id, shared by every like and never overwritten"""
+
+        user=User.query.filter(User.username=='testuser1').first()
+        meal_likes=[MealLiked(user_id=user.id,meal_id=meal.id) for meal in Meal.query.limit(2)]
+        db.session.add_all(meal_likes)
+        db.session.commit()
+
+        for meal_liked in meal_likes:
+            Restaurant.save('yelp_id','Old name','address',4.6,'https://www.yelp.com/biz/restaurant','')
+            db.session.add(RestaurantMealLiked(restaurant_yelp_id='yelp_id',meals_liked_id=meal_liked.id,user_id=user.id))
+        Restaurant.save('yelp_id','New name','address',4.6,'https://www.yelp.com/biz/restaurant','')
+        db.session.commit()
+
+        self.assertEqual(Restaurant.query.count(),1)
+        self.assertEqual({row.restaurant_name for row in RestaurantMealLiked.query.all()},{"Old name"})
+
+        restaurant=Restaurant.query.get('yelp_id')
+        self.assertIsNone(restaurant.photo)
+        self.assertTrue(restaurant.photo_url.startswith("data:image/png;base64,"))
+
+    def test_restaurant_url(self):
+        """Restaurants with urls that are not http(s) are not stored"""
+
+        with self.assertRaises(ValueError):
+            Restaurant.save('yelp_id','Restaurant','address',4.6,'javascript:alert(1)','')
+        self.assertEqual(Restaurant.query.count(),0)
@@ -0,0 +1,182 @@
+"""API cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api_client.py
+
+
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+from api_client import CachedClient, LRUCache, SQLiteCache
+
+
+class CachedClientTestCase(TestCase):
+    """Test the two-tier API cache."""
+
+    def setUp(self):
+        """Create a client with a fresh shared tier and a stubbed upstream."""
+
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+
+        self.ttls = {"filter.php": (60, 600), "random.php": (0, 0)}
+        self.client = CachedClient(local=LRUCache(maxsize=2), shared=SQLiteCache(self.path), ttls=self.ttls)
+
+        self.calls = 0
+
+        def fetch_json(url, params=None, headers=None):
+            self.calls += 1
+            return {"meals": [{"strMeal": params["a"], "call": self.calls}]}
+
+        patcher = patch.object(self.client, "fetch_json", side_effect=fetch_json)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_local_and_shared_hits(self):
+        """Second lookup is a local hit, another worker gets a shared hit"""
+
+        url = "http://mealdb/filter.php"
+
+        first = self.client.get_json(url, params={"a": "Canadian"})
+        self.assertEqual(self.client.get_json(url, params={"a": "Canadian"}), first)
+        self.assertEqual(self.calls, 1)
+
+        #a second worker has its own local tier but reads the same file
+        other = CachedClient(local=LRUCache(), shared=SQLiteCache(self.path), ttls=self.ttls)
+        with patch.object(other, "fetch_json", side_effect=AssertionError("upstream call")):
+            self.assertEqual(other.get_json(url, params={"a": "Canadian"}), first)
+
+        self.assertEqual(self.client.stats()["misses"], 1)
+        self.assertEqual(self.client.stats()["local_hits"], 1)
+        self.assertEqual(other.stats()["shared_hits"], 1)
+
+    def test_lru_eviction(self):
+        """Local tier keeps only maxsize entries"""
+
+        for cuisine in ["British", "Canadian", "Chinese"]:
+            self.client.get_json("http://mealdb/filter.php", params={"a": cuisine})
+
+        self.assertEqual(self.client.stats()["local_size"], 2)
+        self.assertEqual(self.client.stats()["shared_size"], 3)
+
+    def test_uncached_endpoint(self):
+        """Endpoints with a zero TTL always go upstream"""
+
+        self.client.get_json("http://mealdb/random.php", params={"a": "x"})
+        self.client.get_json("http://mealdb/random.php", params={"a": "x"})
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.client.stats()["uncached"], 2)
+
+    def test_stale_while_revalidate(self):
+        """A stale entry is served at once and refreshed in the background"""
+
+        url = "http://mealdb/filter.php"
+        key = self.client.cache_key(url, {"a": "British"})
+        now = time.time()
+        stale_value = {"meals": [{"strMeal": "British", "call": 0}]}
+        self.client.local.set(key, stale_value, now-1, now+600)
+
+        self.assertEqual(self.client.get_json(url, params={"a": "British"}), stale_value)
+
+        for i in range(100):
+            if self.client.stats()["refreshes"]:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.client.stats()["stale_hits"], 1)
+        self.assertEqual(self.client.get_json(url, params={"a": "British"})["meals"][0]["call"], 1)
+
+    def test_upstream_error(self):
+        """Errors on a miss are counted and raised"""
+
+        with patch.object(self.client, "fetch_json", side_effect=requests.ConnectionError()):
+            with self.assertRaises(requests.ConnectionError):
+                self.client.get_json("http://mealdb/filter.php", params={"a": "Dutch"})
+
+        self.assertEqual(self.client.stats()["errors"], 1)
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Threads missing on the same key share one upstream call"""
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch(url, params=None, headers=None):
+            started.set()
+            release.wait(5)
+            self.calls += 1
+            return {"businesses": [], "call": self.calls}
+
+        results = []
+        with patch.object(self.client, "fetch_json", side_effect=slow_fetch):
+            threads = [threading.Thread(target=lambda: results.append(
+                self.client.get_json("http://mealdb/filter.php", params={"a": "Italian"}))) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            started.wait(5)
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"businesses": [], "call": 1}]*8)
+        self.assertEqual(self.client.stats()["misses"]-self.client.stats()["coalesced"], 1)
+
+    def test_worker_lock(self):
+        """With the worker lock, a second worker waits for the first one's entry"""
+
+        worker1 = CachedClient(local=LRUCache(), shared=SQLiteCache(self.path), ttls=self.ttls, worker_lock=True)
+        worker2 = CachedClient(local=LRUCache(), shared=SQLiteCache(self.path), ttls=self.ttls, worker_lock=True)
+        key = worker1.cache_key("http://mealdb/filter.php", {"a": "Thai"})
+
+        #worker1 is in the middle of loading the key
+        self.assertTrue(worker1.shared.acquire(key))
+        self.assertFalse(worker2.shared.acquire(key))
+
+        def finish_loading():
+            time.sleep(0.2)
+            worker1.load(key, "http://mealdb/filter.php", {"a": "Thai"}, None)
+            worker1.shared.release(key)
+
+        with patch.object(worker1, "fetch_json", return_value={"meals": ["from worker1"]}), \
+             patch.object(worker2, "fetch_json", side_effect=AssertionError("upstream call")):
+            thread = threading.Thread(target=finish_loading)
+            thread.start()
+            self.assertEqual(worker2.get_json("http://mealdb/filter.php", params={"a": "Thai"}), {"meals": ["from worker1"]})
+            thread.join()
+
+        self.assertEqual(worker2.stats()["worker_coalesced"], 1)
+
+    def test_reset_after_fork(self):
+        """A forked worker reads and writes the shared tier through its own connection"""
+
+        url = "http://mealdb/filter.php"
+        first = self.client.get_json(url, params={"a": "Canadian"})
+        inherited = self.client.shared._connection()
+
+        pid = os.fork()
+        if pid == 0:
+            #the child exits with 0 only if it worked on a new connection
+            ok = False
+            try:
+                self.client.shared.reset()
+                ok = (self.client.shared._connection() is not inherited
+                      and self.client.shared.get(self.client.cache_key(url, {"a": "Canadian"}))[0] == first)
+                self.client.shared.set("child", {"meals": []}, time.time()+60, time.time()+600)
+            finally:
+                os._exit(0 if ok else 1)
+
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(self.client.shared.get("child")[0], {"meals": []})
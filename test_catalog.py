@@ -0,0 +1,137 @@
+"""Catalog mirror tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_catalog.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from csv import DictReader
+
+from models import db, Cuisine, Category, Meal, MealIngredient, User, MealLiked, RestaurantMealLiked
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from catalog import parse_ingredients, sync_meal
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+MEAL_INFO = {
+    "idMeal": "52893",
+    "strMeal": "Apple & Blackberry Crumble",
+    "strCategory": "Dessert",
+    "strArea": "British",
+    "strInstructions": "Heat oven to 190C/170C fan/gas 5.",
+    "strMealThumb": "https://www.themealdb.com/images/media/meals/xvsurr1511719182.jpg",
+    "strIngredient1": "Plain Flour",
+    "strMeasure1": "120g",
+    "strIngredient2": "Caster Sugar",
+    "strMeasure2": "60g",
+    "strIngredient3": "",
+    "strMeasure3": " ",
+    "strIngredient4": None,
+    "strMeasure4": None,
+}
+
+
+class CatalogTestCase(TestCase):
+    """Test the local TheMealDB mirror."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        MealIngredient.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    location='Philadelphia',
+                                    image_url=None)
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        db.session.commit()
+
+        cuisines={cuisine.cuisine_name:cuisine.cuisine_id for cuisine in Cuisine.query.all()}
+        categories={category.category_name:category.category_id for category in Category.query.all()}
+        self.meal=sync_meal(MEAL_INFO,cuisines,categories)
+        db.session.commit()
+
+        self.meal_id=self.meal.id
+        self.testuser_id=self.testuser.id
+
+    def test_parse_ingredients(self):
+        """Empty and missing strIngredientN keys are skipped"""
+
+        self.assertEqual(parse_ingredients(MEAL_INFO),[("Plain Flour","120g"),("Caster Sugar","60g")])
+
+    def test_sync_meal(self):
+        """Sync updates the existing meal row and replaces its ingredients"""
+
+        meal=Meal.query.filter(Meal.meal_name=="Apple & Blackberry Crumble").one()
+        self.assertEqual(meal.id,self.meal_id)
+        self.assertEqual(meal.mealdb_id,"52893")
+        self.assertEqual(meal.ingredient_names,["Plain Flour","Caster Sugar"])
+
+        cuisines={cuisine.cuisine_name:cuisine.cuisine_id for cuisine in Cuisine.query.all()}
+        categories={category.category_name:category.category_id for category in Category.query.all()}
+        sync_meal(dict(MEAL_INFO,strIngredient2="Butter"),cuisines,categories)
+        db.session.commit()
+
+        self.assertEqual(meal.ingredient_names,["Plain Flour","Butter"])
+        self.assertEqual(MealIngredient.query.filter(MealIngredient.meal_id==meal.id).count(),2)
+
+        #meals with an unknown area are not mirrored
+        self.assertIsNone(sync_meal(dict(MEAL_INFO,strArea="Atlantis"),cuisines,categories))
+
+    def test_routes_do_not_call_the_api(self):
+        """Meal and roulette pages are served from the local catalog"""
+
+        with patch("requests.Session.send",side_effect=AssertionError("outbound call")), self.client as c:
+
+            resp=c.get(f"/meals/{self.meal_id}")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Caster Sugar", html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            british=Cuisine.query.filter(Cuisine.cuisine_name=="British").one()
+            dessert=Category.query.filter(Category.category_name=="Dessert").one()
+
+            for url in [f"/cuisines/{british.cuisine_id}",f"/categories/{dessert.category_id}","/surprise-me"]:
+                resp=c.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Ingredients", resp.get_data(as_text=True))
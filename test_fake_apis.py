@@ -0,0 +1,143 @@
+"""Local API stand-in tests, and offline tests of the routes that call the APIs."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fake_apis.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from csv import DictReader
+
+from werkzeug.serving import make_server
+
+from models import db, Cuisine, Category, Meal, MealIngredient, User, MealLiked, RestaurantMealLiked
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from catalog import sync_catalog
+from fake_apis import create_app, load_meals
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FakeAPIsTestCase(TestCase):
+    """Test the fake TheMealDB and Yelp endpoints."""
+
+    def setUp(self):
+        self.fake = create_app().test_client()
+
+    def test_mealdb_endpoints(self):
+        areas = self.fake.get("/api/json/v1/1/list.php?a=list").get_json()["meals"]
+        self.assertIn({"strArea": "British"}, areas)
+
+        british = self.fake.get("/api/json/v1/1/filter.php?a=British").get_json()["meals"]
+        self.assertIn("Rock Cakes", [meal["strMeal"] for meal in british])
+
+        rock_cakes = [meal for meal in british if meal["strMeal"] == "Rock Cakes"][0]
+        meal = self.fake.get(f"/api/json/v1/1/lookup.php?i={rock_cakes['idMeal']}").get_json()["meals"][0]
+        self.assertEqual(meal["strCategory"], "Dessert")
+        self.assertTrue(meal["strIngredient1"])
+
+        #same request, same body
+        self.assertEqual(self.fake.get("/api/json/v1/1/search.php?s=rock").get_json()["meals"][0], meal)
+        self.assertIsNone(self.fake.get("/api/json/v1/1/search.php?f=x").get_json()["meals"])
+        self.assertEqual(len(self.fake.get("/api/json/v1/1/random.php").get_json()["meals"]), 1)
+
+    def test_businesses_search(self):
+        resp = self.fake.get("/v3/businesses/search?location=Philadelphia&term=rock cakes").get_json()
+        self.assertEqual(len(resp["businesses"]), 10)
+        self.assertEqual(resp, self.fake.get("/v3/businesses/search?location=Philadelphia&term=rock cakes").get_json())
+
+    def test_started_elsewhere(self):
+        """The fixtures are found whichever directory the stand-in is started from"""
+
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(cwd))
+        try:
+            self.assertIn("Rock Cakes", [meal["strMeal"] for meal in load_meals()])
+        finally:
+            os.chdir(cwd)
+
+    def test_error_injection(self):
+        failing = create_app(error_rate=1.0).test_client()
+        self.assertEqual(failing.get("/api/json/v1/1/random.php").status_code, 503)
+
+
+class OfflineRoutesTestCase(TestCase):
+    """Catalog sync and restaurant routes against the stand-in."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        fake_apis_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+        cls.config = {key: app.config[key] for key in ['MEALDB_URL', 'YELP_URL']}
+        app.config['MEALDB_URL'] = f"{fake_apis_url}/api/json/v1/1"
+        app.config['YELP_URL'] = f"{fake_apis_url}/v3/businesses/search"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        app.config.update(cls.config)
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        MealIngredient.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        db.session.commit()
+
+        self.testuser_id = testuser.id
+
+    def test_sync_catalog(self):
+        """Every meal gets its TheMealDB id and ingredients"""
+
+        self.assertEqual(sync_catalog(app.config['MEALDB_URL']), Meal.query.count())
+        self.assertEqual(Meal.query.filter(Meal.mealdb_id==None).count(), 0)
+        self.assertTrue(Meal.query.filter(Meal.meal_name=="Rock Cakes").one().ingredient_names)
+
+    def test_restaurant_routes(self):
+        """Liking a meal shows restaurants from the stand-in"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/like-it/Rock Cakes", data={"address": ""}, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Restaurants nearby Philadelphia", html)
+            self.assertIn("Rock Cakes", html)
+
+            resp = c.get("/show-it/Rock Cakes/restaurants?address=philly")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Add Fav", resp.get_data(as_text=True))
@@ -0,0 +1,338 @@
+"""Bulk favorite tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_favorites.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from csv import DictReader
+
+from models import db, Cuisine, Category, Meal, User, MealLiked, Restaurant, RestaurantMealLiked, MealStats, MealRestaurantStats, Message, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FavoritesTestCase(TestCase):
+    """Test set-based favorite changes and the batch endpoint."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="testuser",
+                            location='Philadelphia',
+                            image_url=None)
+        db.session.commit()
+
+        self.testuser_id=testuser.id
+        self.other_id=other.id
+        self.meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).order_by(Meal.id).limit(5)]
+
+        #the user liked the first three meals, at the same restaurant each
+        for meal_id in self.meal_ids[:3]:
+            meal_liked=MealLiked(user_id=testuser.id,meal_id=meal_id)
+            db.session.add(meal_liked)
+            db.session.flush()
+            Restaurant.save("yelp_1","Restaurant 1",'address',4.5,'https://www.yelp.com/biz/restaurant',None)
+            db.session.add(RestaurantMealLiked(restaurant_yelp_id="yelp_1",meals_liked_id=meal_liked.id,user_id=testuser.id))
+        db.session.commit()
+
+        self.meals_liked_ids=[meal_liked.id for meal_liked in MealLiked.query.order_by(MealLiked.meal_id)]
+
+    def post(self, url, user_id=None, **kwargs):
+        """Response to a POST and the UPDATE statements it ran on favorites"""
+
+        updates=[]
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            #not the stats, see MealStats.refresh
+            if statement.startswith("UPDATE") and not statement.startswith(("UPDATE meal_stats","UPDATE meal_restaurant_stats")):
+                updates.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=user_id or self.testuser_id
+
+            event.listen(db.engine,"before_cursor_execute",record)
+            try:
+                resp=c.post(url,headers={"Referer":"/"},**kwargs)
+            finally:
+                event.remove(db.engine,"before_cursor_execute",record)
+
+        return resp,updates
+
+    def active_meals(self):
+        return {meal_id for (meal_id,) in db.session.query(MealLiked.meal_id)
+                .filter(MealLiked.user_id==self.testuser_id,MealLiked.is_active==True)}
+
+    def active_restaurants(self):
+        return {meals_liked_id for (meals_liked_id,) in db.session.query(RestaurantMealLiked.meals_liked_id)
+                .filter(RestaurantMealLiked.user_id==self.testuser_id,RestaurantMealLiked.is_active==True)}
+
+    def test_remove_restaurant(self):
+        """Removing a restaurant for every meal is one UPDATE"""
+
+        resp,updates=self.post("/restaurant/remove-it/yelp_1")
+        self.assertEqual(resp.status_code,302)
+        self.assertEqual(len(updates),1)
+        self.assertEqual(self.active_restaurants(),set())
+
+    def test_unlink_and_remove_meal(self):
+        resp,updates=self.post(f"/restaurant/yelp_1/unlink-restaurant-meal/{self.meals_liked_ids[0]}")
+        self.assertEqual(len(updates),1)
+        self.assertEqual(self.active_restaurants(),set(self.meals_liked_ids[1:]))
+
+        resp,updates=self.post(f"/meals-liked/remove-it/{self.meal_ids[0]}")
+        self.assertEqual(len(updates),1)
+        self.assertEqual(self.active_meals(),set(self.meal_ids[1:3]))
+
+    def test_batch(self):
+        self.post(f"/meals-liked/remove-it/{self.meal_ids[0]}")
+        self.post(f"/restaurant/remove-it/yelp_1")
+
+        batch={"meals":{"add":[self.meal_ids[3],self.meal_ids[4]],"remove":[self.meal_ids[1]],"restore":[self.meal_ids[0]]},
+               "restaurants":{"add":[{"yelp_id":"yelp_2","meals_liked_id":self.meals_liked_ids[2],"name":"Restaurant 2",
+                                      "address":"address","rating":4,"url":"https://www.yelp.com/biz/restaurant"}],
+                              "restore":[{"yelp_id":"yelp_1","meals_liked_id":self.meals_liked_ids[0]}]}}
+        resp,updates=self.post("/favorites/batch",json=batch)
+
+        self.assertEqual(resp.status_code,200)
+        self.assertEqual(resp.json,{"meals":{"add":2,"remove":1,"restore":1},
+                                    "restaurants":{"add":1,"remove":0,"restore":1}})
+        self.assertEqual(self.active_meals(),{self.meal_ids[0],self.meal_ids[2],self.meal_ids[3],self.meal_ids[4]})
+        self.assertEqual(self.active_restaurants(),{self.meals_liked_ids[0],self.meals_liked_ids[2]})
+        self.assertEqual(Restaurant.query.get("yelp_2").name,"Restaurant 2")
+
+        #adding again changes nothing
+        resp,updates=self.post("/favorites/batch",json={"meals":{"add":[self.meal_ids[3]]}})
+        self.assertEqual(resp.json["meals"]["add"],0)
+
+    def test_batch_errors(self):
+        """A bad batch changes nothing"""
+
+        for batch in [None,[],{"meals":{"eat":[1]}},{"meals":{"remove":["1"]}},{"restaurants":{"add":[{"yelp_id":"yelp_1"}]}}]:
+            resp,updates=self.post("/favorites/batch",json=batch)
+            self.assertEqual(resp.status_code,400,batch)
+
+        #someone else's liked meal rolls back the whole batch
+        batch={"meals":{"remove":self.meal_ids},
+               "restaurants":{"add":[{"yelp_id":"yelp_1","meals_liked_id":self.meals_liked_ids[0]}]}}
+        resp,updates=self.post("/favorites/batch",user_id=self.other_id,json=batch)
+        self.assertEqual(resp.status_code,400)
+
+        #so does a new restaurant without its details
+        resp,updates=self.post("/favorites/batch",json={"meals":{"remove":self.meal_ids},
+                                                        "restaurants":{"add":[{"yelp_id":"yelp_9","meals_liked_id":self.meals_liked_ids[0]}]}})
+        self.assertEqual(resp.status_code,400)
+        self.assertEqual(self.active_meals(),set(self.meal_ids[:3]))
+
+        #and one whose url is not http(s)
+        resp,updates=self.post("/favorites/batch",json={"restaurants":{"add":[{"yelp_id":"yelp_9","meals_liked_id":self.meals_liked_ids[0],
+                                                                               "name":"Restaurant 9","address":"address","rating":4,
+                                                                               "url":"javascript:alert(1)"}]}})
+        self.assertEqual(resp.status_code,400)
+        self.assertIsNone(Restaurant.query.get("yelp_9"))
+
+        self.client.get("/logout")
+        self.assertEqual(self.client.post("/favorites/batch",json={}).status_code,401)
+
+    def test_like_restaurant_for_other_users_meal(self):
+        """Restaurants are only liked for the user's own liked meals"""
+
+        resp,updates=self.post("/restaurant/like-it",user_id=self.other_id,
+                               data={"restaurant_name":"Restaurant 2","yelp_id":"yelp_2","meals_liked_id":self.meals_liked_ids[0],
+                                     "restaurant_address":"address","rating":"4.5",
+                                     "restaurant_url":"https://www.yelp.com/biz/restaurant","photo":""})
+        self.assertEqual(resp.status_code,404)
+        self.assertEqual(RestaurantMealLiked.query.filter(RestaurantMealLiked.user_id==self.other_id).count(),0)
+
+
+class ConcurrentLikesTestCase(TestCase):
+    """Test double-clicked like buttons, and many users liking one meal at once."""
+
+    THREADS=8
+    REQUESTS=5
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+        db.session.commit()
+
+        self.testuser_id=testuser.id
+        self.meal_id=Meal.query.filter(Meal.meal_name=="Rock Cakes").one().id
+
+    def hammer(self, url, data, user_ids=None, json=False):
+        """Status codes of THREADS clients posting url REQUESTS times each, all at once
+
+        Client i is logged in as user_ids[i] and posts data(user_id) if data is
+        a function; by default every client is the test user. data is posted as
+        a form, or as JSON with json=True.
+        """
+
+        barrier=threading.Barrier(self.THREADS)
+        statuses=[]
+
+        def post(user_id):
+            client=app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY]=user_id
+            barrier.wait()
+            for i in range(self.REQUESTS):
+                #testing apps raise instead of answering 500, keep the error for the assertion
+                try:
+                    body=data(user_id) if callable(data) else data
+                    statuses.append(client.post(url,headers={"Referer":"/"},
+                                                **({"json":body} if json else {"data":body})).status_code)
+                except Exception as e:
+                    statuses.append(repr(e))
+
+        threads=[threading.Thread(target=post,args=(user_id,))
+                 for user_id in user_ids or [self.testuser_id]*self.THREADS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return statuses
+
+    def test_like_meal_and_restaurant(self):
+        statuses=self.hammer("/like-it/Rock Cakes",{"address":"Philadelphia"})
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+
+        meals_liked=MealLiked.query.filter(MealLiked.user_id==self.testuser_id,MealLiked.meal_id==self.meal_id).all()
+        self.assertEqual(len(meals_liked),1)
+        self.assertTrue(meals_liked[0].is_active)
+
+        statuses=self.hammer("/restaurant/like-it",{"restaurant_name":"Restaurant 1","yelp_id":"yelp_1",
+                                                    "meals_liked_id":meals_liked[0].id,"restaurant_address":"address",
+                                                    "rating":"4.5","restaurant_url":"https://www.yelp.com/biz/restaurant","photo":""})
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+        self.assertEqual(Restaurant.query.count(),1)
+        self.assertEqual(RestaurantMealLiked.query.filter(RestaurantMealLiked.is_active==True).count(),1)
+
+    def test_batch(self):
+        """Batches adding the same favorites at once all succeed, and add each once"""
+
+        statuses=self.hammer("/favorites/batch",{"meals":{"add":[self.meal_id]}},json=True)
+        self.assertEqual(statuses,[200]*self.THREADS*self.REQUESTS)
+        self.assertEqual(MealLiked.query.filter(MealLiked.meal_id==self.meal_id).count(),1)
+
+        meals_liked_id=MealLiked.query.filter(MealLiked.meal_id==self.meal_id).one().id
+        statuses=self.hammer("/favorites/batch",{"restaurants":{"add":[{"yelp_id":"yelp_1","meals_liked_id":meals_liked_id,
+                                                                        "name":"Restaurant 1","address":"address","rating":4.5,
+                                                                        "url":"https://www.yelp.com/biz/restaurant"}]}},json=True)
+        self.assertEqual(statuses,[200]*self.THREADS*self.REQUESTS)
+        self.assertEqual(RestaurantMealLiked.query.count(),1)
+
+    def test_like_message(self):
+        """Clicks on a review's like button at once all succeed, and its counter matches its likes"""
+
+        author=User.signup(username="author",email="author@test.com",password="testuser",location='Philadelphia',image_url=None)
+        db.session.commit()
+        meal_liked=MealLiked(user_id=author.id,meal_id=self.meal_id)
+        db.session.add(meal_liked)
+        db.session.commit()
+        msg=Message(text="review",user_id=author.id,restaurant_info=None,meals_liked_id=meal_liked.id)
+        db.session.add(msg)
+        db.session.commit()
+        message_id=msg.id
+
+        statuses=self.hammer(f"/users/add_like/{message_id}",{})
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+
+        #written by the other clients' sessions
+        db.session.expire_all()
+        likes=Like.query.filter(Like.message_id==message_id).count()
+        self.assertIn(likes,(0,1))
+        self.assertEqual(Message.query.get(message_id).like_count,likes)
+        self.assertEqual(User.query.get(author.id).likes_received,likes)
+
+    def test_reactivate(self):
+        """A soft deleted like is reactivated, not duplicated"""
+
+        db.session.add(MealLiked(user_id=self.testuser_id,meal_id=self.meal_id,is_active=False))
+        db.session.commit()
+
+        statuses=self.hammer("/like-it/Rock Cakes",{"address":"Philadelphia"})
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+        self.assertEqual([meal_liked.is_active for meal_liked in MealLiked.query.all()],[True])
+
+    def test_many_users(self):
+        """Users liking the same meal and restaurant at once all get their like, and the stats count every one"""
+
+        users=[User.signup(username=f"user{i}",email=f"user{i}@test.com",password="testuser",
+                           location='Philadelphia',image_url=None) for i in range(self.THREADS)]
+        db.session.commit()
+        user_ids=[user.id for user in users]
+
+        statuses=self.hammer("/like-it/Rock Cakes",{"address":"Philadelphia"},user_ids)
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+        self.assertEqual(MealLiked.query.filter(MealLiked.meal_id==self.meal_id,MealLiked.is_active==True).count(),self.THREADS)
+        self.assertEqual(MealStats.query.get(self.meal_id).liked_by,self.THREADS)
+
+        meals_liked_ids=dict(db.session.query(MealLiked.user_id,MealLiked.id).filter(MealLiked.meal_id==self.meal_id))
+        statuses=self.hammer("/restaurant/like-it",
+                             lambda user_id:{"restaurant_name":"Restaurant 1","yelp_id":"yelp_1",
+                                             "meals_liked_id":meals_liked_ids[user_id],"restaurant_address":"address",
+                                             "rating":"4.5","restaurant_url":"https://www.yelp.com/biz/restaurant","photo":""},
+                             user_ids)
+        self.assertEqual(statuses,[302]*self.THREADS*self.REQUESTS)
+        self.assertEqual(MealRestaurantStats.query.get((self.meal_id,"yelp_1")).pairings,self.THREADS)
@@ -0,0 +1,231 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_feeds.py
+
+
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from csv import DictReader
+
+from models import db, Cuisine, Category, Message, Meal, User, MealLiked, Restaurant, RestaurantMealLiked, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from feeds import paginate, encode_cursor, decode_cursor
+from user_cache import user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FeedsTestCase(TestCase):
+    """Test paging through reviews."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        db.session.commit()
+
+        meal=Meal.query.filter(Meal.meal_name=='Rock Cakes').first()
+        meal_liked=MealLiked(user_id=testuser.id,meal_id=meal.id)
+        db.session.add(meal_liked)
+        db.session.commit()
+
+        #five reviews share a timestamp, so the id breaks the tie
+        now=datetime(2021,6,1)
+        for i in range(25):
+            db.session.add(Message(text=f"review {i}",user_id=testuser.id,restaurant_info=None,
+                                   meals_liked_id=meal_liked.id,timestamp=now+timedelta(minutes=max(i,5))))
+        db.session.commit()
+
+        self.testuser_id=testuser.id
+        self.meal_id=meal.id
+
+    def test_timestamp_default(self):
+        """Each review gets its own timestamp"""
+
+        before=datetime.utcnow()
+        msg=Message(text="fresh",user_id=self.testuser_id,restaurant_info=None,
+                    meals_liked_id=MealLiked.query.first().id)
+        db.session.add(msg)
+        db.session.commit()
+        self.assertGreaterEqual(msg.timestamp,before)
+
+    def test_paginate(self):
+        """Pages are newest first, don't overlap and cover every review"""
+
+        texts=[]
+        cursor=None
+        while True:
+            page=paginate(Message.query,cursor,size=7)
+            texts+=[message.text for message in page.items]
+            cursor=page.next_cursor
+            if cursor is None:
+                break
+
+        self.assertEqual(texts,[f"review {i}" for i in range(24,-1,-1)])
+
+    def test_cursor(self):
+        message=Message.query.first()
+        self.assertEqual(decode_cursor(encode_cursor(message)),(message.timestamp,message.id))
+
+        with self.assertRaises(ValueError):
+            decode_cursor("not a cursor")
+
+    def test_load_more(self):
+        """Review lists show a page and a link to the next one"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            for url in ["/",f"/users/{self.testuser_id}/messages",f"/meals/{self.meal_id}/reviews"]:
+                html=c.get(url).get_data(as_text=True)
+                self.assertIn("review 24",html)
+                self.assertNotIn("review 4<",html)
+
+                next_url=re.search(r'id="load-more"\s+style="[^"]*"\s+href="([^"]+)"',html).group(1)
+                html=c.get(next_url.replace("&amp;","&")).get_data(as_text=True)
+                self.assertIn("review 4<",html)
+                self.assertNotIn("review 24",html)
+
+            self.assertEqual(c.get("/?cursor=bogus").status_code,400)
+
+    def test_liked_messages(self):
+        """Liked reviews are paginated too"""
+
+        for message in Message.query.all():
+            db.session.add(Like(user_id=self.testuser_id,message_id=message.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            html=c.get(f"/users/{self.testuser_id}/liked-messages").get_data(as_text=True)
+            self.assertIn("review 24",html)
+            self.assertIn('id="load-more"',html)
+
+
+class FeedQueryCountTestCase(TestCase):
+    """Review pages run a fixed number of queries however many reviews they show."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        viewer = User.signup(username="viewer",
+                             email="viewer@test.com",
+                             password="testuser",
+                             location='Philadelphia',
+                             image_url=None)
+        db.session.commit()
+
+        self.viewer_id=viewer.id
+        self.meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).order_by(Meal.id).limit(20)]
+        self.meal_id=self.meal_ids[0]
+
+    def add_reviews(self, start, stop):
+        """Reviews by new users start..stop of meal start..stop, at a restaurant and liked by the viewer"""
+
+        for i in range(start, stop):
+            user=User.signup(username=f"user{i}",email=f"user{i}@test.com",password="testuser",location='Philadelphia',image_url=None)
+            db.session.commit()
+
+            #the first meal gets every review, so its reviews page grows too
+            for meal_id in {self.meal_ids[0],self.meal_ids[i]}:
+                meal_liked=MealLiked(user_id=user.id,meal_id=meal_id)
+                db.session.add(meal_liked)
+                db.session.flush()
+                Restaurant.save(f"yelp_{i}",f"Restaurant {i}",'address',4.5,'https://www.yelp.com/biz/restaurant',None)
+                db.session.add(RestaurantMealLiked(restaurant_yelp_id=f"yelp_{i}",meals_liked_id=meal_liked.id,user_id=user.id))
+                message=Message(text=f"review {i}",user_id=user.id,restaurant_info=f"yelp_{i}",meals_liked_id=meal_liked.id)
+                db.session.add(message)
+                db.session.flush()
+                db.session.add(Like(user_id=self.viewer_id,message_id=message.id))
+        db.session.commit()
+        db.session.expire_all()
+
+    def count_queries(self, url):
+        statements=[]
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.viewer_id
+
+            #every count starts with the current user uncached
+            user_cache.clear()
+            event.listen(db.engine,"before_cursor_execute",count)
+            try:
+                resp=c.get(url)
+            finally:
+                event.remove(db.engine,"before_cursor_execute",count)
+
+        self.assertEqual(resp.status_code,200)
+        return len(statements)
+
+    def test_query_count_is_constant(self):
+        urls=["/",f"/meals/{self.meal_id}/reviews",f"/users/{self.viewer_id}/liked-messages"]
+
+        self.add_reviews(0,2)
+        few={url:self.count_queries(url) for url in urls}
+
+        self.add_reviews(2,15)
+        many={url:self.count_queries(url) for url in urls}
+
+        self.assertEqual(few,many)
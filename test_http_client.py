@@ -0,0 +1,61 @@
+"""Outbound HTTP client tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_client.py
+
+
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+import requests
+
+from http_client import HTTPClient
+
+
+def response(status):
+    return Mock(status_code=status, headers={})
+
+
+class HTTPClientTestCase(TestCase):
+    """Test retries and timeouts of the pooled client."""
+
+    def setUp(self):
+        self.client = HTTPClient(pool_size=2, connect_timeout=1, read_timeout=2, retries=2, backoff=0)
+
+    def test_timeouts(self):
+        """Every call carries the connect and read timeouts"""
+
+        with patch.object(self.client.session, "get", return_value=response(200)) as get:
+            self.client.get("http://mealdb/list.php", params={"a": "list"})
+
+        self.assertEqual(get.call_args[1]["timeout"], (1, 2))
+
+    def test_retries_then_succeeds(self):
+        """Connection errors and 503s are retried"""
+
+        results = [requests.ConnectionError(), response(503), response(200)]
+        with patch.object(self.client.session, "get", side_effect=results) as get:
+            resp = self.client.get("http://mealdb/list.php")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(get.call_count, 3)
+
+    def test_retries_are_bounded(self):
+        """After the last retry the error or response goes to the caller"""
+
+        with patch.object(self.client.session, "get", side_effect=requests.Timeout()) as get:
+            with self.assertRaises(requests.Timeout):
+                self.client.get("http://mealdb/list.php")
+        self.assertEqual(get.call_count, 3)
+
+        with patch.object(self.client.session, "get", return_value=response(502)) as get:
+            self.assertEqual(self.client.get("http://mealdb/list.php").status_code, 502)
+        self.assertEqual(get.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        """A 404 is an answer, not a failure"""
+
+        with patch.object(self.client.session, "get", return_value=response(404)) as get:
+            self.assertEqual(self.client.get("http://mealdb/lookup.php").status_code, 404)
+        self.assertEqual(get.call_count, 1)
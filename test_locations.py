@@ -0,0 +1,84 @@
+"""Location normalization and restaurant search cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_locations.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from api_client import CachedClient, LRUCache
+from locations import gazetteer, geohash, geohash_center, normalize_text
+import yelp
+
+
+class LocationsTestCase(TestCase):
+    """Test gazetteer lookups and geohash buckets."""
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("  New York,  NY! "), "new york ny")
+        self.assertEqual(normalize_text("Montréal"), "montreal")
+
+    def test_geohash(self):
+        """Known geohash values"""
+
+        self.assertEqual(geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(geohash(40.7128, -74.0060), "dr5re")
+
+        latitude, longitude = geohash_center("dr5re")
+        self.assertEqual(geohash(latitude, longitude), "dr5re")
+
+    def test_spellings_share_a_bucket(self):
+        """Aliases, case, punctuation, state and country suffixes all resolve to one key"""
+
+        keys = {gazetteer.resolve(location).key for location in
+                ["NYC", "New York", "new york, ny", "New York, NY, USA", "new york city"]}
+        self.assertEqual(keys, {"geo:dr5re"})
+        self.assertEqual(gazetteer.resolve("philly").name, "Philadelphia")
+
+    def test_unknown_locations(self):
+        """Addresses and wrong-state cities are keyed by their text"""
+
+        location = gazetteer.resolve("123 Main St, Philadelphia PA")
+        self.assertEqual(location.key, "text:123 main st philadelphia pa")
+        self.assertIsNone(location.latitude)
+
+        self.assertEqual(gazetteer.resolve("Portland, ME").key, "text:portland me")
+        self.assertEqual(gazetteer.resolve("Portland, OR").name, "Portland")
+
+
+class RestaurantSearchTestCase(TestCase):
+    """Both restaurant routes share one cache entry per (bucket, term)."""
+
+    def setUp(self):
+        self.client = CachedClient(local=LRUCache())
+        self.calls = []
+
+        def fetch_json(url, params=None, headers=None):
+            self.calls.append(params)
+            return {"businesses": [{"id": "yelp_id", "name": "Amazing restaurant LLC"}]}
+
+        for patcher in [patch.object(self.client, "fetch_json", side_effect=fetch_json), patch.object(yelp, "api", self.client)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        app = Flask(__name__)
+        app.config['YELP_URL'] = "http://yelp/v3/businesses/search"
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+    def test_search_restaurants(self):
+        for address in ["NYC", "new york, ny", "New York"]:
+            self.assertEqual(yelp.search_restaurants("Rock Cakes", address)["businesses"][0]["id"], "yelp_id")
+        yelp.search_restaurants("rock  cakes", "Manhattan")
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0]["term"], "rock cakes")
+        self.assertIn("latitude", self.calls[0])
+
+        yelp.search_restaurants("Rock Cakes", "123 Main St, Philadelphia PA")
+        self.assertEqual(self.calls[1]["location"], "123 main st philadelphia pa")
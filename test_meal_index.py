@@ -0,0 +1,250 @@
+"""In-memory meal index tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_meal_index.py
+
+
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from csv import DictReader
+
+from models import db, Cuisine, Category, Meal, MealIngredient, CatalogVersion, User, MealLiked, RestaurantMealLiked
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from catalog import sync_catalog
+from meal_index import MealIndex, ingredient_filter
+import meal_index
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MealIndexTestCase(TestCase):
+    """Test random picks from the meal index."""
+
+    def setUp(self):
+        """Add sample data."""
+
+        MealIngredient.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+        CatalogVersion.query.delete()
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        db.session.commit()
+
+        #a few meals with known ingredients
+        self.ingredients={"Rock Cakes":["Plain Flour","Butter","Caster Sugar"],
+                          "Chicken Handi":["Chicken","Onion","Cashew Nuts"],
+                          "Chicken Couscous":["Chicken Breast","Onion","Couscous"]}
+        for meal_name,ingredients in self.ingredients.items():
+            meal=Meal.query.filter(Meal.meal_name==meal_name).one()
+            meal.ingredients=[MealIngredient(position=position,ingredient=ingredient)
+                              for position,ingredient in enumerate(ingredients,1)]
+        db.session.commit()
+
+        self.british_id=Cuisine.query.filter(Cuisine.cuisine_name=="British").one().cuisine_id
+        self.dessert_id=Category.query.filter(Category.category_name=="Dessert").one().category_id
+        self.index=MealIndex()
+
+    def test_picks(self):
+        """Picks are meals of the cuisine or category, with no more queries once built"""
+
+        self.assertEqual(Meal.query.get(self.index.pick("cuisine",self.british_id)).cuisine_id,self.british_id)
+
+        with patch.object(db.session,"query",side_effect=AssertionError("index queried the database")):
+            for i in range(20):
+                self.assertIn(self.index.pick("category",self.dessert_id),self.index.by_category[self.dessert_id])
+            self.assertEqual(len(self.index.ids("surprise")),Meal.query.count())
+
+        self.assertIsNone(self.index.pick("cuisine",0))
+
+    def test_ingredient_filters(self):
+        """Include and exclude filters match ingredients by term"""
+
+        def names(mode,key=None,**filters):
+            ids=self.index.ids(mode,key,ingredient_filter(**filters))
+            return {meal.meal_name for meal in Meal.query.filter(Meal.id.in_(ids))}
+
+        self.assertEqual(names("surprise",include=["chicken"]),{"Chicken Handi","Chicken Couscous"})
+        self.assertEqual(names("surprise",include=["Chicken"],exclude=["nuts"]),{"Chicken Couscous"})
+        self.assertEqual(names("surprise",include=["onion, butter"]),set())
+        self.assertEqual(names("category",self.dessert_id,include=["butter"]),{"Rock Cakes"})
+
+        without_nuts=self.index.ids("surprise",filters=ingredient_filter(exclude=["nuts"]))
+        self.assertEqual(len(without_nuts),Meal.query.count()-1)
+
+    def test_whole_word_terms(self):
+        """Terms match whole ingredient words, singular or plural, and phrases in order"""
+
+        extra={"Graham Cracker Crust":["Graham Crackers","Eggs"],"Moussaka":["Eggplant","Lamb Mince"]}
+        meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).filter(~Meal.meal_name.in_(self.ingredients)).limit(2)]
+        for meal_id,ingredients in zip(meal_ids,extra.values()):
+            Meal.query.get(meal_id).ingredients=[MealIngredient(position=position,ingredient=ingredient)
+                                                 for position,ingredient in enumerate(ingredients,1)]
+        db.session.commit()
+        crust,moussaka=meal_ids
+
+        def ids(term):
+            return set(self.index.ids("surprise",filters=ingredient_filter(include=[term])))
+
+        self.assertEqual(ids("ham"),set())
+        self.assertEqual(ids("egg"),{crust})
+        self.assertEqual(ids("EGGS"),{crust})
+        self.assertEqual(ids("eggplant"),{moussaka})
+        self.assertEqual(ids("cracker"),{crust})
+        self.assertEqual(ids("nut"),ids("cashew nuts"))
+        self.assertEqual(len(ids("chicken breast")),1)
+        self.assertEqual(ids("breast chicken"),set())
+
+    def test_filter_during_build(self):
+        """A filter computed while a rebuild swaps the index uses the ingredients of one build only"""
+
+        chicken=ingredient_filter(include=["chicken"])
+        term_bits=meal_index.term_bits
+        rock_cakes=Meal.query.filter(Meal.meal_name=="Rock Cakes").one()
+        self.index.build()
+
+        def rebuild_meanwhile(*args):
+            if rock_cakes.ingredients[0].ingredient != "Chicken":
+                rock_cakes.ingredients[0].ingredient="Chicken"
+                db.session.commit()
+                self.index.build()
+            return term_bits(*args)
+
+        with patch.object(meal_index,"term_bits",side_effect=rebuild_meanwhile):
+            ids=self.index.ids("surprise",filters=chicken)
+        self.assertEqual({meal.meal_name for meal in Meal.query.filter(Meal.id.in_(ids))},{"Chicken Handi","Chicken Couscous"})
+
+        #the next spin filters the new build
+        self.assertIn(rock_cakes.id,self.index.ids("surprise",filters=chicken))
+
+    def test_complete(self):
+        """Whole name prefixes come before later word prefixes, served from memory"""
+
+        names=[name for name,meal_id in self.index.complete("chicken han",limit=20)]
+        self.assertEqual(names[0],"Chicken Handi")
+        self.assertTrue(all(name.lower().startswith("chicken han") for name in names))
+
+        self.assertIn("Chicken Handi",[name for name,meal_id in self.index.complete("  HAND")])
+        self.assertEqual(len(self.index.complete("c",limit=3)),3)
+        self.assertEqual(self.index.complete(""),[])
+        self.assertEqual(self.index.complete("zzz"),[])
+
+        with patch.object(db.session,"query",side_effect=AssertionError("index queried the database")):
+            start=time.perf_counter()
+            for i in range(1000):
+                self.index.complete("ch")
+            self.assertLess((time.perf_counter()-start)/1000,0.001)
+
+    def test_ingredient_filter(self):
+        self.assertIsNone(ingredient_filter([""],[" , "]))
+        self.assertEqual(ingredient_filter(["Garlic, chicken ","garlic"]).include,("chicken","garlic"))
+
+    def test_catalog_version(self):
+        """The index is rebuilt when another worker bumps the catalog version"""
+
+        self.index.check_seconds=0
+        before=set(self.index.ids("surprise"))
+
+        meal=Meal(meal_name="New meal",cuisine_id=self.british_id,category_id=self.dessert_id)
+        db.session.add(meal)
+        db.session.commit()
+        self.assertEqual(set(self.index.ids("surprise")),before)
+
+        CatalogVersion.bump()
+        db.session.commit()
+        self.assertEqual(set(self.index.ids("surprise")),before|{meal.id})
+        self.assertEqual(CatalogVersion.current(),1)
+
+    def test_sync_invalidates(self):
+        """A catalog sync in this worker invalidates the shared index"""
+
+        meal_index.meal_index.ids("surprise")
+        with patch("catalog.api.fetch_json",return_value={"meals":None}):
+            sync_catalog(app.config['MEALDB_URL'])
+        self.assertIsNone(meal_index.meal_index.version)
+
+
+class IngredientFilterViewsTestCase(TestCase):
+    """Test the include/exclude query params."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        MealIngredient.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        meal=Meal.query.filter(Meal.meal_name=="Rock Cakes").one()
+        meal.ingredients=[MealIngredient(position=1,ingredient="Plain Flour"),MealIngredient(position=2,ingredient="Raisins")]
+        db.session.commit()
+        meal_index.meal_index.invalidate()
+
+        self.testuser_id=testuser.id
+
+    def test_list_meals(self):
+        resp=self.client.get("/meals?include=raisins")
+        html=resp.get_data(as_text=True)
+        self.assertIn("Rock Cakes",html)
+        self.assertNotIn("Chicken Handi",html)
+
+        html=self.client.get("/meals?q=rock cakes&exclude=raisins").get_data(as_text=True)
+        self.assertIn("Sorry, no meals found",html)
+
+    def test_autocomplete(self):
+        resp=self.client.get("/meals/autocomplete?q=rock&limit=100")
+        self.assertEqual(resp.status_code,200)
+        self.assertIn({"id":Meal.query.filter(Meal.meal_name=="Rock Cakes").one().id,"name":"Rock Cakes"},resp.json["meals"])
+        self.assertLessEqual(len(resp.json["meals"]),20)
+
+        self.assertEqual(self.client.get("/meals/autocomplete").json,{"meals":[]})
+
+    def test_roulette_filters(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            resp=c.get("/surprise-me?include=Raisins")
+            html=resp.get_data(as_text=True)
+            self.assertIn("Rock Cakes",html)
+            self.assertIn('value="raisins"',html)
+
+            resp=c.get("/surprise-me?include=truffles",follow_redirects=True)
+            self.assertIn("No meals match those ingredients.",resp.get_data(as_text=True))
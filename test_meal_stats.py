@@ -0,0 +1,168 @@
+"""Meal stats tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_meal_stats.py
+
+
+import os
+from unittest import TestCase
+
+from csv import DictReader
+
+from sqlalchemy import event
+
+from models import db, Cuisine, Category, Message, Meal, User, MealLiked, Restaurant, RestaurantMealLiked, Like, MealStats, MealRestaurantStats
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from favorites import apply_batch, like_meal, like_restaurant, set_meals_active, set_restaurants_active
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MealStatsTestCase(TestCase):
+    """Test that incrementally maintained stats match a full recompute."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        self.user_ids=[]
+        for i in range(3):
+            user=User.signup(username=f"user{i}",email=f"user{i}@test.com",password="testuser",
+                             location='Philadelphia',image_url=None)
+            db.session.commit()
+            self.user_ids.append(user.id)
+
+        self.meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).order_by(Meal.id).limit(2)]
+        Restaurant.save("yelp_1","Restaurant 1",'address',4.5,'https://www.yelp.com/biz/restaurant',None)
+        Restaurant.save("yelp_2","Restaurant 2",'address',4,'https://www.yelp.com/biz/restaurant',None)
+        db.session.commit()
+
+    def snapshot(self):
+        #a missing row and a row of zeros read the same
+        stats={(s.meal_id,s.review_count,s.review_likes,s.liked_by) for s in MealStats.query.filter(MealStats.meal_id.in_(self.meal_ids))
+               if s.review_count or s.review_likes or s.liked_by}
+        pairings={(p.meal_id,p.restaurant_yelp_id,p.pairings) for p in MealRestaurantStats.query}
+        return stats,pairings
+
+    def assertFresh(self):
+        """The stats are what a full recompute gives"""
+
+        db.session.expire_all()
+        incremental=self.snapshot()
+        MealStats.refresh(db.session.connection(),self.meal_ids)
+        db.session.expire_all()
+        self.assertEqual(incremental,self.snapshot())
+        db.session.rollback()
+        return incremental
+
+    def test_incremental(self):
+        meal_id=self.meal_ids[0]
+        meals_liked={}
+        for user_id in self.user_ids:
+            like_meal(user_id,meal_id)
+            meals_liked[user_id]=MealLiked.query.filter_by(user_id=user_id,meal_id=meal_id).one().id
+            like_restaurant(user_id,meals_liked[user_id],"yelp_1")
+        like_restaurant(self.user_ids[0],meals_liked[self.user_ids[0]],"yelp_2")
+        db.session.commit()
+        self.assertFresh()
+
+        messages=[Message(user_id=user_id,text="good",meals_liked_id=meals_liked[user_id]) for user_id in self.user_ids[:2]]
+        db.session.add_all(messages)
+        db.session.commit()
+        Like.toggle(self.user_ids[2],messages[0].id)
+        Like.toggle(self.user_ids[1],messages[0].id)
+        Like.toggle(self.user_ids[0],messages[1].id)
+        db.session.commit()
+        stats,pairings=self.assertFresh()
+        self.assertIn((meal_id,2,3,3),stats)
+        self.assertEqual(pairings,{(meal_id,"yelp_1",3),(meal_id,"yelp_2",1)})
+
+        Like.toggle(self.user_ids[1],messages[0].id)
+        db.session.delete(messages[1])
+        set_restaurants_active(self.user_ids[1],[{"yelp_id":"yelp_1"}],False)
+        set_meals_active(self.user_ids[2],[meal_id],False)
+        db.session.commit()
+        stats,pairings=self.assertFresh()
+        self.assertIn((meal_id,1,1,2),stats)
+        #pairings only count restaurants of active meal favorites
+        self.assertEqual(pairings,{(meal_id,"yelp_1",1),(meal_id,"yelp_2",1)})
+
+        db.session.delete(User.query.get(self.user_ids[0]))
+        db.session.commit()
+        stats,pairings=self.assertFresh()
+        self.assertIn((meal_id,0,0,1),stats)
+        self.assertEqual(pairings,set())
+
+    def test_batch_refreshes_once(self):
+        """A batch using every action recomputes the stats of the meals it touched once, at the end"""
+
+        user_id,meal_id,other_meal_id=self.user_ids[0],*self.meal_ids
+        like_meal(user_id,meal_id)
+        like_meal(user_id,other_meal_id)
+        meals_liked_id=MealLiked.query.filter_by(user_id=user_id,meal_id=meal_id).one().id
+        like_restaurant(user_id,meals_liked_id,"yelp_1")
+        set_meals_active(user_id,[other_meal_id],False)
+        db.session.commit()
+
+        batch={"meals":{"add":[other_meal_id],"remove":[meal_id],"restore":[meal_id]},
+               "restaurants":{"add":[{"yelp_id":"yelp_2","meals_liked_id":meals_liked_id}],
+                              "remove":[{"yelp_id":"yelp_1"}],"restore":[{"yelp_id":"yelp_1","meals_liked_id":meals_liked_id}]}}
+        statements=[]
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine,"before_cursor_execute",record)
+        try:
+            apply_batch(user_id,batch)
+        finally:
+            event.remove(db.engine,"before_cursor_execute",record)
+        db.session.commit()
+
+        self.assertEqual(len([statement for statement in statements if statement.startswith("UPDATE meal_stats")]),1)
+        self.assertFalse([statement for statement in statements if statement.startswith("DELETE FROM meal_stats")])
+        stats,pairings=self.assertFresh()
+        self.assertEqual({(s[0],s[3]) for s in stats},{(meal_id,1),(other_meal_id,1)})
+        self.assertEqual(pairings,{(meal_id,"yelp_1",1),(meal_id,"yelp_2",1)})
+
+    def test_meal_pages(self):
+        like_meal(self.user_ids[0],self.meal_ids[0])
+        meals_liked_id=MealLiked.query.filter_by(user_id=self.user_ids[0]).one().id
+        like_restaurant(self.user_ids[0],meals_liked_id,"yelp_2")
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.user_ids[0]
+
+            for url in [f"/meals/{self.meal_ids[0]}",f"/meals/{self.meal_ids[0]}/reviews"]:
+                html=c.get(url).get_data(as_text=True)
+                self.assertIn("0 review(s), 0 like(s), liked by 1 user(s)",html)
+                self.assertIn("Restaurant 2",html)
+
+            #meals nobody touched have no stats row
+            html=c.get(f"/meals/{self.meal_ids[1]}").get_data(as_text=True)
+            self.assertIn("0 review(s), 0 like(s), liked by 0 user(s)",html)
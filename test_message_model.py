@@ -6,7 +6,7 @@
 import os
 from unittest import TestCase
 
-from models import db, Cuisine, Category,Message,Meal,User,MealLiked,RestaurantMealLiked,Like
+from models import db, Cuisine, Category,Message,Meal,User,MealLiked,Restaurant,RestaurantMealLiked,Like
 
 from sqlalchemy.exc import IntegrityError
 
@@ -44,6 +44,7 @@ class MessageModelTestCase(TestCase):
         User.query.delete()
         MealLiked.query.delete()
         RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
         Cuisine.query.delete()
         Meal.query.delete()
         Category.query.delete()
@@ -88,15 +89,10 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(len(meal_liked.messages),0)
 
 
-        restaurant_meal=RestaurantMealLiked(restaurant_name='restaurant_name',
-                                                    restaurant_yelp_id='yelp_id',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address',
-                                                    restaurant_rating=4.6,
-                                                    restaurant_url='restaurant_url',
-                                                    restaurant_photo='photo',
-                                                    user_id=user.id
-                )
+        Restaurant.save('yelp_id','restaurant_name','address',4.6,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal=RestaurantMealLiked(restaurant_yelp_id='yelp_id',
+                                            meals_liked_id=meal_liked.id,
+                                            user_id=user.id)
 
         db.session.add(restaurant_meal)
         db.session.commit()
@@ -123,12 +119,16 @@ class MessageModelTestCase(TestCase):
         )
         
         #message should have 1 like
+        db.session.add(user2)
+        db.session.commit()
 
-        user2.likes.append(msg)
+        self.assertTrue(Like.toggle(user2.id,msg.id))
         db.session.commit()
 
         self.assertEqual(len(msg.user_likes),1)
         self.assertEqual(len(user2.likes),1)
+        self.assertEqual(msg.like_count,1)
+        self.assertEqual(user.likes_received,1)
 
 
         #user_id and message_id are unique pairs
@@ -139,4 +139,39 @@ class MessageModelTestCase(TestCase):
         except IntegrityError:
             db.session.rollback()
         
-        self.assertIsNone(like.id)
\ No newline at end of file
+        self.assertIsNone(like.id)
+
+    def test_like_counters(self):
+        """Counters follow likes, unlikes and deleted likers and messages"""
+
+        author=User.query.filter(User.username=='testuser1').first()
+        meal_liked=MealLiked(user_id=author.id,meal_id=Meal.query.first().id)
+        db.session.add(meal_liked)
+        db.session.commit()
+
+        msgs=[Message(text=f"review {i}",user_id=author.id,restaurant_info=None,meals_liked_id=meal_liked.id) for i in range(2)]
+        likers=[User(email=f"liker{i}@test.com",username=f"liker{i}",password="HASHED_PASSWORD1",location="Philadelphia") for i in range(3)]
+        db.session.add_all(msgs+likers)
+        db.session.commit()
+
+        for liker in likers:
+            Like.toggle(liker.id,msgs[0].id)
+        Like.toggle(likers[0].id,msgs[1].id)
+        db.session.commit()
+        self.assertEqual([msg.like_count for msg in msgs],[3,1])
+        self.assertEqual(author.likes_received,4)
+
+        #toggling again unlikes
+        self.assertFalse(Like.toggle(likers[1].id,msgs[0].id))
+        db.session.commit()
+        self.assertEqual([msg.like_count for msg in msgs],[2,1])
+        self.assertEqual(author.likes_received,3)
+
+        db.session.delete(likers[0])
+        db.session.commit()
+        self.assertEqual([msg.like_count for msg in msgs],[1,0])
+        self.assertEqual(author.likes_received,1)
+
+        db.session.delete(msgs[0])
+        db.session.commit()
+        self.assertEqual(author.likes_received,0)
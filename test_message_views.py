@@ -10,7 +10,7 @@ from unittest import TestCase
 
 from csv import DictReader
 
-from models import db, connect_db,Cuisine, Category,Message,Meal,User,MealLiked,RestaurantMealLiked,Like
+from models import db, connect_db,Cuisine, Category,Message,Meal,User,MealLiked,Restaurant,RestaurantMealLiked,Like
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -44,6 +44,7 @@ class MessageViewTestCase(TestCase):
         User.query.delete()
         MealLiked.query.delete()
         RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
         Cuisine.query.delete()
         Meal.query.delete()
         Category.query.delete()
@@ -80,20 +81,15 @@ class MessageViewTestCase(TestCase):
         db.session.add(meal_liked)
         db.session.commit()
 
-        restaurant_meal=RestaurantMealLiked(restaurant_name='Amazing restaurant LLC',
-                                                    restaurant_yelp_id='yelp_id',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address',
-                                                    restaurant_rating=4.6,
-                                                    restaurant_url='restaurant_url',
-                                                    restaurant_photo='photo',
-                                                    user_id=self.new_user.id
-                )
+        Restaurant.save('yelp_id','Amazing restaurant LLC','address',4.6,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal=RestaurantMealLiked(restaurant_yelp_id='yelp_id',
+                                            meals_liked_id=meal_liked.id,
+                                            user_id=self.new_user.id)
 
         db.session.add(restaurant_meal)
         db.session.commit()
 
-        msg=Message(text='amazing food',restaurant_info='No Restaurant Selected',meals_liked_id=meal_liked.id)
+        msg=Message(text='amazing food',restaurant_info=None,meals_liked_id=meal_liked.id)
         self.new_user.messages.append(msg)
 
         db.session.commit()
@@ -253,4 +249,36 @@ class MessageViewTestCase(TestCase):
             html = resp1.get_data(as_text=True)
             self.assertIn("Rock Cakes", html)
             self.assertIn("No reviews found", html)
-            self.assertEqual(resp1.status_code, 200)
\ No newline at end of file
+            self.assertEqual(resp1.status_code, 200)
+
+    def post_review(self, restaurant):
+        """Post a review of Rock Cakes as new_user, return the response and the saved message"""
+
+        meal=Meal.query.filter(Meal.meal_name=='Rock Cakes').first()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.new_user.id
+
+            resp=c.post('/messages/new',data={"text":"new review","meal":meal.id,"restaurant":restaurant})
+
+        return resp,Message.query.filter(Message.text=='new review').one()
+
+    def test_add_message_without_restaurant(self):
+        """The review form's "No Restaurant Selected" option saves the review without a restaurant"""
+
+        resp,msg=self.post_review('No Restaurant Selected')
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(msg.restaurant_info)
+
+    def test_add_message_unknown_restaurant(self):
+        """A restaurant the user never liked is not saved with the review"""
+
+        resp,msg=self.post_review('unknown_yelp_id')
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(msg.restaurant_info)
+
+        Message.query.filter(Message.text=='new review').delete()
+        db.session.commit()
+        resp,msg=self.post_review('yelp_id')
+        self.assertEqual(msg.restaurant_info,'yelp_id')
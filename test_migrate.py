@@ -0,0 +1,198 @@
+"""Schema migration and index tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrate.py
+
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase, skipUnless
+
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, MetaData, Table, Text, UniqueConstraint, event, inspect, text
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app
+from index_check import check_indexes
+from migrate import load_migrations, upgrade, stamp, applied_versions
+
+db.create_all()
+
+
+MIGRATION = '''
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("INSERT INTO migrate_test (name) VALUES ('{name}')"))
+'''
+
+
+def baseline_schema():
+    """The tables as the first release of models.py made them, before any migration."""
+
+    metadata=MetaData()
+    Table("cuisines",metadata,Column("cuisine_id",Integer,primary_key=True),
+          Column("cuisine_name",Text,nullable=False,unique=True),Column("cuisine_image",Text,nullable=False))
+    Table("categories",metadata,Column("category_id",Integer,primary_key=True),
+          Column("category_name",Text,nullable=False,unique=True),Column("category_image",Text,nullable=False))
+    Table("meals",metadata,Column("id",Integer,primary_key=True),Column("meal_name",Text,nullable=False,unique=True),
+          Column("cuisine_id",Integer,ForeignKey("cuisines.cuisine_id",ondelete="cascade"),nullable=False),
+          Column("category_id",Integer,ForeignKey("categories.category_id",ondelete="cascade"),nullable=False),
+          Column("image_url",Text))
+    Table("users",metadata,Column("id",Integer,primary_key=True),Column("email",Text,nullable=False,unique=True),
+          Column("username",Text,nullable=False,unique=True),Column("image_url",Text),
+          Column("location",Text,nullable=False),Column("password",Text,nullable=False))
+    Table("meals_liked",metadata,Column("id",Integer,primary_key=True),
+          Column("meal_id",Integer,ForeignKey("meals.id",ondelete="cascade"),nullable=False),
+          Column("user_id",Integer,ForeignKey("users.id",ondelete="cascade"),nullable=False),
+          Column("is_active",Boolean,nullable=False),UniqueConstraint("meal_id","user_id"))
+    Table("restaurants_meals_liked",metadata,Column("id",Integer,primary_key=True),
+          Column("restaurant_name",Text,nullable=False),Column("restaurant_yelp_id",Text,nullable=False),
+          Column("restaurant_address",Text,nullable=False),Column("restaurant_rating",Float),
+          Column("restaurant_url",Text,nullable=False),Column("restaurant_photo",Text),
+          Column("meals_liked_id",Integer,ForeignKey("meals_liked.id",ondelete="cascade"),nullable=False),
+          Column("user_id",Integer,ForeignKey("users.id",ondelete="cascade"),nullable=False),
+          Column("is_active",Boolean,nullable=False),UniqueConstraint("meals_liked_id","restaurant_yelp_id"))
+    Table("messages",metadata,Column("id",Integer,primary_key=True),
+          Column("user_id",Integer,ForeignKey("users.id",ondelete="cascade"),nullable=False),
+          Column("text",Text,nullable=False),
+          Column("meals_liked_id",Integer,ForeignKey("meals_liked.id",ondelete="cascade"),nullable=False),
+          Column("restaurant_info",Text,nullable=False),Column("timestamp",DateTime,nullable=False))
+    Table("likes",metadata,Column("id",Integer,primary_key=True),
+          Column("user_id",Integer,ForeignKey("users.id",ondelete="cascade")),
+          Column("message_id",Integer,ForeignKey("messages.id",ondelete="cascade")),UniqueConstraint("user_id","message_id"))
+    return metadata
+
+
+class MigrateTestCase(TestCase):
+    """Test the migration runner on a scratch table."""
+
+    def setUp(self):
+        self.path=tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.path)
+
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+            conn.execute(text("DROP TABLE IF EXISTS migrate_test"))
+            conn.execute(text("CREATE TABLE migrate_test (name TEXT)"))
+
+    def tearDown(self):
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS migrate_test"))
+
+        #leave the test database stamped like a seeded one
+        stamp(db.engine)
+
+    def add_migration(self, filename):
+        with open(os.path.join(self.path,filename),"w") as f:
+            f.write(MIGRATION.format(name=filename))
+
+    def names(self):
+        with db.engine.connect() as conn:
+            return [name for (name,) in conn.execute(text("SELECT name FROM migrate_test"))]
+
+    def test_upgrade(self):
+        """Pending migrations run once, in version order"""
+
+        self.add_migration("0002_second.py")
+        self.add_migration("0001_first.py")
+        self.add_migration("notes.txt")
+
+        applied=upgrade(db.engine,load_migrations(self.path))
+        self.assertEqual([(m.version,m.name) for m in applied],[(1,"first"),(2,"second")])
+        self.assertEqual(self.names(),["0001_first.py","0002_second.py"])
+
+        self.add_migration("0003_third.py")
+        self.assertEqual(len(upgrade(db.engine,load_migrations(self.path))),1)
+        self.assertEqual(upgrade(db.engine,load_migrations(self.path)),[])
+        self.assertEqual(self.names(),["0001_first.py","0002_second.py","0003_third.py"])
+        self.assertEqual(applied_versions(db.engine),{1,2,3})
+
+    def test_stamp(self):
+        """Stamped migrations are not run"""
+
+        self.add_migration("0001_first.py")
+        stamp(db.engine,load_migrations(self.path))
+        self.assertEqual(upgrade(db.engine,load_migrations(self.path)),[])
+        self.assertEqual(self.names(),[])
+
+    def columns(self):
+        inspector=inspect(db.engine)
+        return {table:{column["name"] for column in inspector.get_columns(table)} for table in inspector.get_table_names()
+                if table not in ("schema_version","migrate_test")}
+
+    @skipUnless(db.engine.dialect.name=="postgresql","0002 moves restaurants with Postgres only ALTER TABLE")
+    def test_repo_migrations(self):
+        """The shipped migrations bring a baseline database to the schema of the models, keeping its rows"""
+
+        migrations=load_migrations()
+        self.assertEqual([m.version for m in migrations],list(range(1,len(migrations)+1)))
+
+        db.session.remove()
+        db.drop_all()
+        baseline=baseline_schema()
+        baseline.create_all(db.engine)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(baseline.tables["cuisines"].insert(),cuisine_id=1,cuisine_name="Italian",cuisine_image="i.png")
+                conn.execute(baseline.tables["categories"].insert(),category_id=1,category_name="Pasta",category_image="p.png")
+                conn.execute(baseline.tables["meals"].insert(),id=1,meal_name="Lasagne",cuisine_id=1,category_id=1)
+                conn.execute(baseline.tables["users"].insert(),id=1,email="u@test.com",username="u",location="Philadelphia",password="x")
+                conn.execute(baseline.tables["meals_liked"].insert(),id=1,meal_id=1,user_id=1,is_active=True)
+                conn.execute(baseline.tables["restaurants_meals_liked"].insert(),id=1,restaurant_name="R",restaurant_yelp_id="yelp_1",
+                             restaurant_address="address",restaurant_url="url",meals_liked_id=1,user_id=1,is_active=True)
+                conn.execute(baseline.tables["messages"].insert(),id=1,user_id=1,text="good",meals_liked_id=1,
+                             restaurant_info="yelp_1",timestamp=datetime(2021,1,1))
+
+            statements=[]
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine,"before_cursor_execute",record)
+            try:
+                self.assertEqual(upgrade(db.engine,migrations),migrations)
+            finally:
+                event.remove(db.engine,"before_cursor_execute",record)
+            self.assertEqual(applied_versions(db.engine),{m.version for m in migrations})
+
+            #0001 and 0003 built their indexes CONCURRENTLY, which Postgres refuses inside a transaction, and left none invalid
+            concurrent=" ".join(statement for statement in statements if statement.startswith("CREATE INDEX CONCURRENTLY"))
+            for index in ("ix_messages_timestamp_id","ix_meals_liked_user_id_meal_id_active"):
+                self.assertIn(index,concurrent)
+            with db.engine.connect() as conn:
+                self.assertEqual(conn.execute(text("SELECT count(*) FROM pg_index WHERE NOT indisvalid")).scalar(),0)
+                self.assertEqual(conn.execute(text("SELECT count(*) FROM pg_indexes WHERE indexname='ix_meals_liked_user_id_meal_id_active'")).scalar(),1)
+
+            #every table and column of the models, whichever order they were added in
+            expected={table.name:{column.name for column in table.columns} for table in db.metadata.sorted_tables}
+            self.assertEqual(self.columns(),expected)
+
+            with db.engine.connect() as conn:
+                self.assertEqual(conn.execute(text("SELECT search_text FROM meals")).scalar(),"lasagne italian pasta ")
+                self.assertEqual(conn.execute(text("SELECT name FROM restaurants WHERE yelp_id='yelp_1'")).scalar(),"R")
+                self.assertEqual(conn.execute(text("SELECT liked_by FROM meal_stats WHERE meal_id=1")).scalar(),1)
+        finally:
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+
+    def test_repo_migrations_up_to_date(self):
+        """The shipped migrations are no-ops on a schema made by create_all"""
+
+        migrations=load_migrations()
+        upgrade(db.engine,migrations)
+        self.assertEqual(applied_versions(db.engine),{m.version for m in migrations})
+
+
+class IndexCheckTestCase(TestCase):
+    """Test the hot lookups use an index."""
+
+    def test_hot_queries_use_indexes(self):
+        for name,(uses_index,plan) in check_indexes(db.engine).items():
+            self.assertTrue(uses_index,f"{name}: {plan}")
@@ -0,0 +1,101 @@
+"""Roulette prefetch tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_prefetch.py
+
+
+import time
+from unittest.mock import patch
+
+from models import db, Cuisine, CatalogVersion
+
+from testing import RouletteTestCase
+from app import app, CURR_USER_KEY
+from favorites import like_meal
+from meal_index import meal_index
+from prefetch import PrefetchQueue, resolve_spin
+
+
+class PrefetchTestCase(RouletteTestCase):
+    """Test per-user prefetch buffers."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        super().setUp()
+
+        self.testuser_id=self.signup("testuser")
+        self.british_id=Cuisine.query.filter(Cuisine.cuisine_name=="British").one().cuisine_id
+
+        self.queue=PrefetchQueue(app,size=3,low_water=2)
+
+    def wait_for_refill(self):
+        for i in range(200):
+            if not self.queue.refilling:
+                return
+            time.sleep(0.01)
+
+    def test_spins_come_from_the_buffer(self):
+        """After the first spin the buffer is filled in the background"""
+
+        first=self.queue.next(self.testuser_id,"cuisine",self.british_id)
+        self.assertEqual(first.meal_object.cuisine_id,self.british_id)
+        self.wait_for_refill()
+
+        buffer=self.queue.buffers[(self.testuser_id,"cuisine",self.british_id,None)]
+        self.assertEqual(len(buffer),3)
+
+        #buffered spins are served without resolving anything
+        with patch.object(self.queue,"resolve",side_effect=AssertionError("resolved synchronously")):
+            spin=self.queue.next(self.testuser_id,"cuisine",self.british_id)
+
+        #and they are detached but fully loaded
+        self.assertEqual(spin.meal_object.cuisine.cuisine_name,"British")
+        self.assertEqual(spin.ingredients,spin.meal_object.ingredient_names)
+
+    def test_buffered_spins_are_current(self):
+        """A buffered spin shows the liked state of now, and is dropped once the catalog changes"""
+
+        self.queue.next(self.testuser_id,"cuisine",self.british_id)
+        self.wait_for_refill()
+        buffer=self.queue.buffers[(self.testuser_id,"cuisine",self.british_id,None)]
+        self.assertIsNone(buffer[0].user_liked_meal)
+
+        #liked on another worker, which can't drop this worker's buffers
+        like_meal(self.testuser_id,buffer[0].meal_object.id)
+        db.session.commit()
+        with patch.object(self.queue,"resolve",side_effect=AssertionError("resolved synchronously")):
+            spin=self.queue.next(self.testuser_id,"cuisine",self.british_id)
+        self.assertTrue(spin.user_liked_meal.is_active)
+        self.wait_for_refill()
+
+        CatalogVersion.bump()
+        db.session.commit()
+        #as if the index checked the catalog version again
+        meal_index.invalidate()
+        old_version=spin.catalog_version
+        spin=self.queue.next(self.testuser_id,"cuisine",self.british_id)
+        self.assertNotEqual(spin.catalog_version,old_version)
+        self.assertEqual(spin.catalog_version,meal_index.version)
+
+    def test_invalidate(self):
+        """Liking a meal drops the user's buffers"""
+
+        self.queue.next(self.testuser_id,"surprise")
+        self.wait_for_refill()
+        self.assertIn((self.testuser_id,"surprise",None,None),self.queue.buffers)
+
+        self.queue.invalidate(self.testuser_id)
+        self.assertNotIn((self.testuser_id,"surprise",None,None),self.queue.buffers)
+
+    def test_unknown_cuisine(self):
+        """There is nothing to spin for an unknown cuisine"""
+
+        self.assertIsNone(resolve_spin(self.testuser_id,"cuisine",0))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            self.assertEqual(c.get("/cuisines/0").status_code,404)
@@ -0,0 +1,159 @@
+"""Recommender tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_recommender.py
+
+
+from unittest.mock import patch
+
+import numpy as np
+from markupsafe import escape
+
+from models import db, Meal
+
+from testing import RouletteTestCase
+from app import app, CURR_USER_KEY
+from favorites import like_meal, set_meals_active
+import recommender as recommender_module
+from recommender import Recommender, cooccurrence, recommender
+
+
+class RecommenderTestCase(RouletteTestCase):
+    """Test item-item recommendations and their incremental updates."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user_ids=[self.signup(f"user{i}") for i in range(4)]
+
+        self.meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).order_by(Meal.id).limit(4)]
+        m=self.meal_ids
+        for user_id,liked in zip(self.user_ids,[[m[0],m[1]],[m[0],m[1],m[2]],[m[0],m[3]]]):
+            for meal_id in liked:
+                like_meal(user_id,meal_id)
+        db.session.commit()
+
+    def test_cooccurrence(self):
+        counts=cooccurrence(np.array([5,5,7,9,9,9]),np.array([0,1,0,0,1,2]),3)
+        self.assertEqual(counts.tolist(),[[3,2,1],[2,2,1],[1,1,1]])
+
+    def test_recommend(self):
+        """Meals liked together with the user's favorites come first, their favorites never"""
+
+        m=self.meal_ids
+        user_id=self.user_ids[3]
+        with app.app_context():
+            self.assertEqual(recommender.recommend(user_id),[])
+
+            like_meal(user_id,m[0])
+            db.session.commit()
+            recommended=recommender.recommend(user_id)
+            #m1 was liked with m0 twice, m2 and m3 once each
+            self.assertEqual([meal_id for meal_id,score in recommended],[m[1],m[2],m[3]])
+            self.assertAlmostEqual(recommended[0][1],2/np.sqrt(4*2))
+            self.assertEqual(recommender.recommend(user_id,candidates=[m[3]]),[(m[3],1/np.sqrt(4*1))])
+
+    def test_incremental(self):
+        """Syncing users after their changes gives the counts of a full rebuild"""
+
+        m=self.meal_ids
+        with app.app_context():
+            recommender.refresh()
+            like_meal(self.user_ids[3],m[2])
+            like_meal(self.user_ids[3],m[3])
+            set_meals_active(self.user_ids[0],[m[0]],False)
+            set_meals_active(self.user_ids[2],[m[0],m[3]],False)
+            db.session.commit()
+            for user_id in self.user_ids:
+                recommender.sync_user(user_id)
+
+            rebuilt=Recommender()
+            rebuilt.build()
+            self.assertTrue(np.array_equal(recommender.counts,rebuilt.counts))
+            self.assertEqual(recommender.user_meals.keys(),rebuilt.user_meals.keys())
+
+    def test_like_does_not_build(self):
+        """A like only adjusts a built matrix by its delta, full builds are left to a background thread"""
+
+        m=self.meal_ids
+        user_id=self.user_ids[3]
+        with patch.object(recommender,"rebuild_in_background") as rebuild:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY]=user_id
+                c.post(f"/like-it/{Meal.query.get(m[0]).meal_name}",data={"address":"Philadelphia"})
+            self.assertIsNone(recommender.built_at)
+            self.assertEqual(rebuild.call_count,1)
+
+            with app.app_context():
+                recommender.refresh()
+                like_meal(user_id,m[1])
+                db.session.commit()
+                #too old: adjusted now, rebuilt later
+                recommender.built_at-=recommender.max_age
+                recommender.sync_user(user_id)
+                self.assertEqual(rebuild.call_count,2)
+
+                rebuilt=Recommender()
+                rebuilt.build()
+                self.assertTrue(np.array_equal(recommender.counts,rebuilt.counts))
+
+    def test_spin_does_not_rebuild(self):
+        """Recommendations from an old matrix come from it as it is, while it is rebuilt in the background"""
+
+        m=self.meal_ids
+        user_id=self.user_ids[3]
+        with app.app_context():
+            like_meal(user_id,m[0])
+            db.session.commit()
+            expected=recommender.recommend(user_id)
+
+            recommender.built_at-=recommender.max_age
+            built_at=recommender.built_at
+            with patch.object(recommender,"rebuild_in_background") as rebuild:
+                with patch.object(recommender,"build") as build:
+                    self.assertEqual(recommender.recommend(user_id),expected)
+            self.assertEqual(build.call_count,0)
+            self.assertEqual(rebuild.call_count,1)
+            self.assertEqual(recommender.built_at,built_at)
+
+    def test_sync_during_build(self):
+        """A user synced while a build runs is synced again once it is done"""
+
+        m=self.meal_ids
+        user_id=self.user_ids[3]
+        building=Recommender()
+
+        def like_meanwhile(*args):
+            #after the build loaded the favorites
+            like_meal(user_id,m[0])
+            db.session.commit()
+            self.assertIsNone(building.sync_user(user_id))
+            return cooccurrence(*args)
+
+        with app.app_context():
+            with patch.object(recommender_module,"cooccurrence",side_effect=like_meanwhile):
+                building.build()
+
+            rebuilt=Recommender()
+            rebuilt.build()
+            self.assertTrue(np.array_equal(building.counts,rebuilt.counts))
+            self.assertEqual(building.user_meals.keys(),rebuilt.user_meals.keys())
+
+    def test_for_you(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.user_ids[3]
+
+            #no favorites yet, any meal
+            resp=c.get("/for-you")
+            self.assertEqual(resp.status_code,200)
+            self.assertIn('<form action="/for-you" method="get"',resp.get_data(as_text=True))
+
+            meal=Meal.query.get(self.meal_ids[0])
+            c.post(f"/like-it/{meal.meal_name}",data={"address":"Philadelphia"})
+            names=[str(escape(Meal.query.get(meal_id).meal_name)) for meal_id in self.meal_ids[1:]]
+            for i in range(3):
+                html=c.get("/for-you").get_data(as_text=True)
+                self.assertTrue(any(f'<h2 class="display-4">{name}</h2>' in html for name in names))
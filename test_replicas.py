@@ -0,0 +1,145 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    createdb food-roulette-test-replica
+#    FLASK_ENV=production python -m unittest test_replicas.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from csv import DictReader
+
+from sqlalchemy import func
+
+from flask import session
+
+from models import db, Cuisine, Category, Meal, User, MealLiked, RestaurantMealLiked
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from replicas import STICKY_KEY, copy_to_replicas, replica_binds
+from user_cache import user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+REPLICA_URL = "postgresql:///food-roulette-test-replica"
+
+
+class ReplicaTestCase(TestCase):
+    """Test that reads go to the replica and writes, and reads right after them, to the primary."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+        user_cache.clear()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url=None)
+        db.session.commit()
+        self.testuser_id=testuser.id
+
+        self.binds=app.config['SQLALCHEMY_BINDS']
+        app.config['SQLALCHEMY_BINDS']=replica_binds(REPLICA_URL)
+        self.assertEqual(copy_to_replicas(app),1)
+
+        #ids past the csv's, which postgres' sequence doesn't know about
+        self.next_cuisine_id=db.session.query(func.max(Cuisine.cuisine_id)).scalar()+1
+
+        #the replica hasn't caught up with this one yet
+        db.session.add(Cuisine(cuisine_id=self.next_cuisine_id,cuisine_name="Lagging",cuisine_image="image"))
+        db.session.commit()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_BINDS']=self.binds
+
+    def test_replica_binds(self):
+        self.assertEqual(replica_binds(" postgres://a/b, ,postgresql://c/d"),
+                         {"replica_1":"postgresql://a/b","replica_2":"postgresql://c/d"})
+        self.assertEqual(replica_binds(""),{})
+
+    def test_read_your_writes(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            self.assertNotIn("Lagging",c.get("/cuisines").get_data(as_text=True))
+
+            resp=c.post("/users/profile",data={"username":"testuser","email":"test@test.com","password":"testuser",
+                                               "image_url":"","location":"Boston"})
+            self.assertEqual(resp.status_code,302)
+            self.assertIn("Lagging",c.get("/cuisines").get_data(as_text=True))
+
+            with c.session_transaction() as sess:
+                self.assertGreater(sess[STICKY_KEY],time.time())
+                sess[STICKY_KEY]=time.time()-1
+            self.assertNotIn("Lagging",c.get("/cuisines").get_data(as_text=True))
+
+    def test_sticky_only_after_writes(self):
+        """Requests that write nothing, and any request without replicas, don't pin the user to the primary"""
+
+        with self.client as c:
+            resp=c.post("/login",data={"username":"testuser","password":"wrong"})
+            self.assertEqual(resp.status_code,200)
+            with c.session_transaction() as sess:
+                self.assertNotIn(STICKY_KEY,sess)
+
+            app.config['SQLALCHEMY_BINDS']=self.binds
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+            resp=c.post("/users/profile",data={"username":"testuser","email":"test@test.com","password":"testuser",
+                                               "image_url":"","location":"Boston"})
+            self.assertEqual(resp.status_code,302)
+            with c.session_transaction() as sess:
+                self.assertNotIn(STICKY_KEY,sess)
+
+    def test_writes_go_to_the_primary(self):
+        """A GET request that writes does so on the primary, then reads from it"""
+
+        with app.test_request_context("/cuisines"):
+            app.preprocess_request()
+            self.assertIn("replica",db.session().info)
+            self.assertEqual(Cuisine.query.filter_by(cuisine_name="Lagging").count(),0)
+
+            db.session.add(Cuisine(cuisine_id=self.next_cuisine_id+1,cuisine_name="Written",cuisine_image="image"))
+            db.session.commit()
+            self.assertTrue(db.session().info["wrote"])
+            self.assertEqual(Cuisine.query.filter(Cuisine.cuisine_name.in_(["Lagging","Written"])).count(),2)
+
+            app.process_response(app.response_class())
+            self.assertGreater(session[STICKY_KEY],time.time())
+            db.session.remove()
+
+    def test_current_user_from_the_primary(self):
+        """The cached current user is loaded from the primary, so it outlives the stickiness without going stale"""
+
+        newuser=User.signup(username="newuser",email="new@test.com",password="testuser",location='Boston',image_url=None)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=newuser.id
+
+            #the replica doesn't know the user yet
+            resp=c.get("/cuisines")
+            self.assertEqual(resp.status_code,200)
+            self.assertIn('alt="newuser"',resp.get_data(as_text=True))
+        self.assertEqual(user_cache.get(newuser.id)["location"],"Boston")
@@ -0,0 +1,124 @@
+"""Roulette sampler tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_sampler.py
+
+
+import random
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from markupsafe import escape
+
+from models import db, Cuisine, Category, Meal, MealStats
+
+from testing import RouletteTestCase
+from app import prefetch, CURR_USER_KEY
+from favorites import like_meal
+from sampler import AliasTable, Sampler, sampler
+
+
+class AliasTableTestCase(TestCase):
+    """Test Walker's alias method."""
+
+    def test_distribution(self):
+        weights={"a":1,"b":2,"c":3,"d":0,"e":14}
+        table=AliasTable(list(weights),list(weights.values()))
+        rng=random.Random(0)
+        draws=Counter(table.draw(rng) for i in range(100000))
+
+        self.assertNotIn("d",draws)
+        for item,weight in weights.items():
+            self.assertAlmostEqual(draws[item]/100000,weight/20,delta=0.01)
+
+    def test_edges(self):
+        self.assertEqual({AliasTable([7],[5]).draw() for i in range(10)},{7})
+        self.assertEqual(len(AliasTable([1,2],[1,1])),2)
+        with self.assertRaises(ValueError):
+            AliasTable([],[])
+        with self.assertRaises(ValueError):
+            AliasTable([1],[0])
+
+
+class SamplerTestCase(RouletteTestCase):
+    """Test spins that skip favorites."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.testuser_id=self.signup("testuser")
+        self.british_id=Cuisine.query.filter(Cuisine.cuisine_name=="British").one().cuisine_id
+        self.british=[meal_id for (meal_id,) in db.session.query(Meal.id).filter(Meal.cuisine_id==self.british_id).order_by(Meal.id)]
+        self.dessert_id=Category.query.filter(Category.category_name=="Dessert").one().category_id
+
+        self.sampler=Sampler()
+
+    def like(self, meal_ids):
+        for meal_id in meal_ids:
+            like_meal(self.testuser_id,meal_id)
+        db.session.commit()
+
+    def test_skips_favorites(self):
+        """Liked meals are never drawn, without redraws"""
+
+        self.like(self.british[1:])
+        self.sampler.refresh()
+        with patch.object(db.session,"query",wraps=db.session.query) as query:
+            picks={self.sampler.pick(self.testuser_id,"cuisine",self.british_id) for i in range(50)}
+            #the user's favorites and seen meals are loaded once, then every draw is from memory
+            self.assertEqual(query.call_count,2)
+        self.assertEqual(picks,{self.british[0]})
+
+        #other users draw from the whole cuisine
+        self.assertEqual({self.sampler.pick(0,"cuisine",self.british_id) for i in range(3000)},set(self.british))
+
+        #liking everything still shows a meal
+        self.like(self.british[:1])
+        self.sampler.forget_user(self.testuser_id)
+        self.assertIn(self.sampler.pick(self.testuser_id,"cuisine",self.british_id),self.british)
+        self.assertIsNone(self.sampler.pick(self.testuser_id,"cuisine",0))
+
+    def test_popularity(self):
+        """Popular meals come up more often"""
+
+        db.session.add(MealStats(meal_id=self.british[0],liked_by=99))
+        db.session.commit()
+        picks=Counter(self.sampler.pick(0,"cuisine",self.british_id) for i in range(2000))
+        self.assertAlmostEqual(picks[self.british[0]]/2000,100/(100+len(self.british)-1),delta=0.05)
+
+    def test_rebuilds_changed_buckets_only(self):
+        self.sampler.refresh()
+        british=self.sampler.bucket_table(("cuisine",self.british_id,None))[1]
+        desserts=self.sampler.bucket_table(("category",self.dessert_id,None))[1]
+        everything=self.sampler.bucket_table(("surprise",None,None))[1]
+        self.sampler.pick(self.testuser_id,"cuisine",self.british_id)
+
+        other=Meal.query.filter(Meal.cuisine_id!=self.british_id,Meal.category_id!=self.dessert_id).first()
+        db.session.add(MealStats(meal_id=other.id,liked_by=5))
+        db.session.commit()
+        self.sampler.meals_changed([other.id])
+
+        self.assertIs(self.sampler.bucket_table(("cuisine",self.british_id,None))[1],british)
+        self.assertIs(self.sampler.bucket_table(("category",self.dessert_id,None))[1],desserts)
+        rebuilt=self.sampler.bucket_table(("surprise",None,None))[1]
+        self.assertIsNot(rebuilt,everything)
+        self.assertEqual(rebuilt.prob,AliasTable(rebuilt.items,[self.sampler.weight(meal_id) for meal_id in rebuilt.items]).prob)
+
+    def test_roulette_skips_favorites(self):
+        sampler.forget_user(self.testuser_id)
+        prefetch.invalidate(self.testuser_id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            for meal_id in self.british[1:]:
+                c.post(f"/like-it/{Meal.query.get(meal_id).meal_name}",data={"address":"Philadelphia"})
+
+            name=escape(Meal.query.get(self.british[0]).meal_name)
+            for i in range(5):
+                html=c.get(f"/cuisines/{self.british_id}").get_data(as_text=True)
+                self.assertIn(f'<h2 class="display-4">{name}</h2>',html)
+                self.assertIn(">Like it</button>",html)
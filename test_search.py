@@ -0,0 +1,114 @@
+"""Meal search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase, skipUnless
+
+from csv import DictReader
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import ProgrammingError
+
+from models import db, Cuisine, Category, Meal, MissingExtension, create_pg_trgm
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app
+from search import search_meals, build_search_text
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SearchTestCase(TestCase):
+    """Test ranked, paginated meal search."""
+
+    def setUp(self):
+        """Add sample data."""
+
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        with open('generator/cuisines.csv') as cuisines:
+            db.session.bulk_insert_mappings(Cuisine, DictReader(cuisines))
+
+        with open('generator/categories.csv') as categories:
+            db.session.bulk_insert_mappings(Category, DictReader(categories))
+
+        with open('generator/meals.csv') as meals:
+            db.session.bulk_insert_mappings(Meal, DictReader(meals))
+
+        meal=Meal.query.filter(Meal.meal_name=="Rock Cakes").one()
+        meal.search_text=build_search_text(meal.meal_name,"British","Dessert",["Plain Flour","Raisins"])
+        db.session.commit()
+
+    def names(self, q, **kwargs):
+        return [meal.meal_name for meal in search_meals(q,**kwargs).items]
+
+    def test_search_text_default(self):
+        """Meals get their lowercased name until the catalog sync adds the rest"""
+
+        self.assertEqual(Meal.query.filter(Meal.meal_name=="Chicken Handi").one().search_text,"chicken handi")
+
+    def test_ranking(self):
+        """Name matches come first"""
+
+        self.assertEqual(self.names("rock CAKES")[0],"Rock Cakes")
+        self.assertEqual(self.names("  Chicken Handi ")[0],"Chicken Handi")
+
+        names=self.names("chicken",size=100)
+        self.assertIn("Chicken Handi",names)
+        self.assertTrue(all("chicken" in name.lower() for name in names[:5]))
+
+    def test_other_names(self):
+        """Ingredient, cuisine and category names match too"""
+
+        self.assertIn("Rock Cakes",self.names("raisins"))
+        self.assertIn("Rock Cakes",self.names("british raisins"))
+        self.assertEqual(self.names("50%_off"),[])
+
+    def test_pages(self):
+        first=search_meals("",size=10)
+        second=search_meals("",page=2,size=10)
+        self.assertTrue(first.has_next)
+        self.assertEqual(len(first.items),10)
+        self.assertFalse({meal.id for meal in first.items}&{meal.id for meal in second.items})
+
+        last=search_meals("",page=Meal.query.count()//10+1,size=10)
+        self.assertFalse(last.has_next)
+
+    @skipUnless(db.engine.dialect.name=="postgresql","typo tolerance needs pg_trgm")
+    def test_typos(self):
+        self.assertEqual(self.names("chiken handi")[0],"Chicken Handi")
+
+    def test_missing_pg_trgm(self):
+        """A Postgres server without pg_trgm fails with what to install, not a bare database error"""
+
+        class Connection:
+            dialect=postgresql.dialect()
+
+            def execute(self, statement):
+                raise ProgrammingError(str(statement),{},Exception('extension "pg_trgm" is not available'))
+
+        with self.assertRaises(MissingExtension) as raised:
+            create_pg_trgm(Connection())
+        self.assertIn("postgresql-contrib",str(raised.exception))
+        self.assertIn('"pg_trgm" is not available',str(raised.exception))
+
+    def test_list_meals(self):
+        html=self.client.get("/meals?q=chicken").get_data(as_text=True)
+        self.assertIn("Chicken Handi",html)
+        self.assertNotIn('id="previous-page"',html)
+
+        html=self.client.get("/meals?page=2").get_data(as_text=True)
+        self.assertIn('id="previous-page"',html)
+        self.assertIn('id="next-page"',html)
@@ -0,0 +1,104 @@
+"""Seen meal tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_seen.py
+
+
+import time
+
+from sqlalchemy import event
+
+from models import db, Cuisine, Meal, User, SeenMeals
+
+from testing import RouletteTestCase
+from app import app, CURR_USER_KEY
+from seen import SeenSets, seen
+
+
+class SeenSetsTestCase(RouletteTestCase):
+    """Test per-user seen bitsets."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.testuser_id=self.signup("testuser")
+        self.now=0
+        self.seen=SeenSets(window=100,clock=lambda: self.now)
+
+    def test_window(self):
+        """Meals stay seen for one to two windows"""
+
+        self.seen.mark(self.testuser_id,3)
+        self.now=150
+        self.seen.mark(self.testuser_id,5)
+        self.assertEqual(self.seen.bits(self.testuser_id),1<<3|1<<5)
+
+        self.now=250
+        self.assertEqual(self.seen.bits(self.testuser_id),1<<5)
+        self.now=500
+        self.assertEqual(self.seen.bits(self.testuser_id),0)
+
+    def test_forget(self):
+        for meal_id in [1,2,3]:
+            self.seen.mark(self.testuser_id,meal_id)
+        self.now=100
+        self.seen.mark(self.testuser_id,4)
+        self.seen.forget(self.testuser_id,[2,4])
+        self.assertEqual(self.seen.bits(self.testuser_id),1<<1|1<<3)
+
+    def test_flush(self):
+        """Marks are written in one batch and loaded back by other workers"""
+
+        other_id=self.signup("other")
+
+        self.seen.app=app
+        self.seen.max_users=1
+        self.seen.mark(self.testuser_id,2)
+        self.seen.mark(other_id,300)
+        #evicted but not written yet
+        self.assertEqual(self.seen.bits(self.testuser_id),1<<2)
+        self.assertEqual(self.seen.flush(),2)
+        self.assertEqual(self.seen.flush(),0)
+
+        worker=SeenSets(window=100,clock=lambda: self.now)
+        self.assertEqual(worker.bits(self.testuser_id),1<<2)
+        self.assertEqual(worker.bits(other_id),1<<300)
+        self.assertEqual(SeenMeals.query.count(),2)
+
+        #deleted users are skipped
+        self.seen.mark(other_id,7)
+        User.query.filter(User.id==other_id).delete()
+        db.session.commit()
+        self.assertEqual(self.seen.flush(),1)
+
+    def test_spins_dont_repeat(self):
+        """Spins go through the whole cuisine before repeating, without writing to the database"""
+
+        thai_id=Cuisine.query.filter(Cuisine.cuisine_name=="Thai").one().cuisine_id
+        thai=Meal.query.filter(Meal.cuisine_id==thai_id).all()
+
+        writes=[]
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if "seen_meals" in statement and not statement.startswith("SELECT"):
+                writes.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            event.listen(db.engine,"before_cursor_execute",record)
+            try:
+                shown=[]
+                for meal in thai:
+                    html=c.get(f"/cuisines/{thai_id}").get_data(as_text=True)
+                    shown+=[meal.id for meal in thai if f'<h2 class="display-4">{meal.meal_name}</h2>' in html]
+                    time.sleep(0.05)
+            finally:
+                event.remove(db.engine,"before_cursor_execute",record)
+
+        self.assertEqual(sorted(shown),sorted(meal.id for meal in thai))
+        self.assertEqual(writes,[])
+        #written by the flusher instead
+        self.assertTrue(self.testuser_id in seen.dirty or SeenMeals.query.get(self.testuser_id))
@@ -0,0 +1,177 @@
+"""SQL statement budget tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_sql_budget.py
+
+
+import json
+
+from flask import Response
+
+from models import db, Message, Meal, MealLiked, Restaurant, Like
+
+from testing import RouletteTestCase
+from app import app, CURR_USER_KEY
+from favorites import like_meal, like_restaurant, set_meals_active, set_restaurants_active
+from recommender import recommender
+from sql_budget import REPEAT_LIMIT, SQLBudgetExceeded, shape
+
+#more rows than REPEAT_LIMIT, so a statement per row shows up as a repeated shape
+ROWS = REPEAT_LIMIT+5
+
+
+class SQLBudgetTestCase(RouletteTestCase):
+    """Test that every view stays within its statement budget and runs no statement per row."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user_id,self.other_id=self.signup("user0"),self.signup("user1")
+
+        #both users like ROWS meals, each at its own restaurant, and review each of them; the user likes every review
+        self.meal_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).order_by(Meal.id).limit(ROWS)]
+        for i,meal_id in enumerate(self.meal_ids):
+            Restaurant.save(f"yelp_{i}",f"Restaurant {i}",'address',4.5,'https://www.yelp.com/biz/restaurant',None)
+        for user_id in (self.user_id,self.other_id):
+            for i,meal_id in enumerate(self.meal_ids):
+                like_meal(user_id,meal_id)
+                meals_liked_id=MealLiked.query.filter_by(user_id=user_id,meal_id=meal_id).one().id
+                like_restaurant(user_id,meals_liked_id,f"yelp_{i}")
+                db.session.add(Message(user_id=user_id,text=f"review {i}",meals_liked_id=meals_liked_id,restaurant_info=f"yelp_{i}"))
+        db.session.commit()
+        for message in Message.query.filter(Message.user_id==self.other_id):
+            Like.toggle(self.user_id,message.id)
+        db.session.commit()
+
+    def tearDown(self):
+        app.config.pop('SQL_BUDGET_STRICT', None)
+        db.session.rollback()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY]=self.user_id
+
+    def test_every_view_has_a_budget(self):
+        for endpoint,view in app.view_functions.items():
+            if endpoint == "static" or endpoint.startswith("_debug_toolbar"):
+                continue
+            self.assertTrue(hasattr(view,"sql_budget"),f"{endpoint} declares no SQL budget")
+
+    def test_shape(self):
+        self.assertEqual(shape("SELECT meals.id FROM meals WHERE meals.id = %(id_1)s"),
+                         shape("SELECT meals.id FROM meals WHERE meals.id = ?"))
+        self.assertEqual(shape("SELECT * FROM meals_1 WHERE id IN (?, ?, ?) AND name = 'x'"),
+                         "SELECT * FROM meals_1 WHERE id IN (?) AND name = ?")
+        self.assertNotEqual(shape("SELECT id FROM meals"),shape("SELECT id FROM users"))
+
+    def test_pages(self):
+        """Every page of a user with many favorites and reviews, within budget and without repeated statements"""
+
+        meal_id=self.meal_ids[0]
+        yelp_id="yelp_0"
+        cuisine_id=Meal.query.get(meal_id).cuisine_id
+        category_id=Meal.query.get(meal_id).category_id
+        message_id=Message.query.filter(Message.user_id==self.other_id).first().id
+
+        urls=["/","/meals","/meals?q=chicken","/meals/autocomplete?q=ch",f"/meals/{meal_id}",f"/meals/{meal_id}/reviews",
+              "/cuisines",f"/cuisines/{cuisine_id}","/categories",f"/categories/{category_id}","/surprise-me","/for-you",
+              "/messages/new",f"/restaurants/{meal_id}","/users/profile"]
+        for user_id in (self.user_id,self.other_id):
+            urls+=[f"/users/{user_id}",f"/users/{user_id}/messages",f"/users/{user_id}/liked-food",
+                   f"/users/{user_id}/liked-food/{meal_id}",f"/users/{user_id}/liked-restaurants",
+                   f"/users/{user_id}/liked-restaurants/{yelp_id}",f"/users/{user_id}/liked-messages"]
+
+        with self.client as c:
+            self.login(c)
+            for url in urls:
+                #strict while testing: a view over budget raises SQLBudgetExceeded here
+                resp=c.get(url)
+                self.assertIn(resp.status_code,(200,302),url)
+                self.assertIn("X-SQL-Statements",resp.headers)
+
+            c.post("/users/add_like/"+str(message_id),headers={"Referer":"/"})
+            c.post(f"/meals-liked/remove-it/{meal_id}",headers={"Referer":"/"})
+            c.post("/favorites/batch",json={"meals":{"add":self.meal_ids,"remove":[],"restore":[]}})
+            c.post(f"/restaurant/{yelp_id}/unlink-restaurant-meal/{MealLiked.query.filter_by(user_id=self.user_id,meal_id=meal_id).one().id}",
+                   headers={"Referer":"/"})
+            c.post(f"/restaurant/remove-it/{yelp_id}",headers={"Referer":"/"})
+            c.post("/messages/new",data={"text":"new review","meal":meal_id,"restaurant":""})
+
+    def test_batch_every_action(self):
+        """A batch with every meal and restaurant action, over many rows each, within budget and without repeated statements"""
+
+        liked_ids=dict(db.session.query(MealLiked.meal_id,MealLiked.id).filter(MealLiked.user_id==self.user_id))
+        new_ids=[meal_id for (meal_id,) in db.session.query(Meal.id).filter(Meal.id.notin_(self.meal_ids)).order_by(Meal.id).limit(ROWS)]
+        #the second half of the meals and the first half of the restaurants are soft deleted; adding them restores them too
+        half=ROWS//2
+        set_meals_active(self.user_id,self.meal_ids[half:],False)
+        set_restaurants_active(self.user_id,[{"yelp_id":f"yelp_{i}"} for i in range(half)],False)
+        db.session.commit()
+
+        batch={"meals":{"add":new_ids+self.meal_ids[half+1:],"remove":self.meal_ids[:half],"restore":self.meal_ids[half:half+1]},
+               "restaurants":{"add":[{"yelp_id":f"new_{i}","meals_liked_id":liked_ids[meal_id],"name":f"New {i}",
+                                      "address":"address","rating":4,"url":"https://www.yelp.com/biz/restaurant"}
+                                     for i,meal_id in enumerate(self.meal_ids)]
+                                    +[{"yelp_id":f"yelp_{i}","meals_liked_id":liked_ids[self.meal_ids[i]]} for i in range(1,half)],
+                              "remove":[{"yelp_id":f"yelp_{i}","meals_liked_id":liked_ids[meal_id]}
+                                        for i,meal_id in enumerate(self.meal_ids) if i>=half],
+                              "restore":[{"yelp_id":"yelp_0"}]}}
+        #a built recommender syncs the user too
+        recommender.refresh()
+        with self.client as c:
+            self.login(c)
+            resp=c.post("/favorites/batch",json=batch)
+
+        self.assertEqual(resp.status_code,200)
+        self.assertEqual(resp.get_json(),{"meals":{"add":ROWS+ROWS-half-1,"remove":half,"restore":1},
+                                          "restaurants":{"add":ROWS+half-1,"remove":ROWS-half,"restore":1}})
+        self.assertLessEqual(int(resp.headers["X-SQL-Statements"]),app.view_functions["batch_favorites"].sql_budget)
+
+    def test_headers_and_log(self):
+        with self.client as c:
+            self.login(c)
+            with self.assertLogs("sql_budget","INFO") as logs:
+                resp=c.get("/")
+
+        statements=int(resp.headers["X-SQL-Statements"])
+        self.assertGreater(statements,0)
+        self.assertGreaterEqual(float(resp.headers["X-SQL-Time-Ms"]),0)
+        self.assertIn(f'desc="{statements} statements"',resp.headers["Server-Timing"])
+
+        record=json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record["endpoint"],record["method"],record["status"]),("homepage","GET",200))
+        self.assertEqual(record["statements"],statements)
+        self.assertFalse(record["over_budget"])
+        self.assertEqual(record["repeated"],[])
+
+    def test_over_budget(self):
+        view=app.view_functions["homepage"]
+        allowed=view.sql_budget
+        view.sql_budget=0
+        try:
+            with self.client as c:
+                self.login(c)
+                with self.assertRaises(SQLBudgetExceeded):
+                    c.get("/")
+
+                #outside tests it only logs a warning
+                app.config['SQL_BUDGET_STRICT']=False
+                with self.assertLogs("sql_budget","WARNING") as logs:
+                    resp=c.get("/")
+                self.assertEqual(resp.status_code,200)
+                self.assertTrue(json.loads(logs.records[-1].getMessage())["over_budget"])
+        finally:
+            view.sql_budget=allowed
+
+    def test_lazy_load_per_row_is_caught(self):
+        """The pattern show_liked_meals had: the meal of each favorite loaded on its own"""
+
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            db.session.expire_all()
+            meals=[liked.meal for liked in MealLiked.query.filter(MealLiked.user_id==self.user_id)]
+            self.assertEqual(len(meals),ROWS)
+            with self.assertRaises(SQLBudgetExceeded) as raised:
+                app.process_response(Response())
+        self.assertIn(f"{ROWS} x SELECT",str(raised.exception))
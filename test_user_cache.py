@@ -0,0 +1,152 @@
+"""Lazy current user tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_user_cache.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, CURR_USER_KEY
+from user_cache import CurrentUser, UserCache, UserGone, user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserCacheTestCase(TestCase):
+    """Test g.user loading."""
+
+    def setUp(self):
+        User.query.delete()
+        user_cache.clear()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               location='Philadelphia',
+                               image_url="/static/images/default-pic.png")
+        db.session.commit()
+
+        self.testuser_id=testuser.id
+
+    def user_queries(self, url, method="get", **kwargs):
+        """Response to a logged in request and the statements it ran on the users table"""
+
+        statements=[]
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if "FROM users" in statement:
+                statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY]=self.testuser_id
+
+            event.listen(db.engine,"before_cursor_execute",record)
+            try:
+                resp=getattr(c,method)(url,**kwargs)
+            finally:
+                event.remove(db.engine,"before_cursor_execute",record)
+
+        return resp,statements
+
+    def test_cached(self):
+        """The navbar user is loaded once per TTL, not per request"""
+
+        resp,statements=self.user_queries("/meals?q=rock")
+        self.assertIn('alt="testuser"',resp.get_data(as_text=True))
+        self.assertEqual(len(statements),1)
+
+        resp,statements=self.user_queries("/meals?q=rock")
+        self.assertIn('alt="testuser"',resp.get_data(as_text=True))
+        self.assertEqual(statements,[])
+
+    def test_expiry(self):
+        cache=UserCache(ttl=0)
+        with app.app_context():
+            self.assertEqual(cache.get(self.testuser_id)["username"],"testuser")
+            User.query.get(self.testuser_id).username="renamed"
+            db.session.commit()
+            self.assertEqual(cache.get(self.testuser_id)["username"],"renamed")
+
+    def test_bounded(self):
+        """Only the most recently seen users are kept"""
+
+        cache=UserCache(max_users=2)
+        with app.app_context():
+            cache.get(self.testuser_id)
+            cache.put(-1,None)
+            cache.get(self.testuser_id)
+            cache.put(-2,None)
+        self.assertEqual(list(cache.entries),[self.testuser_id,-2])
+
+    def test_lazy(self):
+        """The id never loads the user, other attributes load it once"""
+
+        with app.app_context():
+            user=CurrentUser(self.testuser_id)
+            with patch.object(User,"query") as query:
+                self.assertEqual(user.id,self.testuser_id)
+                query.get.assert_not_called()
+
+            self.assertNotIn("password",user_cache.get(self.testuser_id))
+            self.assertTrue(user.password.startswith("$2b$"))
+            self.assertIs(user.instance,user.instance)
+            self.assertEqual(user.meals_liked_list,[])
+
+            self.assertFalse(CurrentUser(0))
+
+    def test_update_profile_invalidates(self):
+        self.user_queries("/meals?q=rock")
+
+        resp,statements=self.user_queries("/users/profile",method="post",
+                                          data={"username":"newname","email":"test@test.com","password":"testuser",
+                                                "image_url":"/static/images/new-pic.png","location":"Boston"})
+        self.assertEqual(resp.status_code,302)
+
+        resp,statements=self.user_queries("/meals?q=rock")
+        self.assertIn('src="/static/images/new-pic.png" alt="newname"',resp.get_data(as_text=True))
+
+    def test_delete_user_invalidates(self):
+        self.user_queries("/meals?q=rock")
+        self.user_queries("/users/delete",method="post")
+
+        self.assertIsNone(user_cache.get(self.testuser_id))
+        resp,statements=self.user_queries("/meals?q=rock")
+        self.assertIn("/signup",resp.get_data(as_text=True))
+
+    def test_deleted_by_another_worker(self):
+        """A user deleted behind the cache's back is logged out, not a 500"""
+
+        self.user_queries("/meals?q=rock")
+        User.query.filter(User.id==self.testuser_id).delete()
+        db.session.commit()
+
+        #the cached row says logged in until the view loads the user's favorites
+        resp,statements=self.user_queries("/messages/new")
+        self.assertEqual(resp.status_code,302)
+        self.assertEqual(resp.location,"http://localhost/")
+        self.assertNotIn(self.testuser_id,user_cache.entries)
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY,sess)
+
+        with app.app_context():
+            user=CurrentUser(self.testuser_id)
+            user_cache.put(self.testuser_id,{"id":self.testuser_id})
+            self.assertTrue(user)
+            with self.assertRaises(UserGone):
+                user.meals_liked
+            self.assertFalse(user)
@@ -11,7 +11,7 @@ from unittest import TestCase
 from csv import DictReader
 
 
-from models import db, connect_db,Cuisine, Category,Message,Meal,User,MealLiked,RestaurantMealLiked,Like
+from models import db, connect_db,Cuisine, Category,Message,Meal,User,MealLiked,Restaurant,RestaurantMealLiked,Like
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -45,6 +45,7 @@ class UserViewTestCase(TestCase):
         User.query.delete()
         MealLiked.query.delete()
         RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
         Cuisine.query.delete()
         Meal.query.delete()
         Category.query.delete()
@@ -81,15 +82,10 @@ class UserViewTestCase(TestCase):
         db.session.add(meal_liked)
         db.session.commit()
 
-        restaurant_meal=RestaurantMealLiked(restaurant_name='Amazing restaurant LLC',
-                                                    restaurant_yelp_id='yelp_id',
-                                                    meals_liked_id=meal_liked.id,
-                                                    restaurant_address='address',
-                                                    restaurant_rating=4.6,
-                                                    restaurant_url='restaurant_url',
-                                                    restaurant_photo='photo',
-                                                    user_id=self.new_user.id
-                )
+        Restaurant.save('yelp_id','Amazing restaurant LLC','address',4.6,'https://www.yelp.com/biz/restaurant','photo')
+        restaurant_meal=RestaurantMealLiked(restaurant_yelp_id='yelp_id',
+                                            meals_liked_id=meal_liked.id,
+                                            user_id=self.new_user.id)
 
         db.session.add(restaurant_meal)
         db.session.commit()
@@ -221,6 +217,21 @@ class UserViewTestCase(TestCase):
             self.assertIn("Amazing restaurant LLC", html)
             self.assertEqual(resp.status_code, 200)
 
+    def test_cache_stats(self):
+        """API cache counters are only served when enabled"""
+
+        with self.client as c:
+            resp=c.get("/cache-stats")
+            self.assertEqual(resp.status_code,404)
+
+            app.config['CACHE_STATS']=True
+            try:
+                resp=c.get("/cache-stats")
+            finally:
+                app.config['CACHE_STATS']=False
+            self.assertEqual(resp.status_code,200)
+            self.assertIn("hit_ratio",resp.json)
+
     def test_remove_restaurants(self):
         """Test remove restaurant"""
 
@@ -0,0 +1,80 @@
+"""Shared setup of the roulette tests.
+
+RouletteTestCase starts every test from the meals of the generator CSVs,
+without users, and with none of the in-memory state (meal index, sampler,
+seen sets, prefetch buffers, recommender, user cache) an earlier test left
+in the app's singletons.
+"""
+
+import os
+from unittest import TestCase
+
+from csv import DictReader
+
+from models import db, Cuisine, Category, Meal, User, MealLiked, Restaurant, RestaurantMealLiked
+
+os.environ['DATABASE_URL'] = "postgresql:///food-roulette-test"
+
+from app import app, prefetch
+from meal_index import meal_index
+from recommender import recommender
+from sampler import sampler
+from seen import seen
+from user_cache import user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def seed_catalog():
+    """Add the cuisines, categories and meals of the generator CSVs, uncommitted."""
+
+    for model, filename in ((Cuisine, 'generator/cuisines.csv'), (Category, 'generator/categories.csv'),
+                            (Meal, 'generator/meals.csv')):
+        with open(filename) as rows:
+            db.session.bulk_insert_mappings(model, DictReader(rows))
+
+
+def reset_app_state():
+    """Reset the app's singletons, which outlive a test."""
+
+    #first, a rebuild started by the last test would load its favorites after the others reset
+    recommender.reset()
+    meal_index.reset()
+    sampler.reset()
+    seen.reset()
+    prefetch.reset()
+    user_cache.clear()
+
+
+class RouletteTestCase(TestCase):
+    """Seeded catalog, no users, fresh app state."""
+
+    def setUp(self):
+        User.query.delete()
+        MealLiked.query.delete()
+        RestaurantMealLiked.query.delete()
+        Restaurant.query.delete()
+        Cuisine.query.delete()
+        Meal.query.delete()
+        Category.query.delete()
+
+        seed_catalog()
+        db.session.commit()
+
+        self.client = app.test_client()
+        app.config['TESTING'] = True
+
+        reset_app_state()
+
+    def signup(self, username):
+        """Id of a new user named username, committed."""
+
+        user = User.signup(username=username,
+                           email=f"{username}@test.com",
+                           password="testuser",
+                           location='Philadelphia',
+                           image_url=None)
+        db.session.commit()
+        return user.id
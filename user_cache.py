@@ -0,0 +1,116 @@
+"""Lazy current user for g.user, backed by a per-worker cache.
+
+g.user is a CurrentUser that knows the logged in user's id from the session.
+Reading g.user.id never touches the database. Truth tests and column
+attributes (username, image_url, location, ...) are served from a cache of
+the users' column values that entries expire from after
+USER_CACHE_TTL_SECONDS, so most requests skip the users query entirely.
+Anything else (relationships, methods) loads the User row into the request's
+session and delegates to it.
+
+Each worker has its own cache of the USER_CACHE_MAX_USERS most recently
+seen users. Views that change or delete a user invalidate it, other workers
+see the change within the TTL, or as soon as they load the row and find it
+gone: the entry is evicted, g.user turns false and accessing anything else
+on it raises UserGone.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from models import db, User
+
+
+TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 30))
+#users of the least recently seen ids are dropped beyond this
+MAX_USERS = int(os.environ.get('USER_CACHE_MAX_USERS', 10000))
+#the password hash stays out of the cache, User.authenticate reads the row
+CACHED_COLUMNS = [column.key for column in User.__table__.columns if column.key != "password"]
+
+
+class UserCache:
+    """user id -> column values of the user, None for ids without a user."""
+
+    def __init__(self, ttl=TTL_SECONDS, max_users=MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        """Column values of a user, loaded on a miss. Needs an app context."""
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and time.time() < entry[0]:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+
+        #from the primary even on requests routed to a replica (see replicas.py): the entry
+        #outlives the replica stickiness, a lagging replica would keep a stale or missing user
+        users = User.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select([users.c[key] for key in CACHED_COLUMNS]).where(users.c.id == user_id)).first()
+        values = dict(zip(CACHED_COLUMNS, row)) if row else None
+        self.put(user_id, values)
+        return values
+
+    def put(self, user_id, values):
+        with self.lock:
+            self.entries[user_id] = (time.time()+self.ttl, values)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+class UserGone(LookupError):
+    """The logged in user was deleted, by a request another worker served."""
+
+
+class CurrentUser:
+    """Stand-in for the logged in User, loading as little as each access needs."""
+
+    def __init__(self, user_id, cache=user_cache):
+        self.__dict__.update(id=user_id, _cache=cache, _user=None, _gone=False)
+
+    def __bool__(self):
+        #false for a session that outlived its user, like a missing g.user was
+        return not self._gone and self._cache.get(self.id) is not None
+
+    def __getattr__(self, name):
+        values = self._cache.get(self.id)
+        if values is not None and name in values:
+            return values[name]
+        return getattr(self.instance, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}>"
+
+    @property
+    def instance(self):
+        """The User row in this request's session."""
+
+        if self._user is None and not self._gone:
+            self.__dict__["_user"] = User.query.get(self.id)
+            if self._user is None:
+                #the cache still had it, drop it so later requests are logged out too
+                self._cache.invalidate(self.id)
+                self.__dict__["_gone"] = True
+        if self._gone:
+            raise UserGone(self.id)
+        return self._user
@@ -0,0 +1,34 @@
+"""Yelp restaurant search, cached per (location bucket, term)."""
+
+from flask import current_app
+
+from api_client import api
+from locations import gazetteer
+from secrets import api_key
+
+
+headers = {'Authorization': 'Bearer %s' % api_key}
+
+# In the dictionary, term can take values like food, cafes or businesses like McDonalds
+# params = {'term':'seafood','location':'New York City'}
+
+
+def search_restaurants(term,address):
+    """Yelp businesses/search response for term near address.
+
+    Addresses that resolve to the same gazetteer bucket share one cache entry and
+    are searched around the bucket center, so "NYC" and "new york, ny" return the
+    same restaurants from the same cached response.
+    """
+
+    location=gazetteer.resolve(address)
+    term=" ".join(term.lower().split())
+
+    if location.latitude is not None:
+        params={"latitude":location.latitude,"longitude":location.longitude,"term":term}
+    else:
+        params={"location":location.name,"term":term}
+
+    #the app config picks the real API or the local stand-in
+    yelp_url=current_app.config['YELP_URL']
+    return api.get_json(yelp_url,headers=headers,params=params,key=f"yelp:{yelp_url}:{location.key}:{term}")